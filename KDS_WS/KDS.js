@@ -96,7 +96,10 @@ configSubmit.onclick = () => {
 
       // ✅ Re-send KDS name to server after login
       if (ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify({ action: "init_kds", kds_name: kdsName }));
+        snapshotVersion = null;
+        ws.send(
+          JSON.stringify({ action: "init_kds", kds_name: kdsName, protocol: "delta" })
+        );
       }
     }
 
@@ -162,6 +165,90 @@ document.getElementById("sort-table").classList.remove("active");
 document.getElementById("sort-time").classList.add("active");
 document.getElementById("sort-time").textContent = "Time⬇";
 
+// ==================== Delta Protocol ====================
+// Server sends a full "snapshot" on init/resync, then "delta" messages that
+// only carry added/removed/changed tickets and items.
+let snapshotVersion = null;
+let serverTickets = [];
+let serverSummary = [];
+
+// Open KDS.html?trace to report each rendered version back for latency tracing
+const traceAck = new URLSearchParams(window.location.search).has("trace");
+
+// Must match item_keys() in snapshot_cache.py: i_code, plus #n for repeats in one KOT
+function itemKeys(items) {
+  const seen = {};
+  return items.map((it) => {
+    const code = String(it.i_code ?? "");
+    seen[code] = (seen[code] || 0) + 1;
+    return seen[code] === 1 ? code : `${code}#${seen[code]}`;
+  });
+}
+
+function applyDelta(list, delta) {
+  const byKot = new Map(list.map((t) => [String(t.kot_no), t]));
+  (delta.removed || []).forEach((kot) => byKot.delete(String(kot)));
+  (delta.added || []).forEach((t) => byKot.set(String(t.kot_no), t));
+  (delta.changed || []).forEach((c) => {
+    const prev = byKot.get(String(c.kot_no));
+    if (!prev) return;
+    // Copy on write: ticket objects already handed out are never modified
+    const t = { ...prev, ...(c.fields || {}) };
+    byKot.set(String(c.kot_no), t);
+    if (c.items) {
+      t.items = c.items; // reordered: server sent the whole list
+      return;
+    }
+    const keys = itemKeys(t.items);
+    const byKey = new Map(keys.map((k, i) => [k, t.items[i]]));
+    (c.items_removed || []).forEach((k) => byKey.delete(k));
+    (c.items_changed || []).forEach(([k, it]) => byKey.set(k, it));
+    const items = [...byKey.values()];
+    // Added items come with their final index, in ascending order
+    (c.items_added || []).forEach(([k, it, idx]) => items.splice(idx, 0, it));
+    t.items = items;
+  });
+  return [...byKot.values()];
+}
+
+// Taps shown before the server confirms them: "kot_no|i_code" -> {ack_status, at}.
+// serverTickets stays exactly as the server sent it (later deltas are applied to
+// it); the edits are laid over a copy, and each one is dropped once the server
+// shows the same value or after LOCAL_EDIT_TTL ms (the write was rolled back).
+const localEdits = new Map();
+const LOCAL_EDIT_TTL = 5000;
+
+function setLocalAck(kot_no, i_code, ack_status) {
+  localEdits.set(`${kot_no}|${i_code}`, { ack_status, at: Date.now() });
+}
+
+function withLocalEdits(list) {
+  if (localEdits.size === 0) return list;
+  const now = Date.now();
+  return list.map((t) => {
+    let changed = false;
+    const items = t.items.map((it) => {
+      const key = `${t.kot_no}|${it.i_code}`;
+      const edit = localEdits.get(key);
+      if (!edit) return it;
+      if (Number(it.ack_status) === edit.ack_status || now - edit.at > LOCAL_EDIT_TTL) {
+        localEdits.delete(key);
+        return it;
+      }
+      changed = true;
+      return { ...it, ack_status: edit.ack_status };
+    });
+    return changed ? { ...t, items } : t;
+  });
+}
+
+function refreshView() {
+  tickets = withLocalEdits(serverTickets).filter(
+    (t) => t.kds_name === kdsName || !t.kds_name
+  );
+  return tickets;
+}
+
 // ==================== WebSocket Message Handler ====================
 let ws; // global WebSocket reference
 
@@ -172,7 +259,10 @@ function connectKDS() {
   ws.onopen = () => {
     console.log("✅ WebSocket connected");
     kdsName = localStorage.getItem("kds_name") || "NONE";
-    ws.send(JSON.stringify({ action: "init_kds", kds_name: kdsName }));
+    snapshotVersion = null;
+    ws.send(
+      JSON.stringify({ action: "init_kds", kds_name: kdsName, protocol: "delta" })
+    );
 
     if (currentKdsSidebarEl) {
       currentKdsSidebarEl.textContent = `KDS Name: ${kdsName}`;
@@ -181,13 +271,25 @@ function connectKDS() {
 
   ws.onmessage = (msg) => {
     const data = JSON.parse(msg.data);
-    const ticketsData = (data.tickets || []).filter(
-      (t) => t.kds_name === kdsName || !t.kds_name
-    );
-    tickets = ticketsData;
+    if (data.type === "delta") {
+      // Missed a version: ask for a full snapshot instead of applying on a stale base
+      if (data.from !== snapshotVersion) {
+        snapshotVersion = null;
+        ws.send(JSON.stringify({ action: "resync" }));
+        return;
+      }
+      serverTickets = applyDelta(serverTickets, data);
+      if (data.summary) serverSummary = data.summary;
+    } else {
+      serverTickets = data.tickets || [];
+      serverSummary = data.summary || [];
+    }
+    snapshotVersion = data.version ?? null;
+
+    const ticketsData = refreshView();
     renderTickets();
 
-    const summaryData = data.summary || [];
+    const summaryData = serverSummary;
     if (foodSummaryEl) {
       foodSummaryEl.innerHTML = summaryData
         .map(
@@ -204,6 +306,13 @@ function connectKDS() {
     const newTickets = ticketsData.filter((t) => !lastTicketIds.has(t.kot_no));
     if (newTickets.length > 0) sound.play().catch(() => {});
     lastTicketIds = currentIds;
+
+    if (traceAck && snapshotVersion !== null) {
+      const rendered = snapshotVersion;
+      requestAnimationFrame(() =>
+        ws.send(JSON.stringify({ action: "rendered", version: rendered }))
+      );
+    }
   };
 
   ws.onerror = (err) => {
@@ -387,7 +496,9 @@ function renderTickets() {
           if (!item) return;
 
           const wasAlreadyAcked = Number(item.ack_status) === 1;
-          item.ack_status = 1; // mark as acknowledged
+          // USP_Accept_kds toggles ack_status; show what it will do
+          setLocalAck(tkt.kot_no, item.i_code, wasAlreadyAcked ? 0 : 1);
+          refreshView();
           ticketEl.classList.add("ticket-acked");
 
           ws.send(
@@ -414,7 +525,10 @@ function renderTickets() {
           const allAlreadyAcked = tkt.items.every(
             (it) => Number(it.ack_status) === 1
           );
-          tkt.items.forEach((it) => (it.ack_status = 1));
+          tkt.items.forEach((it) =>
+            setLocalAck(tkt.kot_no, it.i_code, Number(it.ack_status) === 1 ? 0 : 1)
+          );
+          refreshView();
 
           ws.send(
             JSON.stringify({
@@ -500,8 +614,8 @@ function toggleItem(kot_no, bill_no, i_code, e) {
   }
 
   // Toggle only this item
-  item.ack_status = Number(item.ack_status) === 1 ? 0 : 1;
-
+  setLocalAck(kot_no, i_code, Number(item.ack_status) === 1 ? 0 : 1);
+  refreshView();
   renderTickets();
 
   ws.send(JSON.stringify({ action: "toggle_item", kot_no, bill_no, i_code }));
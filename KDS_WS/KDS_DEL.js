@@ -185,6 +185,47 @@ updateClock();
 // ==================== 4. WebSocket Setup ====================
 let ws; // global reference
 
+// Delta protocol: full "snapshot" on init/resync, then "delta" messages with
+// only the added/removed/changed tickets and items.
+let snapshotVersion = null;
+let serverTickets = [];
+
+// Must match item_keys() in snapshot_cache.py: i_code, plus #n for repeats in one KOT
+function itemKeys(items) {
+  const seen = {};
+  return items.map((it) => {
+    const code = String(it.i_code ?? "");
+    seen[code] = (seen[code] || 0) + 1;
+    return seen[code] === 1 ? code : `${code}#${seen[code]}`;
+  });
+}
+
+function applyDelta(list, delta) {
+  const byKot = new Map(list.map((t) => [String(t.kot_no), t]));
+  (delta.removed || []).forEach((kot) => byKot.delete(String(kot)));
+  (delta.added || []).forEach((t) => byKot.set(String(t.kot_no), t));
+  (delta.changed || []).forEach((c) => {
+    const prev = byKot.get(String(c.kot_no));
+    if (!prev) return;
+    // Copy on write: ticket objects already handed out are never modified
+    const t = { ...prev, ...(c.fields || {}) };
+    byKot.set(String(c.kot_no), t);
+    if (c.items) {
+      t.items = c.items; // reordered: server sent the whole list
+      return;
+    }
+    const keys = itemKeys(t.items);
+    const byKey = new Map(keys.map((k, i) => [k, t.items[i]]));
+    (c.items_removed || []).forEach((k) => byKey.delete(k));
+    (c.items_changed || []).forEach(([k, it]) => byKey.set(k, it));
+    const items = [...byKey.values()];
+    // Added items come with their final index, in ascending order
+    (c.items_added || []).forEach(([k, it, idx]) => items.splice(idx, 0, it));
+    t.items = items;
+  });
+  return [...byKot.values()];
+}
+
 function connectKDSDel() {
   const wsHost = window.location.hostname;
   ws = new WebSocket(`ws://${wsHost}:9998`);
@@ -192,7 +233,10 @@ function connectKDSDel() {
   ws.onopen = () => {
     console.log("✅ WebSocket connected");
     kdsName = localStorage.getItem("kds_name") || "NONE";
-    ws.send(JSON.stringify({ action: "init_kds", kds_name: kdsName }));
+    snapshotVersion = null;
+    ws.send(
+      JSON.stringify({ action: "init_kds", kds_name: kdsName, protocol: "delta" })
+    );
 
     if (currentKdsSidebarEl) {
       currentKdsSidebarEl.textContent = `KDS Name: ${kdsName}`;
@@ -202,8 +246,20 @@ function connectKDSDel() {
   ws.onmessage = (event) => {
     const data = JSON.parse(event.data);
 
-    if (data.tickets) {
-      renderTickets(data.tickets);
+    if (data.type === "delta") {
+      // Missed a version: ask for a full snapshot instead of applying on a stale base
+      if (data.from !== snapshotVersion) {
+        snapshotVersion = null;
+        ws.send(JSON.stringify({ action: "resync" }));
+        return;
+      }
+      serverTickets = applyDelta(serverTickets, data);
+      snapshotVersion = data.version;
+      renderTickets(serverTickets);
+    } else if (data.tickets) {
+      serverTickets = data.tickets;
+      snapshotVersion = data.version ?? null;
+      renderTickets(serverTickets);
     }
 
     // Handle server-directed printing
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# Server modules are flat files in KDS_WS/ and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    """server.py on a throwaway SQLite file; the config it was imported with is restored after the module."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(config, "DATA_SOURCE", "sqlite")
+        mp.setattr(config, "SQLITE_PATH", str(tmp_path_factory.mktemp("kds") / "kds.db"))
+        mp.setattr(config, "TRACING", False)
+        import server
+        yield server
@@ -0,0 +1,386 @@
+"""Dinner-rush load generator and end-to-end latency benchmark for server.py.
+
+Starts the server against a local SQLite data source (DATA_SOURCE = "sqlite"),
+connects simulated KDS (9999), KDS_DEL, CDS and Recall (9998) screens, inserts
+KOTs the way the POS does and taps / bumps them like the kitchen. Measures
+
+    trigger_to_<screen>   KOT row committed -> screen first shows the KOT
+    tap_to_screen         toggle_item sent -> tapping screen shows ack_status 1
+    bump_to_screen        toggle_ticket sent -> KDS_DEL screen shows it delivered
+
+and writes p50 / p95 / p99 (ms) plus message counts to a JSON report.
+
+    python Test/load_bench.py --stations 4 --kds 8 --del 4 --cds 2 --recall 2 \\
+        --kot-rate 2 --tap-rate 6 --bump-rate 1 --duration 60 --report bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+KDS_WS = os.path.dirname(HERE)
+sys.path.insert(0, KDS_WS)
+
+import config
+from snapshot_cache import item_keys
+
+
+# ------------------- Statistics -------------------
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples):
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]),
+        "mean_ms": ms(sum(values) / len(values)),
+    }
+
+
+# ------------------- Screen State -------------------
+def apply_delta(tickets, delta):
+    """Apply a server delta to {kot_no: ticket}, the same way KDS.js does."""
+    for ticket in delta.get("added", []):
+        tickets[ticket["kot_no"]] = ticket
+    for kot_no in delta.get("removed", []):
+        tickets.pop(kot_no, None)
+    for change in delta.get("changed", []):
+        old = tickets.get(change["kot_no"])
+        if old is None:
+            continue
+        ticket = {**old, **change.get("fields", {})}
+        if "items" in change:
+            ticket["items"] = change["items"]
+        else:
+            removed = set(change.get("items_removed", []))
+            replaced = dict(change.get("items_changed", []))
+            keyed = [(k, replaced.get(k, it)) for k, it in zip(item_keys(old["items"]), old["items"])
+                     if k not in removed]
+            for key, item, index in change.get("items_added", []):
+                keyed.insert(index, (key, item))
+            ticket["items"] = [it for _, it in keyed]
+        tickets[change["kot_no"]] = ticket
+
+
+class Screen:
+    """One simulated display: keeps the tickets it has been sent and reports what it sees."""
+
+    def __init__(self, bench, role, kds_name):
+        self.bench = bench
+        self.role = role                  # kds | kds_del | cds | recall
+        self.kds_name = kds_name
+        self.port = config.WS_PORT_KDS if role == "kds" else config.WS_PORT_KDS_DEL
+        self.tickets = {}
+        self.version = None
+        self.seen = set()
+        self.pending = {}                 # key -> (sent_at, metric, predicate)
+        self.messages = 0
+        self.bytes = 0
+        self.disconnects = 0
+        self.ws = None
+
+    async def run(self):
+        import websockets
+        while not self.bench.stopping:
+            try:
+                async with websockets.connect(f"ws://{self.bench.host}:{self.port}", max_size=None) as ws:
+                    self.ws = ws
+                    await self._init()
+                    async for message in ws:
+                        self._receive(message)
+            except Exception:
+                if self.bench.stopping:
+                    return
+                self.disconnects += 1
+                await asyncio.sleep(0.5)
+
+    async def _init(self):
+        if self.role == "recall":
+            await self.send({"action": "init_kds_recall", "kds_name": self.kds_name})
+        elif self.role != "cds":
+            # CDS.js never sends init_kds; it shows the NONE station
+            init = {"action": "init_kds", "kds_name": self.kds_name}
+            if self.bench.args.delta:
+                init["protocol"] = "delta"
+            await self.send(init)
+
+    async def send(self, payload):
+        if self.ws is not None:
+            await self.ws.send(json.dumps(payload))
+
+    def _receive(self, message):
+        now = time.perf_counter()
+        self.messages += 1
+        self.bytes += len(message)
+        data = json.loads(message)
+        if "delivered_tickets" in data or data.get("action") == "print_ticket":
+            return
+        if data.get("type") == "delta":
+            if data.get("from") != self.version:
+                self.version = None
+                asyncio.ensure_future(self.send({"action": "resync"}))
+                return
+            apply_delta(self.tickets, data)
+            self.version = data.get("version")
+        elif "tickets" in data:
+            self.tickets = {t["kot_no"]: t for t in data["tickets"]}
+            self.version = data.get("version")
+        else:
+            return
+
+        for kot_no in self.tickets.keys() - self.seen:
+            self.seen.add(kot_no)
+            injected = self.bench.injected.get(kot_no)
+            if injected is not None:
+                self.bench.record(f"trigger_to_{self.role}", now - injected)
+        for key, (sent_at, metric, predicate) in list(self.pending.items()):
+            if predicate(self.tickets):
+                del self.pending[key]
+                self.bench.record(metric, now - sent_at)
+
+    # ---------- Kitchen actions ----------
+    async def tap(self):
+        """Acknowledge one pending item (KDS toggle_item)."""
+        choices = [(t, it) for t in self.tickets.values() if not t.get("Cancelled")
+                   for it in t["items"] if int(it.get("ack_status") or 0) == 0
+                   and (t["kot_no"], it["i_code"]) not in self.pending]
+        if not choices:
+            return False
+        ticket, item = random.choice(choices)
+        kot_no, i_code = ticket["kot_no"], item["i_code"]
+
+        def acked(tickets):
+            t = tickets.get(kot_no)
+            return t is None or any(it["i_code"] == i_code and int(it.get("ack_status") or 0) == 1
+                                    for it in t["items"])
+        self.pending[(kot_no, i_code)] = (time.perf_counter(), "tap_to_screen", acked)
+        await self.send({"action": "toggle_item", "kot_no": kot_no, "bill_no": ticket.get("bill_no"),
+                         "i_code": i_code})
+        return True
+
+    async def bump(self):
+        """Hand over one fully ready ticket (KDS_DEL toggle_ticket)."""
+        choices = [t for t in self.tickets.values() if t["items"] and t["kot_no"] not in self.pending
+                   and all(int(it.get("ready_status") or 0) == 1 and it.get("status") != "Delivered"
+                           for it in t["items"])]
+        if not choices:
+            return False
+        ticket = random.choice(choices)
+        kot_no = ticket["kot_no"]
+
+        def delivered(tickets):
+            t = tickets.get(kot_no)
+            return t is None or all(it.get("status") == "Delivered" for it in t["items"])
+        self.pending[kot_no] = (time.perf_counter(), "bump_to_screen", delivered)
+        await self.send({"action": "toggle_ticket", "kot_no": kot_no, "bill_no": ticket.get("bill_no"),
+                         "items": ticket["items"], "print": False})
+        return True
+
+
+# ------------------- Benchmark -------------------
+class Bench:
+    def __init__(self, args, source):
+        self.args = args
+        self.host = args.host
+        self.source = source
+        self.stations = [f"KDS{n + 1}" for n in range(args.stations)]
+        self.injected = {}                # kot_no -> perf_counter() when its rows were committed
+        self.samples = {}
+        self.stopping = False
+        self.kots = self.taps = self.bumps = 0
+        self.screens = (
+            [Screen(self, "kds", self.stations[n % len(self.stations)]) for n in range(args.kds)]
+            + [Screen(self, "kds_del", self.stations[n % len(self.stations)]) for n in range(args.dels)]
+            + [Screen(self, "cds", "NONE") for _ in range(args.cds)]
+            + [Screen(self, "recall", self.stations[n % len(self.stations)]) for n in range(args.recall)]
+        )
+
+    def record(self, metric, seconds):
+        self.samples.setdefault(metric, []).append(seconds)
+
+    def first_screen(self, role, kds_name):
+        return next((s for s in self.screens if s.role == role and s.kds_name == kds_name), None)
+
+    async def every(self, rate, action):
+        """Call `action()` `rate` times per second (Poisson arrivals) until stopped."""
+        if rate <= 0:
+            return
+        while not self.stopping:
+            await asyncio.sleep(random.expovariate(rate))
+            if not self.stopping:
+                await action()
+
+    async def insert_kot(self):
+        kot_no = self.args.first_kot + self.kots
+        self.kots += 1
+        station = random.choice(self.stations)
+        station_no = self.stations.index(station) + 1
+        items = [(f"{station_no}{n:03d}", f"Item {station_no}-{n}", random.randint(1, 3))
+                 for n in random.sample(range(self.args.menu), self.args.items)]
+        await asyncio.to_thread(self.source.insert_kot, kot_no, station, items,
+                                bill_no=f"B{kot_no}", table_name=f"T{kot_no % 40 + 1}")
+        self.injected[kot_no] = time.perf_counter()
+
+    async def tap(self):
+        # One tapping screen per station, as in a kitchen; rate is spread over stations
+        screen = self.first_screen("kds", random.choice(self.stations))
+        if screen is not None and await screen.tap():
+            self.taps += 1
+
+    async def bump(self):
+        screen = self.first_screen("kds_del", random.choice(self.stations))
+        if screen is not None and await screen.bump():
+            self.bumps += 1
+
+    async def run(self):
+        tasks = [asyncio.create_task(screen.run()) for screen in self.screens]
+        await asyncio.sleep(self.args.warmup)
+        started = time.perf_counter()
+        load = [asyncio.create_task(self.every(self.args.kot_rate, self.insert_kot)),
+                asyncio.create_task(self.every(self.args.tap_rate, self.tap)),
+                asyncio.create_task(self.every(self.args.bump_rate, self.bump))]
+        await asyncio.sleep(self.args.duration)
+        for task in load:
+            task.cancel()
+        await asyncio.sleep(self.args.drain)
+        elapsed = time.perf_counter() - started
+        self.stopping = True
+        for screen in self.screens:
+            if screen.ws is not None:
+                await screen.ws.close()
+        for task in tasks:
+            task.cancel()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        roles = {}
+        for screen in self.screens:
+            r = roles.setdefault(screen.role, {"screens": 0, "messages": 0, "bytes": 0,
+                                               "disconnects": 0, "unanswered_actions": 0})
+            r["screens"] += 1
+            r["messages"] += screen.messages
+            r["bytes"] += screen.bytes
+            r["disconnects"] += screen.disconnects
+            r["unanswered_actions"] += len(screen.pending)
+        return {
+            "config": {k: v for k, v in vars(self.args).items() if k not in ("serve", "report")},
+            "elapsed_s": round(elapsed, 2),
+            "kots_injected": self.kots,
+            "taps": self.taps,
+            "bumps": self.bumps,
+            "metrics": {name: summarize(values) for name, values in sorted(self.samples.items())},
+            "screens": roles,
+        }
+
+
+# ------------------- Server Process -------------------
+def serve(db_path):
+    """Run server.py on the SQLite data source (the child process of a benchmark)."""
+    config.DATA_SOURCE = "sqlite"
+    config.SQLITE_PATH = db_path
+    os.chdir(KDS_WS)
+    import server
+    asyncio.run(server.main())
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="KDS WebSocket load benchmark (SQLite data source)")
+    p.add_argument("--stations", type=int, default=4, help="kitchen stations (KDS1..KDSn)")
+    p.add_argument("--kds", type=int, default=8, help="KDS screens on :9999")
+    p.add_argument("--del", dest="dels", type=int, default=4, help="KDS_DEL screens on :9998")
+    p.add_argument("--cds", type=int, default=2, help="CDS screens (station NONE) on :9998")
+    p.add_argument("--recall", type=int, default=2, help="Recall screens on :9998")
+    p.add_argument("--kot-rate", type=float, default=2.0, help="KOT inserts per second")
+    p.add_argument("--items", type=int, default=4, help="items per KOT")
+    p.add_argument("--menu", type=int, default=40, help="menu items per station")
+    p.add_argument("--tap-rate", type=float, default=6.0, help="item taps per second (all stations)")
+    p.add_argument("--bump-rate", type=float, default=1.0, help="KDS_DEL bumps per second (all stations)")
+    p.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    p.add_argument("--warmup", type=float, default=2.0, help="seconds to connect before load starts")
+    p.add_argument("--drain", type=float, default=3.0, help="seconds to wait for in-flight updates")
+    p.add_argument("--snapshots", dest="delta", action="store_false", help="screens use full snapshots, not deltas")
+    p.add_argument("--db", default=os.path.join(HERE, "bench_kds.db"), help="SQLite file (recreated)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--no-spawn", dest="spawn", action="store_false",
+                   help="use a server already running on --db instead of starting one")
+    p.add_argument("--server-log", default=os.devnull, help="file for the server's output")
+    p.add_argument("--report", default="bench_report.json", help="JSON report path ('-' = stdout only)")
+    p.add_argument("--first-kot", type=int, default=100000, help="KOT numbers start here")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args.db)
+        return
+
+    from data_source import SqliteSource
+    random.seed(args.seed)
+    if args.spawn:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    source = SqliteSource(args.db)
+
+    server = None
+    if args.spawn:
+        log = open(args.server_log, "w")
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--db", args.db],
+                                  cwd=KDS_WS, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        for port in (config.WS_PORT_KDS, config.WS_PORT_KDS_DEL):
+            if not wait_for_port(args.host, port, 30):
+                sys.exit(f"❌ Server not listening on {args.host}:{port}")
+        result = asyncio.run(Bench(args, source).run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+
+    text = json.dumps(result, indent=2)
+    if args.report == "-":
+        print(text)
+    else:
+        with open(args.report, "w") as f:
+            f.write(text)
+        for name, stats in result["metrics"].items():
+            if stats["count"]:
+                print(f"{name:24} n={stats['count']:<6} p50={stats['p50_ms']:>8} ms  "
+                      f"p95={stats['p95_ms']:>8} ms  p99={stats['p99_ms']:>8} ms")
+        print(f"✅ Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import pytest
+
+from data_source import SqliteSource, result_sets
+
+
+@pytest.fixture
+def source(tmp_path):
+    src = SqliteSource(str(tmp_path / "kds.db"))
+    src.insert_kot(1, "GRILL", [("A", "Naan", 2), ("B", "Dal", 1)], bill_no="B1", table_name="T1")
+    src.insert_kot(2, "BAR", [("C", "Lime Soda", 1)], bill_no="B1", table_name="T1")
+    src.insert_kot(3, "GRILL", [("A", "Naan", 1)], bill_no="B2", table_name="T2")
+    src.cancel_ticket(3)
+    yield src
+    src.close()
+
+
+def test_bulk_rows_match_the_per_station_fetches(source):
+    stations = ["GRILL", "BAR", "EMPTY", "NONE"]
+    for bulk, single in ((source.kds_rows_bulk, source.kds_rows), (source.kds_del_rows_bulk, source.kds_del_rows)):
+        rows = bulk(stations)
+        for kds_name in stations:
+            # Bulk rows carry the station column on top of the procedure's columns
+            assert [tuple(r)[:-1] for r in rows[kds_name]] == [tuple(r) for r in single(kds_name)]
+    assert len(source.kds_rows_bulk(["NONE"])["NONE"]) == 4
+
+
+class FakeCursor:
+    """Result sets of a batch as pyodbc exposes them; None stands for a row count."""
+
+    def __init__(self, *sets):
+        self.sets = list(sets)
+
+    @property
+    def description(self):
+        return None if self.sets[0] is None else [("KOT_NO",)]
+
+    def fetchall(self):
+        return self.sets[0]
+
+    def nextset(self):
+        self.sets.pop(0)
+        return bool(self.sets)
+
+
+def test_result_sets_skip_row_counts():
+    assert result_sets(FakeCursor(None, [1], None, None, [], [2, 3]), 3) == [[1], [], [2, 3]]
+
+
+def test_result_sets_missing_set_raises():
+    with pytest.raises(RuntimeError):
+        result_sets(FakeCursor([1], None), 2)
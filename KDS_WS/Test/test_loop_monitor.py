@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+
+import loop_monitor
+from loop_monitor import LoopMonitor
+
+
+class Histogram:
+    """Records observe() calls, optionally per label tuple."""
+
+    def __init__(self):
+        self.values = []
+        self.by_label = {}
+
+    def observe(self, value):
+        self.values.append(value)
+
+    def labels(self, *labels):
+        return self.by_label.setdefault(labels, Histogram())
+
+
+async def ws_handler():
+    action = "toggle_ticket"
+    blocking_call()
+
+
+def blocking_call():
+    time.sleep(0.4)
+
+
+def test_stall_is_named_by_the_watchdog(monkeypatch):
+    # Treat this file as app code so its frames name the stall
+    monkeypatch.setattr(loop_monitor, "APP_DIR", os.path.dirname(os.path.abspath(__file__)))
+    original_run = asyncio.events.Handle._run
+    lag, slow = Histogram(), Histogram()
+    monitor = LoopMonitor(interval=0.05, slow_after=0.1, lag_seconds=lag, slow_seconds=slow)
+
+    async def main():
+        monitor.start()
+        await asyncio.sleep(0.2)
+        await asyncio.create_task(ws_handler())
+        await asyncio.sleep(0.2)
+        monitor.stop()
+
+    asyncio.run(main())
+    assert asyncio.events.Handle._run is original_run
+    assert len(lag.values) >= 3
+    stalls = slow.by_label[("ws_handler", "toggle_ticket")].values
+    assert len(stalls) == 1 and stalls[0] >= 0.2
+    assert monitor.max_lag == monitor.max_callback == stalls[0]
+
+
+def test_idle_loop_reports_no_stalls():
+    lag, slow = Histogram(), Histogram()
+    monitor = LoopMonitor(interval=0.02, slow_after=0.1, lag_seconds=lag, slow_seconds=slow)
+
+    async def main():
+        monitor.start()
+        await asyncio.sleep(0.3)
+        monitor.stop()
+
+    asyncio.run(main())
+    assert len(lag.values) >= 5
+    assert slow.by_label == {} and monitor.max_callback == 0.0
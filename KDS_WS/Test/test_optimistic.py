@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+from optimistic import PendingTransitions, WriteBehindQueue, accept_items, deliver_items
+
+
+def test_accept_items_toggles_ack_status():
+    ticket = {"kot_no": 1, "items": [{"i_code": "A", "ack_status": 0}, {"i_code": "B", "ack_status": 1}]}
+    accepted = accept_items(["A", "B"])(ticket)
+    assert [it["ack_status"] for it in accepted["items"]] == [1, 0]
+    assert [it["ack_status"] for it in ticket["items"]] == [0, 1]     # original left alone
+
+
+def test_deliver_items_removes_ready_items_and_empty_tickets():
+    ticket = {"kot_no": 1, "ticketstatus": 1,
+              "items": [{"i_code": "A", "ready_status": 1}, {"i_code": "B", "ready_status": 0}]}
+    delivered = deliver_items(["A", "B"])(ticket)
+    assert delivered["items"] == [{"i_code": "B", "ready_status": 0}] and delivered["ticketstatus"] == 0
+    assert deliver_items(["A"])({**ticket, "items": ticket["items"][:1]}) is None
+
+
+def test_pending_transitions_drop_tickets_that_leave():
+    pending = PendingTransitions()
+    tickets = [{"kot_no": 1, "items": [{"i_code": "A", "ready_status": 1}]}, {"kot_no": 2, "items": []}]
+    assert pending.apply(tickets) is tickets
+    transition_id = pending.add(1, deliver_items(["A"]))
+    assert [t["kot_no"] for t in pending.apply(tickets)] == [2]
+    pending.discard(transition_id)
+    assert pending.apply(tickets) is tickets
+
+
+def test_overlays_match_the_refetch_after_the_write(server):
+    """The transition shown on a tap is what the data source returns once the write lands."""
+    src = server.data_source.source
+    src.clear()
+    src.insert_kot(1, "GRILL", [("A", "Naan", 2), ("B", "Dal", 1)], bill_no="B1")
+    src.accept_items([(1, "A", "B1")])
+
+    before = server.build_tickets(src.kds_rows("GRILL"))
+    src.accept_items([(1, "A", "B1"), (1, "B", "B1")])
+    assert [accept_items(["A", "B"])(t) for t in before] == server.build_tickets(src.kds_rows("GRILL"))
+
+    before = server.build_kds_del_tickets(src.kds_del_rows("GRILL"))
+    src.update_kds_del_items([(1, "A", "B1"), (1, "B", "B1")])
+    after = server.build_kds_del_tickets(src.kds_del_rows("GRILL"))
+    shown = [t for t in (deliver_items(["A", "B"])(t) for t in before) if t is not None]
+    assert [t["items"] for t in shown] == [t["items"] for t in after]
+    assert [t["ticketstatus"] for t in shown] == [t["ticketstatus"] for t in after]
+
+
+def test_write_behind_runs_in_order_and_reports():
+    queue = WriteBehindQueue(name="test-write-behind")
+    results, finished = [], threading.Event()
+    queue.submit(results.append, 1, done=lambda ok: results.append(ok))
+    queue.submit(lambda: False, done=lambda ok: results.append(ok))
+    queue.submit(lambda: 1 / 0, done=lambda ok: (results.append(ok), finished.set()))
+    assert finished.wait(5)
+    assert results == [1, True, False, False]
+    assert (queue.completed, queue.failed) == (1, 2)
+
+
+def test_rollback_runs_on_the_event_loop(server):
+    async def run():
+        loop_thread = threading.get_ident()
+        threads = set()
+        pending = PendingTransitions()
+
+        def overlay(tickets):
+            threads.add(threading.get_ident())
+            return pending.apply(tickets)
+
+        cache = server.VersionedCache(wrap=lambda tickets: {"tickets": tickets}, overlay=overlay)
+        cache["GRILL"] = [{"kot_no": 1, "items": [{"i_code": "A", "ack_status": 0}]}]
+        reconciled = asyncio.Event()
+
+        async def reconcile(*stations):
+            reconciled.set()
+
+        stations = server.apply_optimistic(cache, pending, 1, accept_items(["A"]), reconcile, lambda: False)
+        assert stations == ["GRILL"] and cache["GRILL"][0]["items"][0]["ack_status"] == 1
+        await asyncio.wait_for(reconciled.wait(), 5)
+        assert cache["GRILL"][0]["items"][0]["ack_status"] == 0                 # rolled back
+        assert threads == {loop_thread}
+
+    asyncio.run(run())
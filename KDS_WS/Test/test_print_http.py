@@ -0,0 +1,55 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+import print as print_server
+from print_http import PrintRequestHandler
+from print_queue import PrintQueue
+
+
+@pytest.fixture
+def server(tmp_path):
+    queue = PrintQueue(str(tmp_path / "jobs.db"))
+    httpd = print_server.make_server(queue, host="127.0.0.1", port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd, queue
+    httpd.shutdown()
+    httpd.server_close()
+    queue.close()
+
+
+def request(conn, method, path, payload=None):
+    body = None if payload is None else json.dumps(payload)
+    conn.request(method, path, body, {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, json.loads(data) if data else None
+
+
+def test_posted_tickets_are_queued(server):
+    httpd, queue = server
+    conn = http.client.HTTPConnection(*httpd.server_address, timeout=5)
+    status, payload = request(conn, "POST", "/", {"ticket": {"kot_no": 1}})
+    assert status == 200 and payload["status"] == "queued" and payload["job_ids"] == [payload["job_id"]]
+    # Same keep-alive connection: a batch is one request and one transaction
+    status, payload = request(conn, "POST", "/", {"tickets": [{"kot_no": 2}, {"kot_no": 3}]})
+    assert status == 200 and len(payload["job_ids"]) == 2 and "job_id" not in payload
+    assert request(conn, "POST", "/", {"tickets": []}) == (400, {"error": "no ticket"})
+
+    assert request(conn, "GET", "/jobs") == (200, {"queued": 3})
+    status, job = request(conn, "GET", f"/jobs/{payload['job_ids'][0]}")
+    assert status == 200 and job["status"] == "queued"
+    assert request(conn, "GET", "/jobs/999")[0] == 404
+    assert [queue.claim(timeout=0)[1]["kot_no"] for _ in range(3)] == [1, 2, 3]
+    conn.close()
+
+
+def test_handler_must_implement_handle_tickets():
+    class Incomplete(PrintRequestHandler):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(None, None, None)
+    assert issubclass(print_server.make_handler(None), PrintRequestHandler)
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from print_queue import PrintQueue, PrintWorker
+
+TIMEOUT = 5
+
+
+def test_jobs_are_claimed_oldest_first(tmp_path):
+    queue = PrintQueue(str(tmp_path / "jobs.db"))
+    first = queue.submit({"kot_no": 1})
+    second = queue.submit({"kot_no": 2})
+    assert queue.claim(timeout=0) == (first, {"kot_no": 1}, 1)
+    assert queue.claim(timeout=0) == (second, {"kot_no": 2}, 1)
+    assert queue.claim(timeout=0.05) is None
+    assert queue.counts() == {"printing": 2}
+    queue.close()
+
+
+def test_claim_wakes_up_on_submit(tmp_path):
+    queue = PrintQueue(str(tmp_path / "jobs.db"))
+    queue.claim(timeout=0)
+    threading.Timer(0.1, queue.submit, [{"kot_no": 1}]).start()
+    job = queue.claim(timeout=TIMEOUT)
+    assert job is not None and job[1] == {"kot_no": 1}
+    queue.close()
+
+
+def test_finish_and_retry(tmp_path):
+    queue = PrintQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit({"kot_no": 1})
+    queue.claim(timeout=0)
+    queue.retry(job_id, "paper out")
+    assert queue.status(job_id)["status"] == "queued"
+    assert queue.claim(timeout=0) == (job_id, {"kot_no": 1}, 2)
+    queue.finish(job_id, False, "paper out")
+    status = queue.status(job_id)
+    assert (status["status"], status["attempts"], status["error"]) == ("failed", 2, "paper out")
+    assert queue.status(job_id + 1) is None
+    queue.close()
+
+
+def test_printing_jobs_are_requeued_on_reopen(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = PrintQueue(path)
+    printing = queue.submit({"kot_no": 1})
+    done = queue.submit({"kot_no": 2})
+    queue.claim(timeout=0)
+    queue.claim(timeout=0)
+    queue.finish(done, True)
+    queue.close()
+
+    reopened = PrintQueue(path)
+    assert reopened.counts() == {"queued": 1, "done": 1}
+    assert reopened.claim(timeout=0) == (printing, {"kot_no": 1}, 2)
+    reopened.close()
+
+
+def test_submit_many_keeps_order(tmp_path):
+    queue = PrintQueue(str(tmp_path / "jobs.db"))
+    job_ids = queue.submit_many([{"kot_no": n} for n in range(5)])
+    assert job_ids == sorted(job_ids) and len(set(job_ids)) == 5
+    assert [queue.claim(timeout=0)[1]["kot_no"] for _ in job_ids] == list(range(5))
+    assert queue.submit_many([]) == []
+    queue.close()
+
+
+def test_purge_only_removes_old_finished_jobs(tmp_path):
+    queue = PrintQueue(str(tmp_path / "jobs.db"))
+    done, failed, waiting = queue.submit_many([{"kot_no": n} for n in range(3)])
+    queue.claim(timeout=0)
+    queue.claim(timeout=0)
+    queue.finish(done, True)
+    queue.finish(failed, False, "offline")
+    assert queue.purge(3600) == 0
+    assert queue.purge(-1) == 2
+    assert queue.counts() == {"queued": 1}
+    assert queue.status(waiting)["status"] == "queued"
+    queue.close()
+
+
+def test_worker_retries_then_gives_up(tmp_path):
+    queue = PrintQueue(str(tmp_path / "jobs.db"))
+    calls = []
+
+    def print_func(ticket):
+        calls.append(ticket["kot_no"])
+        if ticket["kot_no"] == 1:
+            raise OSError("printer offline")
+        return calls.count(2) > 1      # kot 2 fails once, then prints
+
+    job_ids = queue.submit_many([{"kot_no": 1}, {"kot_no": 2}])
+    PrintWorker(queue, print_func, max_attempts=2, retry_delay=0).start()
+    deadline = time.monotonic() + TIMEOUT
+    while queue.counts() != {"failed": 1, "done": 1} and time.monotonic() < deadline:
+        time.sleep(0.01)
+    failed, done = (queue.status(job_id) for job_id in job_ids)
+    assert (failed["status"], failed["attempts"], failed["error"]) == ("failed", 2, "printer offline")
+    assert (done["status"], done["attempts"]) == ("done", 2)
+    assert sorted(calls) == [1, 1, 2, 2]
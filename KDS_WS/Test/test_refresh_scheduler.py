@@ -0,0 +1,96 @@
+import threading
+import time
+
+from refresh_scheduler import RefreshScheduler
+
+TIMEOUT = 5
+
+
+class Fetch:
+    """Refresh function that records its calls and blocks until released."""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, arg):
+        with self._lock:
+            self.calls.append(arg)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        self.started.release()
+        self.release.wait(TIMEOUT)
+        with self._lock:
+            self.active -= 1
+        return arg
+
+
+def test_requests_during_a_fetch_share_one_trailing_refresh():
+    scheduler = RefreshScheduler(max_workers=4)
+    fetch = Fetch()
+    first = scheduler.request("GRILL", fetch, "GRILL")
+    assert fetch.started.acquire(timeout=TIMEOUT)
+    trailing = [scheduler.request("GRILL", fetch, "GRILL") for _ in range(10)]
+    joined = scheduler.request("GRILL", fetch, "GRILL", join_running=True)
+    assert joined is first
+    assert all(f is trailing[0] for f in trailing) and trailing[0] is not first
+    fetch.release.set()
+    assert trailing[0].result(TIMEOUT) == "GRILL" and first.done()
+    assert fetch.calls == ["GRILL", "GRILL"] and fetch.max_active == 1
+    assert (scheduler.started, scheduler.joined) == (2, 11)
+    # The key is released right after the result is set
+    deadline = time.monotonic() + TIMEOUT
+    while scheduler.in_flight("GRILL") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not scheduler.in_flight("GRILL")
+    scheduler.shutdown()
+
+
+def test_different_keys_run_in_parallel():
+    scheduler = RefreshScheduler(max_workers=4)
+    fetch = Fetch()
+    futures = [scheduler.request(k, fetch, k) for k in ("A", "B", "C")]
+    for _ in futures:
+        assert fetch.started.acquire(timeout=TIMEOUT)
+    fetch.release.set()
+    assert [f.result(TIMEOUT) for f in futures] == ["A", "B", "C"]
+    assert fetch.max_active == 3
+    scheduler.shutdown()
+
+
+def test_request_many_holds_every_key_of_the_bulk_load():
+    scheduler = RefreshScheduler(max_workers=4)
+    bulk, single = Fetch(), Fetch()
+    busy = scheduler.request("B", single, "B")
+    assert single.started.acquire(timeout=TIMEOUT)
+
+    futures = scheduler.request_many({"A": "A", "B": "B", "C": "C"}, bulk, single)
+    assert bulk.started.acquire(timeout=TIMEOUT)
+    assert bulk.calls == [["A", "C"]]                      # B was in flight: trails on its own
+    # While the bulk load runs, its keys are busy too
+    trailing_a = scheduler.request("A", single, "A")
+    assert trailing_a is not futures[0]
+    assert scheduler.in_flight("A") and scheduler.in_flight("C")
+
+    single.release.set()
+    bulk.release.set()
+    for future in [busy, *futures, trailing_a]:
+        future.result(TIMEOUT)
+    assert sorted(single.calls) == ["A", "B", "B"]
+    scheduler.shutdown()
+
+
+def test_a_failed_refresh_releases_its_key():
+    scheduler = RefreshScheduler(max_workers=1)
+
+    def fail(arg):
+        raise RuntimeError(arg)
+
+    future = scheduler.request("A", fail, "boom")
+    assert isinstance(future.exception(TIMEOUT), RuntimeError)
+    assert scheduler.request("A", lambda arg: arg, "ok").result(TIMEOUT) == "ok"
+    scheduler.shutdown()
@@ -0,0 +1,41 @@
+import http.client
+import json
+import threading
+from http.server import HTTPServer
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def address(server):
+    httpd = HTTPServer(("127.0.0.1", 0), server.KDSRequestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(address, path):
+    conn = http.client.HTTPConnection(*address, timeout=5)
+    conn.request("GET", path)
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response.status, body
+
+
+def test_traces_filters_by_minutes(address):
+    status, body = get(address, "/traces?minutes=5&kot=12")
+    assert status == 200 and json.loads(body) == []
+    assert get(address, "/traces")[0] == 200
+
+
+@pytest.mark.parametrize("minutes", ["abc", "-1", "nan", "inf"])
+def test_traces_rejects_bad_minutes(address, minutes):
+    status, body = get(address, f"/traces?minutes={minutes}")
+    assert status == 400 and "minutes" in json.loads(body)["error"]
+
+
+def test_metrics_are_served(address):
+    status, body = get(address, "/metrics")
+    assert status == 200 and b"kds_loop_lag_seconds" in body
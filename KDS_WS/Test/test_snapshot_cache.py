@@ -0,0 +1,201 @@
+import json
+import random
+from decimal import Decimal
+
+from snapshot_cache import StationSummary, VersionedCache, diff_snapshot, diff_tickets, item_keys, plain_qty
+
+
+def ticket(kot_no, *items, **fields):
+    return {"kot_no": kot_no, "table_no": "T1", **fields,
+            "items": [{"i_code": code, "name": code, "qty": 1, "ack_status": ack} for code, ack in items]}
+
+
+def apply_delta(tickets, delta):
+    """Python twin of applyDelta() in KDS.js / KDS_DEL.js."""
+    by_kot = {t["kot_no"]: t for t in tickets}
+    for kot in delta["removed"]:
+        by_kot.pop(kot, None)
+    for t in delta["added"]:
+        by_kot[t["kot_no"]] = t
+    for change in delta["changed"]:
+        t = {**by_kot[change["kot_no"]], **change.get("fields", {})}
+        by_kot[change["kot_no"]] = t
+        if "items" in change:
+            t["items"] = change["items"]
+            continue
+        by_key = dict(zip(item_keys(t["items"]), t["items"]))
+        for key in change.get("items_removed", []):
+            del by_key[key]
+        for key, item in change.get("items_changed", []):
+            by_key[key] = item
+        items = list(by_key.values())
+        for key, item, index in change.get("items_added", []):
+            items.insert(index, item)
+        t["items"] = items
+    return list(by_kot.values())
+
+
+def test_item_keys_number_repeated_codes():
+    assert item_keys([{"i_code": "A"}, {"i_code": "B"}, {"i_code": "A"}]) == ["A", "B", "A#2"]
+
+
+def test_diff_tickets_added_removed_changed():
+    old = [ticket(1, ("A", 0)), ticket(2, ("B", 0))]
+    new = [ticket(2, ("B", 1)), ticket(3, ("C", 0))]
+    added, removed, changed = diff_tickets(old, new)
+    assert [t["kot_no"] for t in added] == [3]
+    assert removed == [1]
+    assert changed == [{"kot_no": 2, "items_changed": [["B", new[0]["items"][0]]]}]
+
+
+def test_diff_tickets_unchanged_ticket_is_not_listed():
+    old = [ticket(1, ("A", 0))]
+    assert diff_tickets(old, [ticket(1, ("A", 0))]) == ([], [], [])
+
+
+def test_diff_reordered_items_sends_the_whole_list():
+    old = [ticket(1, ("A", 0), ("B", 0))]
+    new = [ticket(1, ("B", 0), ("A", 0))]
+    _, _, changed = diff_tickets(old, new)
+    assert changed == [{"kot_no": 1, "items": new[0]["items"]}]
+
+
+def test_delta_applied_by_the_client_gives_the_new_list():
+    old = [ticket(1, ("A", 0), ("B", 0)), ticket(2, ("C", 0)), ticket(4, ("A", 0))]
+    new = [ticket(1, ("A", 1), ("X", 0), ("B", 0), ("A", 0), table_no="T9"),
+           ticket(3, ("D", 0)), ticket(4, ("A", 0))]
+    delta = diff_snapshot(old, new)
+    assert sorted(apply_delta(old, delta), key=lambda t: t["kot_no"]) == new
+    assert [t["kot_no"] for t in old] == [1, 2, 4]     # old list left as it was
+
+
+def test_diff_snapshot_carries_the_summary_when_it_changed():
+    old = {"tickets": [], "summary": []}
+    new = {"tickets": [], "summary": [{"name": "A", "qty": 1}]}
+    assert diff_snapshot(old, new)["summary"] == new["summary"]
+    assert diff_snapshot(new, dict(new)) is None
+
+
+def test_versioned_cache_bumps_only_on_change():
+    cache = VersionedCache()
+    cache["GRILL"] = {"tickets": [ticket(1, ("A", 0))], "summary": []}
+    assert cache.version("GRILL") == 1
+    cache["GRILL"] = {"tickets": [ticket(1, ("A", 0))], "summary": []}
+    assert cache.version("GRILL") == 1
+    cache["GRILL"] = {"tickets": [ticket(1, ("A", 1))], "summary": []}
+    assert cache.version("GRILL") == 2
+
+
+def test_delta_since_only_from_the_previous_version():
+    cache = VersionedCache(wrap=lambda tickets: {"tickets": tickets})
+    cache["BAR"] = [ticket(1, ("A", 0))]
+    assert cache.delta_since("BAR", 0) is None           # first version: snapshot only
+    cache["BAR"] = [ticket(1, ("A", 1))]
+    cache["BAR"] = [ticket(1, ("A", 1)), ticket(2, ("B", 0))]
+
+    version, text = cache.delta_since("BAR", 2)
+    delta = json.loads(text)
+    assert (version, delta["type"], delta["from"], delta["version"]) == (3, "delta", 2, 3)
+    assert [t["kot_no"] for t in delta["added"]] == [2]
+    assert cache.delta_since("BAR", 1) is None           # gap: the client must resync
+    assert cache.delta_since("BAR", 2)[1] is text        # encoded once per version
+
+
+def test_snapshot_is_encoded_once_per_version():
+    cache = VersionedCache(wrap=lambda tickets: {"tickets": tickets})
+    cache["BAR"] = [ticket(1, ("A", 0))]
+    version, text = cache.snapshot("BAR", [])
+    assert version == 1 and json.loads(text) == {"tickets": [ticket(1, ("A", 0))], "type": "snapshot", "version": 1}
+    assert cache.snapshot("BAR", [])[1] is text
+    assert json.loads(cache.encoded("EMPTY", []))["version"] == 0
+
+
+def test_overlay_is_reapplied_over_the_assigned_value():
+    hidden = set()
+    cache = VersionedCache(wrap=lambda tickets: {"tickets": tickets},
+                           overlay=lambda tickets: [t for t in tickets if t["kot_no"] not in hidden])
+    cache["BAR"] = [ticket(1, ("A", 0)), ticket(2, ("B", 0))]
+    hidden.add(1)
+    assert cache.reapply("BAR")
+    assert [t["kot_no"] for t in cache["BAR"]] == [2]
+    hidden.clear()
+    cache.reapply("BAR")
+    assert [t["kot_no"] for t in cache["BAR"]] == [1, 2]
+    assert not cache.reapply("NONE")
+
+
+# ------------------- Food Summary -------------------
+def recompute(tickets):
+    """Summary computed from scratch, the way USP_Get_KDS_Summary groups the rows."""
+    totals = {}
+    for t in tickets:
+        for item in StationSummary.counted(t):
+            entry = totals.setdefault(item["i_code"], [item["name"], Decimal(0)])
+            entry[1] += Decimal(str(item["qty"]))
+    return [{"name": name, "qty": plain_qty(qty)} for name, qty in sorted(totals.values()) if qty > 0]
+
+
+def summary_ticket(kot_no, *items, cancelled=False):
+    return {"kot_no": kot_no, "Cancelled": cancelled,
+            "items": [{"i_code": code, "name": f"Item {code}", "qty": qty, "status": status}
+                      for code, qty, status in items]}
+
+
+def test_summary_counts_open_items_only():
+    summary = StationSummary()
+    rows = summary.update([summary_ticket(1, ("A", 2, "Pending"), ("B", 1, "Ready")),
+                           summary_ticket(2, ("A", 1, "Delivered")),
+                           summary_ticket(3, ("A", 5, "Pending"), cancelled=True)])
+    assert rows == [{"name": "Item A", "qty": 2}, {"name": "Item B", "qty": 1}]
+
+
+def test_summary_follows_status_changes():
+    summary = StationSummary()
+    summary.update([summary_ticket(1, ("A", 2, "Pending"), ("B", 1, "Pending"))])
+    assert summary.update([summary_ticket(1, ("A", 2, "Delivered"), ("B", 1, "Ready"))]) == [
+        {"name": "Item B", "qty": 1}]
+    assert summary.update([summary_ticket(1, ("A", 2, "Pending"), ("B", 1, "Ready"))]) == [
+        {"name": "Item A", "qty": 2}, {"name": "Item B", "qty": 1}]
+
+
+def test_summary_sorts_items_without_a_name():
+    summary = StationSummary()
+    nameless = summary_ticket(1, ("A", 1, "Pending"), ("B", 2, "Pending"))
+    nameless["items"][0]["name"] = None                     # NULL I_Name
+    assert summary.update([nameless]) == [{"name": None, "qty": 1}, {"name": "Item B", "qty": 2}]
+
+
+def test_summary_negative_lines_do_not_depend_on_order():
+    void_first = [summary_ticket(1, ("A", -1, "Pending")), summary_ticket(2, ("A", 3, "Pending"))]
+    summary = StationSummary()
+    summary.update(void_first[:1])
+    assert summary.update(void_first) == [{"name": "Item A", "qty": 2}]
+    assert StationSummary().update(void_first[::-1]) == [{"name": "Item A", "qty": 2}]
+
+
+def test_summary_fractional_quantities_do_not_drift():
+    summary = StationSummary()
+    base = [summary_ticket(1, ("A", 0.1, "Pending"))]
+    for kot_no in range(2, 40):
+        summary.update(base + [summary_ticket(kot_no, ("A", 0.2, "Pending"))])
+    assert summary.update(base) == [{"name": "Item A", "qty": 0.1}]
+    assert summary.update([]) == [] and summary._totals == {}
+
+
+def test_summary_matches_a_full_recompute():
+    rng = random.Random(7)
+    summary = StationSummary()
+    tickets = {}
+    for _ in range(2000):
+        kot_no = rng.randrange(30)
+        if rng.random() < 0.2:
+            tickets.pop(kot_no, None)
+        else:
+            tickets[kot_no] = summary_ticket(
+                kot_no,
+                *[(rng.choice("ABCDE"), rng.choice([1, 2, 3, -1, 0.5, 0.25]),
+                   rng.choice(["Pending", "Ready", "Delivered"])) for _ in range(rng.randint(1, 4))],
+                cancelled=rng.random() < 0.1)
+        listed = list(tickets.values())
+        rng.shuffle(listed)
+        assert summary.update(listed) == recompute(listed)
@@ -0,0 +1,84 @@
+import random
+
+from text_wrap import TextWrapper
+
+
+class Measure:
+    """char_width that counts calls; 'W' is twice as wide as other characters."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, ch):
+        self.calls.append(ch)
+        return 20 if ch == "W" else 10
+
+
+def naive_chars(text, max_width, char_width):
+    """Reference for "chars" mode: grow each line a character at a time."""
+    lines = []
+    while True:
+        n = 0
+        while n < len(text) and sum(char_width(c) for c in text[:n + 1]) <= max_width:
+            n += 1
+        if n == len(text):
+            lines.append(text)
+            return lines
+        n = max(n, 1)
+        lines.append(text[:n])
+        text = text[n:].lstrip()
+        if not text:
+            return lines
+
+
+def test_each_character_is_measured_once():
+    measure = Measure()
+    wrapper = TextWrapper(measure)
+    assert wrapper.width("Naan Naan") == 90
+    assert wrapper.width("WaN") == 40
+    assert sorted(measure.calls) == sorted(set("Naan WaN"))
+
+
+def test_chars_mode_breaks_at_the_longest_prefix():
+    wrapper = TextWrapper(Measure())
+    assert wrapper.wrap("Paneer Tikka Masala", 60) == ("Paneer", "Tikka ", "Masala")
+    assert wrapper.wrap("Butter  Naan", 80) == ("Butter  ", "Naan")
+    assert wrapper.wrap("WWW", 30) == ("W", "W", "W")
+    assert wrapper.wrap("W", 5) == ("W",)              # a character wider than the line still prints
+    assert wrapper.wrap("aW ", 15) == ("a", "W")
+    assert wrapper.wrap("", 50) == ("",)
+
+
+def test_chars_mode_matches_naive_wrapping():
+    rng = random.Random(7)
+    measure = Measure()
+    wrapper = TextWrapper(measure)
+    for _ in range(300):
+        text = "".join(rng.choice("ab W ") for _ in range(rng.randint(0, 40)))
+        max_width = rng.randint(5, 120)
+        assert list(wrapper.wrap(text, max_width)) == naive_chars(text, max_width, measure)
+
+
+def test_words_mode_fills_lines_word_by_word():
+    wrapper = TextWrapper(Measure())
+    assert wrapper.wrap("Dal Makhani Full", 110, "words") == ("Dal Makhani", "Full")
+    assert wrapper.wrap("Dal Makhani Full", 160, "words") == ("Dal Makhani Full",)
+    # A word wider than the line keeps a line of its own instead of being split
+    assert wrapper.wrap("Extra Chicken-Tikka-Masala Plate", 100, "words") == (
+        "Extra", "Chicken-Tikka-Masala", "Plate")
+
+
+def test_layouts_are_cached_per_text_width_and_mode():
+    measure = Measure()
+    wrapper = TextWrapper(measure, max_layouts=2)
+    first = wrapper.wrap("Paneer Tikka", 60)
+    measured = len(measure.calls)
+    assert wrapper.wrap("Paneer Tikka", 60) is first
+    assert (wrapper.hits, wrapper.misses) == (1, 1)
+    wrapper.wrap("Paneer Tikka", 60, "words")
+    wrapper.wrap("Paneer Tikka", 70)
+    assert (wrapper.hits, wrapper.misses) == (1, 3)
+    assert len(measure.calls) == measured              # widths are reused across layouts
+    # Least recently used layout was evicted
+    wrapper.wrap("Paneer Tikka", 60)
+    assert (wrapper.hits, wrapper.misses) == (1, 4)
@@ -0,0 +1,99 @@
+import io
+
+import pytest
+
+import print as print_server
+from ticket_layout import ESC_CUT, ESC_INIT, EscPosTarget, Layout, PngTarget
+
+TICKET = {
+    "bill_type": "Table billing", "table_no": "T4", "kot_no": 12, "bill_no": "B7", "stwd": "Ravi",
+    "items": [
+        {"name": "Naan", "qty": 2},
+        {"name": "Paneer Butter Masala with Extra Cheese and Garlic Naan Combo", "qty": 1},
+    ],
+}
+
+
+def texts(row):
+    return [(run.x, run.text) for run in row[1]]
+
+
+def test_rows_group_runs_by_line():
+    layout = Layout(576)
+    layout.text(300, 30, "QTY", "item")
+    layout.text(20, 0, "Header", "header")
+    layout.text(20, 30, "ITEM", "item")
+    layout.end(60)
+    layout.end(40)
+    assert [(y, [r.text for r in runs]) for y, runs in layout.rows()] == [(0, ["Header"]), (30, ["ITEM", "QTY"])]
+    assert layout.height == 60
+
+
+def test_ticket_lines_are_positioned_and_wrapped():
+    target = EscPosTarget(font_specs=print_server.FONTS)     # fixed 12-dot characters, header at 2x
+    layout = print_server.layout_ticket(TICKET, target)
+    rows = layout.rows()
+    assert [y for y, _ in rows] == [0, 55, 95, 135, 165, 195, 225, 255, 285, 315]
+    assert texts(rows[0]) == [(168, "Table : T4")]         # centered: (576 - 10 * 24) // 2
+    assert texts(rows[1]) == [(20, "Bill:B7 | KOT:12")]
+    assert texts(rows[3]) == [(20, "ITEM"), (530, "QTY")]  # QTY right-aligned with 10 dots padding
+    assert texts(rows[4]) == [(20, "Naan"), (530, "2")]
+    # 505 dots of name column = 42 characters; the quantity goes on the last line
+    assert texts(rows[5]) == [(20, "Paneer Butter Masala with Extra Cheese and")]
+    assert texts(rows[6]) == [(20, "Garlic Naan Combo"), (530, "1")]
+    assert texts(rows[8]) == [(20, "Steward: Ravi  Items: 2")]
+    assert texts(rows[9]) == [(234, "KDS PRINT")]
+    assert layout.height == 345
+
+
+def test_escpos_encodes_positions_styles_and_feeds():
+    target = EscPosTarget(font_specs={"a": {"height": 24}, "b": {"height": 48, "weight": 700}})
+    layout = Layout(576)
+    layout.text(0, 0, "AB", "a")
+    layout.text(300, 0, "C", "b")
+    layout.text(0, 30, "D", "a")
+    layout.end(60)
+    assert target.encode(layout) == (
+        ESC_INIT
+        + b"\x1d!\x00\x1bE\x00" + b"\x1b$\x00\x00AB"
+        + b"\x1d!\x11\x1bE\x01" + b"\x1b$\x2c\x01C"        # 300 = 0x012c, low byte first
+        + b"\x1bJ\x1e"                                     # feed 30 dots to the next row
+        + b"\x1d!\x00\x1bE\x00" + b"\x1b$\x00\x00D"
+        + b"\x1bJ\x1e"                                     # feed to layout.height
+        + b"\n\n\n" + ESC_CUT)
+
+
+def test_escpos_clips_runs_to_the_print_head():
+    target = EscPosTarget(font_specs=print_server.FONTS)
+    layout = Layout(576)
+    layout.text(20, 0, "-" * 50, "item")                   # 620 dots of 12-dot characters
+    layout.text(400, 30, "Table : T4", "header")           # 24-dot characters from x=400
+    layout.text(580, 30, "X", "item")                      # past the right edge
+    data = target.encode(layout, cut=False)
+    assert b"\x1b$\x14\x00" + b"-" * 46 + b"\x1bJ" in data  # (576 - 20) // 12
+    assert b"\x1b$\x90\x01Table :\x1bJ" in data             # (576 - 400) // 24 = 7 characters
+    assert b"X" not in data
+
+
+def test_escpos_splits_long_feeds():
+    target = EscPosTarget(font_specs={"a": {}})
+    layout = Layout(576)
+    layout.text(0, 0, "A", "a")
+    layout.text(0, 300, "B", "a")
+    data = target.encode(layout, cut=False)
+    assert b"A\x1bJ\xff\x1bJ\x2d" in data                  # 300 = 255 + 45
+    assert data.endswith(b"B\x1bJ\x18")                     # last row: one Font A line
+    assert not data.endswith(ESC_CUT)
+
+
+def test_png_draws_every_line():
+    Image = pytest.importorskip("PIL.Image")
+    target = PngTarget(print_server.FONTS)
+    layout = print_server.layout_ticket(TICKET, target)
+    image = Image.open(io.BytesIO(target.render(layout)))
+    assert image.format == "PNG" and image.size == (576, layout.height)
+    for y, runs in layout.rows():
+        for run in runs:
+            width = max(target.measure(run.text, run.font), 1)
+            ink = image.crop((run.x, y, min(run.x + width, 576), y + 20)).getextrema()[0]
+            assert ink < 128, run
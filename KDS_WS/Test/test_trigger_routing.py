@@ -0,0 +1,73 @@
+from trigger_routing import StationIndex, TriggerChange, parse_trigger_message
+
+
+def change(kot_nos=(), i_codes=()):
+    c = TriggerChange()
+    c.kot_nos |= {str(k) for k in kot_nos}
+    c.i_codes |= {str(i) for i in i_codes}
+    return c
+
+
+def tickets(*kots):
+    """[{"kot_no", "items"}] from (kot_no, [i_code, ...]) pairs."""
+    return [{"kot_no": kot, "items": [{"i_code": code} for code in codes]} for kot, codes in kots]
+
+
+# ------------------- Parsing -------------------
+def test_parse_json_object_and_list():
+    parsed = parse_trigger_message('[{"KOT_NO": 12, "BillNO": "B1", "I_Code": "A"}, {"kot_no": 13, "i_code": "B"}]')
+    assert (parsed.kot_nos, parsed.bill_nos, parsed.i_codes) == ({"12", "13"}, {"B1"}, {"A", "B"})
+
+
+def test_parse_for_xml_fragment():
+    parsed = parse_trigger_message('<row KOT_NO="7" I_Code="A"/><row><KOT_NO>8</KOT_NO><I_Code>B</I_Code></row>')
+    assert (parsed.kot_nos, parsed.i_codes) == ({"7", "8"}, {"A", "B"})
+
+
+def test_parse_key_value_pairs():
+    parsed = parse_trigger_message("KOT_NO=42; I_Code=X1, BillNO=B9")
+    assert (parsed.kot_nos, parsed.bill_nos, parsed.i_codes) == ({"42"}, {"B9"}, {"X1"})
+
+
+def test_parse_unusable_bodies_are_unknown():
+    assert parse_trigger_message("") is None
+    assert parse_trigger_message("{not json") is None
+    assert parse_trigger_message('{"BillNO": "B1"}') is None     # no KOT or item to route by
+    assert parse_trigger_message("KOT Change") is None
+
+
+# ------------------- Station Routing -------------------
+def test_routes_by_kot_and_learned_item_codes():
+    index = StationIndex()
+    stations = {"GRILL": tickets((1, ["A"])), "BAR": tickets((2, ["B"]))}
+    assert index.stations_for(change(kot_nos=[1]), stations) == {"GRILL"}
+    assert index.stations_for(change(i_codes=["B"]), stations) == {"BAR"}
+
+
+def test_unknown_item_code_is_unknown():
+    index = StationIndex()
+    assert index.stations_for(change(i_codes=["Z"]), {"GRILL": tickets((1, ["A"]))}) is None
+
+
+def test_new_kot_is_unknown_even_with_known_item_codes():
+    index = StationIndex()
+    stations = {"BAR": tickets((1, ["X"]))}
+    assert index.stations_for(change(kot_nos=[1], i_codes=["X"]), stations) == {"BAR"}
+    # KOT 2 is on no screen yet: it could belong to a station that never showed X
+    assert index.stations_for(change(kot_nos=[2], i_codes=["X"]), stations) is None
+
+
+def test_screen_types_keep_separate_indexes():
+    main, kds_del = StationIndex(), StationIndex()
+    main.stations_for(change(kot_nos=[1]), {"BAR": tickets((1, ["X"]))})
+    # The EXPO screen has never shown X: it must not be routed to nowhere
+    assert kds_del.stations_for(change(i_codes=["X"]), {"EXPO": tickets((5, ["Y"]))}) is None
+    assert main.stations_for(change(i_codes=["X"]), {"BAR": tickets((1, ["X"]))}) == {"BAR"}
+
+
+def test_reset_forgets_learned_items():
+    index = StationIndex()
+    stations = {"GRILL": tickets((1, ["A"]))}
+    index.learn(stations)
+    index.reset()
+    assert index.stations_for(change(i_codes=["A"]), {"GRILL": []}) is None
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from websockets.exceptions import ConnectionClosed
+
+log = logging.getLogger(__name__)
+
+
+class ClientOutbox:
+    """Bounded outbound queue for one WebSocket, drained by its own writer task.
+
+    offer() never waits. Messages queued with a key are latest-wins: a newer
+    snapshot for the same key replaces the one still waiting. Messages without a
+    key (print commands) are always delivered in order. A message may also be a
+    callable, resolved by the writer right before sending (returning None skips it).
+    A client whose queue overflows or whose send stalls past `send_timeout` is
+    disconnected.
+    """
+
+    def __init__(self, websocket, max_queued=16, send_timeout=5.0, send_seconds=None, on_sent=None):
+        self.websocket = websocket
+        self.max_queued = max_queued
+        self.send_timeout = send_timeout
+        self.send_seconds = send_seconds      # optional histogram with observe(seconds)
+        self.on_sent = on_sent                # optional on_sent(websocket) after each send
+        self.closed = False
+
+        # Measurements for slow-consumer detection and monitoring
+        self.sent = 0
+        self.superseded = 0
+        self.last_send_seconds = 0.0
+        self.max_send_seconds = 0.0
+
+        self._pending = OrderedDict()
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def offer(self, message, key=None):
+        """Queue `message` (str or callable) for sending; returns False if the client is gone."""
+        if self.closed:
+            return False
+        if key is None:
+            self._seq += 1
+            key = self._seq
+        elif key in self._pending:
+            del self._pending[key]
+            self.superseded += 1
+        self._pending[key] = message
+        if len(self._pending) > self.max_queued:
+            self._disconnect(f"{len(self._pending)} messages queued")
+            return False
+        self._wakeup.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._pending:
+                    _, message = self._pending.popitem(last=False)
+                    if callable(message):
+                        message = message()
+                        if message is None:
+                            continue
+                    started = time.perf_counter()
+                    try:
+                        await asyncio.wait_for(self.websocket.send(message), self.send_timeout)
+                    except asyncio.TimeoutError:
+                        self._disconnect(f"send stalled for more than {self.send_timeout}s")
+                        return
+                    elapsed = time.perf_counter() - started
+                    self.sent += 1
+                    self.last_send_seconds = elapsed
+                    if self.send_seconds is not None:
+                        self.send_seconds.observe(elapsed)
+                    if self.on_sent is not None:
+                        self.on_sent(self.websocket)
+                    if elapsed > self.max_send_seconds:
+                        self.max_send_seconds = elapsed
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            log.error("❌ Client writer error: %s", e)
+        finally:
+            self.closed = True
+            self._pending.clear()
+
+    def _disconnect(self, reason):
+        if self.closed:
+            return
+        self.closed = True
+        self._pending.clear()
+        log.warning("🐢 Dropping slow client (%s)", reason)
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        asyncio.create_task(self.websocket.close(1013, "slow consumer"))
+
+    def close(self):
+        """Stop the writer task; called when the connection handler exits."""
+        self.closed = True
+        self._pending.clear()
+        self._task.cancel()
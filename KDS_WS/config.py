@@ -4,6 +4,11 @@ HTTP_PORT = 9090
 WS_PORT_KDS = 9999
 WS_PORT_KDS_DEL = 9998
 
+# Data source: "sqlserver" (production, DB_CONN_STR) or "sqlite" (local file at
+# SQLITE_PATH with the same tables/procedure semantics, for running off-site)
+DATA_SOURCE = "sqlserver"
+SQLITE_PATH = "kds_local.db"     # relative to KDS_WS
+
 # Database connection string (update for your setup)
 DB_CONN_STR = (
     "DRIVER={ODBC Driver 17 for SQL Server};"
@@ -13,5 +18,87 @@ DB_CONN_STR = (
     "PWD=hello213;"
 )
 
+# DB connection pool
+DB_POOL_SIZE = 8                 # max open connections shared by all DB helpers
+DB_POOL_MAX_IDLE = 300           # seconds; idle connections older than this are closed
+DB_POOL_HEALTH_CHECK_AFTER = 30  # seconds idle before a connection is pinged on borrow
+DB_POOL_ACQUIRE_TIMEOUT = 10     # seconds to wait for a free connection
+
+# Async DB layer (blocking pyodbc calls run on a worker pool, never on the event loop)
+DB_WORKERS = 8                   # keep <= DB_POOL_SIZE so workers never wait on the pool
+DB_READ_TIMEOUT = 10             # seconds a WebSocket handler waits for a fetch
+DB_WRITE_TIMEOUT = 15            # seconds a WebSocket handler waits for an update
+DB_QUERY_TIMEOUT = 20            # ODBC statement timeout so timed-out calls free their worker
+
+# WebSocket keepalive: one shared ping round for all screens every N seconds;
+# a screen that has not answered the previous round is disconnected
+WS_PING_INTERVAL = 20
+
+# Per-client outbound queues: snapshots are latest-wins, so a slow screen only ever
+# has a few messages waiting; past these limits it is disconnected and reconnects
+WS_OUTBOX_MAX = 16               # queued messages before a client counts as stalled
+WS_SEND_TIMEOUT = 5              # seconds a single send may take
+
+# Service Broker listener: triggers arriving within the window are drained in
+# batched RECEIVEs and handled with one refresh per station
+TRIGGER_WAIT_MS = 10000          # WAITFOR timeout while the queue is idle
+TRIGGER_COALESCE_WINDOW_MS = 50  # how long to keep collecting after the first message
+TRIGGER_BATCH_SIZE = 500         # max messages per RECEIVE
+
+# Targeted refresh: parse KOT/bill/item from the trigger body and refetch only the
+# stations that show them; unknown items or unparseable bodies refresh everything
+TARGETED_REFRESH = True
+FULL_REFRESH_INTERVAL = 60       # seconds between safety-net full refreshes (0 = off)
+
+# Station refresh workers (single-flight per station, shared by both screens)
+REFRESH_WORKERS = 4
+
+# Log a refresh -> broadcast round trip that takes longer than this (seconds)
+SLOW_REFRESH_SECONDS = 0.5
+
+# Apply toggle/ack taps to the cache and broadcast them before the stored
+# procedure runs (write-behind); False waits for the write and a refetch first
+OPTIMISTIC_WRITES = True
+
+# Batched item writes: ack_ticket / toggle_ticket send all items in one call to
+# these procedures (data/KDS_Batch_Updates.sql); if they are not installed the
+# per-item procedures are used. False always uses the per-item path.
+KDS_BATCH_WRITES = True
+KDS_ACCEPT_BATCH_PROC = "dbo.USP_Accept_kds_Batch"
+KDS_DEL_BATCH_PROC = "dbo.USP_UPDATE_KDS_DEL_Batch"
+
+# Per-change latency tracing (trigger/tap -> refresh -> encode -> send -> client ack),
+# kept in memory and served at http://<host>:9090/traces?minutes=5&kot=123
+TRACING = True
+TRACE_BUFFER_SIZE = 2000         # most recent traces kept
+TRACE_MAX_AGE = 900              # seconds /traces looks back by default
+
+# Logging: records go through an in-memory queue to a background writer, so a
+# blocked console (text selected in the window) or slow disk never stalls the server
+LOG_DIR = "logs"                 # <LOG_DIR>/server.log, rotated; "" for console only
+LOG_LEVEL = "INFO"
+LOG_FILE_FORMAT = "text"         # "text" or "json" (one object per line)
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_RATE_BURST = 5               # identical warnings/errors let through per window...
+LOG_RATE_WINDOW = 10.0           # ...of this many seconds; the rest are counted and summarized
+
+# Event-loop lag monitor: a timer probe measures how late the loop wakes up and a
+# watchdog thread names the handler/action of each stall (kds_loop_* metrics); nothing
+# in asyncio is patched and the cost is one timer per interval, so it stays on
+LOOP_MONITOR = True
+LOOP_LAG_INTERVAL = 0.25         # seconds between lag probes
+LOOP_SLOW_CALLBACK = 0.1         # a stall this long is reported with its handler/action
+
+# Food summary source: "cache" derives per-item totals from the station's tickets
+# (one query per refresh); "procedure" calls USP_Get_KDS_Summary as before
+SUMMARY_SOURCE = "cache"
+
+# Station load mode when several stations refresh at once:
+#   "per_station" - one USP_Get_KDS_Data / USP_GET_KDS_DEL_Data round trip per @KDS
+#   "bulk"        - one round trip for all of them: a single batch that runs the
+#                   procedure once per @KDS, read back one result set per station
+KDS_LOAD_MODE = "per_station"
+
 # Optional: If set, WebSocket clients must pass token in URL: ws://host:9999?token=YOUR_TOKEN
 SECRET_TOKEN = ""   # leave empty for now to keep open access
@@ -0,0 +1,60 @@
+-- ==================== KDS batched item updates ====================
+-- Lets server.py send every item of an ack / bump in one call instead of one
+-- EXEC per item. Each batch procedure runs the existing per-item procedure for
+-- every row inside one transaction, so behaviour is unchanged.
+-- Run once against the POS database; server.py falls back to the per-item
+-- procedures while these do not exist.
+
+IF TYPE_ID(N'dbo.KDS_ItemList') IS NULL
+    CREATE TYPE dbo.KDS_ItemList AS TABLE (
+        KOT_NO  NVARCHAR(50) NOT NULL,
+        I_Code  NVARCHAR(50) NOT NULL,
+        BillNO  NVARCHAR(50) NULL
+    );
+GO
+
+CREATE OR ALTER PROCEDURE dbo.USP_Accept_kds_Batch
+    @Items dbo.KDS_ItemList READONLY
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
+    DECLARE @KOT_NO NVARCHAR(50), @I_Code NVARCHAR(50), @BillNO NVARCHAR(50);
+    DECLARE items CURSOR LOCAL FAST_FORWARD FOR SELECT KOT_NO, I_Code, BillNO FROM @Items;
+
+    BEGIN TRANSACTION;
+    OPEN items;
+    FETCH NEXT FROM items INTO @KOT_NO, @I_Code, @BillNO;
+    WHILE @@FETCH_STATUS = 0
+    BEGIN
+        EXEC dbo.USP_Accept_kds @KOT_NO, @I_Code, @BillNO;
+        FETCH NEXT FROM items INTO @KOT_NO, @I_Code, @BillNO;
+    END
+    CLOSE items;
+    COMMIT TRANSACTION;
+END
+GO
+
+CREATE OR ALTER PROCEDURE dbo.USP_UPDATE_KDS_DEL_Batch
+    @Items dbo.KDS_ItemList READONLY
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
+    DECLARE @KOT_NO NVARCHAR(50), @I_Code NVARCHAR(50), @BillNO NVARCHAR(50);
+    DECLARE items CURSOR LOCAL FAST_FORWARD FOR SELECT KOT_NO, I_Code, BillNO FROM @Items;
+
+    BEGIN TRANSACTION;
+    OPEN items;
+    FETCH NEXT FROM items INTO @KOT_NO, @I_Code, @BillNO;
+    WHILE @@FETCH_STATUS = 0
+    BEGIN
+        EXEC dbo.USP_UPDATE_KDS_DEL @KOT_NO, @I_Code, @BillNO;
+        FETCH NEXT FROM items INTO @KOT_NO, @I_Code, @BillNO;
+    END
+    CLOSE items;
+    COMMIT TRANSACTION;
+END
+GO
@@ -0,0 +1,434 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import config
+
+log = logging.getLogger(__name__)
+
+
+# ------------------- Contract -------------------
+# Every data source provides the operations server.py needs. Fetches return rows
+# with the USP_* column names as attributes (KOT_NO, I_Code, order_status, ...):
+#
+#   kds_rows(kds_name)            USP_Get_KDS_Data
+#   summary_rows(kds_name)        USP_Get_KDS_Summary
+#   kds_del_rows(kds_name)        USP_GET_KDS_DEL_Data
+#   delivered_rows(kds_name)      USP_Get_KDS_Delivered_Data
+#   kds_rows_bulk(kds_names)      USP_Get_KDS_Data for several stations at once -> {kds_name: rows}
+#   kds_del_rows_bulk(kds_names)  USP_GET_KDS_DEL_Data for several stations at once -> {kds_name: rows}
+#
+#   accept_items(rows)            USP_Accept_kds for each (kot_no, i_code, bill_no), one transaction
+#   update_kds_del_items(rows)    USP_UPDATE_KDS_DEL for each (kot_no, i_code, bill_no), one transaction
+#   cancel_ticket(kot_no)         Cancel_Type = 1 on every row of the KOT
+#   recall_item(kot_no, i_code, bill_no)   USP_Recall_KDS_DEL_Data
+#
+#   open_listener()               trigger queue: receive(timeout_ms) -> [(handle, type, body)],
+#                                 end(batch) after handling, close()
+#
+# Errors are raised to the caller, which logs them.
+
+TRIGGER_MESSAGE = "KDS_TriggerMessage"
+
+# Contract operation -> the SQL Server procedure / statement behind it (metric labels)
+PROCEDURES = {
+    "kds_rows": "USP_Get_KDS_Data",
+    "summary_rows": "USP_Get_KDS_Summary",
+    "kds_del_rows": "USP_GET_KDS_DEL_Data",
+    "delivered_rows": "USP_Get_KDS_Delivered_Data",
+    "kds_rows_bulk": "USP_Get_KDS_Data (bulk)",
+    "kds_del_rows_bulk": "USP_GET_KDS_DEL_Data (bulk)",
+    "accept_items": "USP_Accept_kds",
+    "update_kds_del_items": "USP_UPDATE_KDS_DEL",
+    "cancel_ticket": "UPDATE tbl_TempKot Cancel_Type",
+    "recall_item": "USP_Recall_KDS_DEL_Data",
+}
+
+
+# ------------------- SQL Server -------------------
+class SqlServerSource:
+    """The production contract: USP_* procedures, tbl_TempKot and the KDS_TriggerQueue Service Broker queue."""
+
+    def __init__(self, conn_str):
+        from db_pool import ConnectionPool
+        import pyodbc
+
+        self.conn_str = conn_str
+        self._pyodbc = pyodbc
+        self.pool = ConnectionPool(
+            conn_str,
+            max_size=config.DB_POOL_SIZE,
+            max_idle=config.DB_POOL_MAX_IDLE,
+            health_check_after=config.DB_POOL_HEALTH_CHECK_AFTER,
+            acquire_timeout=config.DB_POOL_ACQUIRE_TIMEOUT,
+            query_timeout=config.DB_QUERY_TIMEOUT,
+        )
+        # Batch procedures found missing (see data/KDS_Batch_Updates.sql)
+        self.missing_batch_procs = set()
+
+    def _fetch(self, sql, *params):
+        with self.pool.connection() as (conn, cursor):
+            cursor.execute(sql, *params)
+            return cursor.fetchall()
+
+    # ---------- Fetches ----------
+    def kds_rows(self, kds_name):
+        return self._fetch("EXEC dbo.USP_Get_KDS_Data @KDS =?", kds_name)
+
+    def summary_rows(self, kds_name):
+        return self._fetch("EXEC dbo.USP_Get_KDS_Summary @KDS = ?", kds_name)
+
+    def kds_del_rows(self, kds_name):
+        return self._fetch("EXEC dbo.USP_GET_KDS_DEL_Data @KDS = ?", kds_name)
+
+    def delivered_rows(self, kds_name):
+        return self._fetch("EXEC dbo.USP_Get_KDS_Delivered_Data @KDS = ?", kds_name)
+
+    def _fetch_stations(self, procedure, kds_names):
+        """Run `procedure` for every station in one batch: one round trip, one result set per station."""
+        kds_names = list(kds_names)
+        sql = "".join(f"EXEC {procedure} @KDS = ?;\n" for _ in kds_names)
+        with self.pool.connection() as (conn, cursor):
+            cursor.execute(sql, *kds_names)
+            return dict(zip(kds_names, result_sets(cursor, len(kds_names))))
+
+    def kds_rows_bulk(self, kds_names):
+        return self._fetch_stations("dbo.USP_Get_KDS_Data", kds_names)
+
+    def kds_del_rows_bulk(self, kds_names):
+        return self._fetch_stations("dbo.USP_GET_KDS_DEL_Data", kds_names)
+
+    # ---------- Writes ----------
+    def _exec_item_batch(self, cursor, batch_proc, item_proc, rows):
+        """Run `item_proc` for every row; one round trip when `batch_proc` exists.
+
+        All rows go to the batch procedure as one table-valued parameter
+        (dbo.KDS_ItemList). Until it is installed the per-item procedure runs
+        once per row, still inside the caller's transaction.
+        """
+        if not rows:
+            return
+        if config.KDS_BATCH_WRITES and batch_proc not in self.missing_batch_procs:
+            try:
+                cursor.execute(f"EXEC {batch_proc} ?", [rows])
+                return
+            except self._pyodbc.Error as e:
+                # SQL Server error 2812: Could not find stored procedure
+                if "2812" not in str(e) and "Could not find stored procedure" not in str(e):
+                    raise
+                self.missing_batch_procs.add(batch_proc)
+                log.warning("❌ %s not installed, using %s per item", batch_proc, item_proc)
+        for row in rows:
+            cursor.execute(f"EXEC {item_proc} ?, ?, ?", *row)
+
+    def accept_items(self, rows):
+        with self.pool.connection() as (conn, cursor):
+            self._exec_item_batch(cursor, config.KDS_ACCEPT_BATCH_PROC, "dbo.USP_Accept_kds", rows)
+            conn.commit()
+
+    def update_kds_del_items(self, rows):
+        with self.pool.connection() as (conn, cursor):
+            self._exec_item_batch(cursor, config.KDS_DEL_BATCH_PROC, "dbo.USP_UPDATE_KDS_DEL", rows)
+            conn.commit()
+
+    def cancel_ticket(self, kot_no):
+        with self.pool.connection() as (conn, cursor):
+            cursor.execute("UPDATE tbl_TempKot SET Cancel_Type = 1 WHERE KOT_NO = ?", kot_no)
+            conn.commit()
+
+    def recall_item(self, kot_no, i_code, bill_no):
+        with self.pool.connection() as (conn, cursor):
+            cursor.execute("EXEC dbo.USP_Recall_KDS_DEL_Data ?, ?, ?", kot_no, i_code, bill_no)
+            conn.commit()
+
+    # ---------- Listener ----------
+    def open_listener(self):
+        return ServiceBrokerListener(self._pyodbc.connect(self.conn_str, timeout=60))
+
+    def close(self):
+        self.pool.close_all()
+
+
+def result_sets(cursor, count):
+    """Rows of the next `count` result sets of a batch.
+
+    Row counts are skipped (a procedure without SET NOCOUNT ON reports one per
+    statement); a batch that yields fewer result sets raises RuntimeError.
+    """
+    sets = []
+    while True:
+        if cursor.description is not None:
+            sets.append(cursor.fetchall())
+            if len(sets) == count:
+                return sets
+        if not cursor.nextset():
+            raise RuntimeError(f"Expected {count} result sets, got {len(sets)}")
+
+
+class ServiceBrokerListener:
+    """Dedicated connection that RECEIVEs from KDS_TriggerQueue."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    def receive(self, timeout_ms):
+        """One batched RECEIVE: every queued message (up to TRIGGER_BATCH_SIZE) in a single round trip."""
+        self.cursor.execute(f"""
+            WAITFOR (
+                RECEIVE TOP({int(config.TRIGGER_BATCH_SIZE)})
+                    conversation_handle,
+                    message_type_name,
+                    CAST(message_body AS NVARCHAR(MAX))
+                FROM KDS_TriggerQueue
+            ), TIMEOUT {int(timeout_ms)};
+        """)
+        return self.cursor.fetchall()
+
+    def end(self, batch):
+        for conversation_handle in {row[0] for row in batch}:
+            self.cursor.execute("END CONVERSATION ?", conversation_handle)
+        self.conn.commit()
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+# ------------------- SQLite -------------------
+# Local stand-in for the POS database so the server can run (and be load-tested)
+# without SQL Server. One table models tbl_TempKot plus the KDS columns the
+# procedures read; item status follows the same life cycle:
+#
+#   order_status 0 Pending -> USP_Accept_kds (ack_status 1, ready_status 1, ready_date)
+#   USP_Accept_kds again   -> ack_status 0, ready_status 0 (un-ack)
+#   USP_UPDATE_KDS_DEL     -> ready items: order_status 2 Delivered
+#   USP_Recall_KDS_DEL     -> order_status 0, back on KDS_DEL as ready
+#
+# Row triggers queue a KDS_TriggerMessage (JSON KOT_NO / BillNO / I_Code) for
+# every insert or update, like the Service Broker triggers on tbl_TempKot.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tbl_TempKot (
+    id           INTEGER PRIMARY KEY,
+    KOT_NO       INTEGER NOT NULL,
+    BillNO       TEXT,
+    TableName    TEXT,
+    CreatedOn    TEXT,
+    comments     TEXT DEFAULT '',
+    Cancel_Type  INTEGER DEFAULT 0,
+    bill_type    TEXT DEFAULT '',
+    I_Code       TEXT NOT NULL,
+    I_Name       TEXT,
+    Qty          INTEGER DEFAULT 1,
+    KDS          TEXT NOT NULL,
+    order_status INTEGER DEFAULT 0,
+    ack_status   INTEGER DEFAULT 0,
+    ready_status INTEGER DEFAULT 0,
+    ready_date   TEXT,
+    stwd         TEXT DEFAULT '',
+    cashier      TEXT DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS ix_tempkot_kds ON tbl_TempKot (KDS, order_status);
+CREATE INDEX IF NOT EXISTS ix_tempkot_kot ON tbl_TempKot (KOT_NO, I_Code);
+
+CREATE TABLE IF NOT EXISTS KDS_TriggerQueue (
+    id                INTEGER PRIMARY KEY AUTOINCREMENT,   -- never reused; the listener reads past the last id
+    message_type_name TEXT NOT NULL,
+    message_body      TEXT
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_tempkot_insert AFTER INSERT ON tbl_TempKot
+BEGIN
+    INSERT INTO KDS_TriggerQueue (message_type_name, message_body)
+    VALUES ('KDS_TriggerMessage', json_object('KOT_NO', NEW.KOT_NO, 'BillNO', NEW.BillNO, 'I_Code', NEW.I_Code));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tempkot_update AFTER UPDATE ON tbl_TempKot
+BEGIN
+    INSERT INTO KDS_TriggerQueue (message_type_name, message_body)
+    VALUES ('KDS_TriggerMessage', json_object('KOT_NO', NEW.KOT_NO, 'BillNO', NEW.BillNO, 'I_Code', NEW.I_Code));
+END;
+"""
+
+KDS_COLUMNS = ("KOT_NO, BillNO, TableName, CreatedOn, comments, Cancel_Type, bill_type, "
+               "I_Code, I_Name, Qty, order_status, ack_status")
+KDS_DEL_COLUMNS = ("KOT_NO, BillNO, TableName, I_Code, I_Name, Qty, stwd, ready_date, bill_type, "
+                   "cashier, ready_status, order_status")
+STATION = "(KDS = ? OR ? = 'NONE')"
+
+_row_types = {}
+
+def _row_factory(cursor, values):
+    # Attribute access like pyodbc.Row, so the same builders work on both sources
+    names = tuple(d[0] for d in cursor.description)
+    row_type = _row_types.get(names)
+    if row_type is None:
+        row_type = _row_types[names] = namedtuple("Row", names)
+    return row_type(*values)
+
+
+class SqliteSource:
+    """The KDS contract on a local SQLite file (see SQLITE_SCHEMA)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = _row_factory
+        return conn
+
+    @property
+    def conn(self):
+        # One connection per thread; SQLite serializes the writers
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _fetch(self, sql, *params):
+        return self.conn.execute(sql, params).fetchall()
+
+    # ---------- Fetches ----------
+    def kds_rows(self, kds_name):
+        return self._fetch(f"SELECT {KDS_COLUMNS} FROM tbl_TempKot "
+                           f"WHERE {STATION} AND order_status < 2 ORDER BY KOT_NO, id",
+                           kds_name, kds_name)
+
+    def summary_rows(self, kds_name):
+        return self._fetch(f"SELECT I_Name, SUM(Qty) AS Qty FROM tbl_TempKot "
+                           f"WHERE {STATION} AND order_status < 2 AND Cancel_Type = 0 "
+                           f"GROUP BY I_Code, I_Name ORDER BY I_Name",
+                           kds_name, kds_name)
+
+    def kds_del_rows(self, kds_name):
+        return self._fetch(f"SELECT {KDS_DEL_COLUMNS} FROM tbl_TempKot "
+                           f"WHERE {STATION} AND order_status < 2 AND Cancel_Type = 0 ORDER BY KOT_NO, id",
+                           kds_name, kds_name)
+
+    def delivered_rows(self, kds_name):
+        return self._fetch(f"SELECT {KDS_DEL_COLUMNS} FROM tbl_TempKot "
+                           f"WHERE {STATION} AND order_status = 2 ORDER BY ready_date DESC, KOT_NO, id",
+                           kds_name, kds_name)
+
+    def _fetch_stations(self, columns, where, kds_names):
+        # One query for every open row, split by station in memory; NONE sees all of them
+        rows = self._fetch(f"SELECT {columns}, KDS FROM tbl_TempKot WHERE {where} ORDER BY KOT_NO, id")
+        by_station = {}
+        for row in rows:
+            by_station.setdefault(row.KDS, []).append(row)
+        return {kds_name: rows if kds_name == "NONE" else by_station.get(kds_name, []) for kds_name in kds_names}
+
+    def kds_rows_bulk(self, kds_names):
+        return self._fetch_stations(KDS_COLUMNS, "order_status < 2", kds_names)
+
+    def kds_del_rows_bulk(self, kds_names):
+        return self._fetch_stations(KDS_DEL_COLUMNS, "order_status < 2 AND Cancel_Type = 0", kds_names)
+
+    # ---------- Writes ----------
+    def accept_items(self, rows):
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.conn as conn:
+            for kot_no, i_code, bill_no in rows:
+                conn.execute(
+                    "UPDATE tbl_TempKot SET ack_status = 1 - ack_status, ready_status = 1 - ack_status, "
+                    "ready_date = CASE WHEN ack_status = 0 THEN ? ELSE ready_date END "
+                    "WHERE KOT_NO = ? AND I_Code = ? AND order_status < 2",
+                    (now, kot_no, str(i_code)))
+
+    def update_kds_del_items(self, rows):
+        with self.conn as conn:
+            for kot_no, i_code, bill_no in rows:
+                conn.execute(
+                    "UPDATE tbl_TempKot SET order_status = 2 "
+                    "WHERE KOT_NO = ? AND I_Code = ? AND ready_status = 1 AND order_status < 2",
+                    (kot_no, str(i_code)))
+
+    def cancel_ticket(self, kot_no):
+        with self.conn as conn:
+            conn.execute("UPDATE tbl_TempKot SET Cancel_Type = 1 WHERE KOT_NO = ?", (kot_no,))
+
+    def recall_item(self, kot_no, i_code, bill_no):
+        with self.conn as conn:
+            conn.execute("UPDATE tbl_TempKot SET order_status = 0 "
+                         "WHERE KOT_NO = ? AND I_Code = ? AND order_status = 2",
+                         (kot_no, str(i_code)))
+
+    # ---------- POS side (seeding and simulation) ----------
+    def insert_kot(self, kot_no, kds_name, items, bill_no=None, table_name="", bill_type="Dine In",
+                   comments="", stwd="", cashier=""):
+        """Add a KOT the way the POS would; `items` is [(i_code, name, qty), ...]."""
+        created = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.conn as conn:
+            conn.executemany(
+                "INSERT INTO tbl_TempKot (KOT_NO, BillNO, TableName, CreatedOn, comments, bill_type, "
+                "I_Code, I_Name, Qty, KDS, stwd, cashier) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(kot_no, bill_no, table_name, created, comments, bill_type,
+                  str(i_code), name, qty, kds_name, stwd, cashier) for i_code, name, qty in items])
+
+    def clear(self):
+        with self.conn as conn:
+            conn.execute("DELETE FROM tbl_TempKot")
+            conn.execute("DELETE FROM KDS_TriggerQueue")
+
+    # ---------- Listener ----------
+    def open_listener(self):
+        return SqliteTriggerListener(self)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SqliteTriggerListener:
+    """Polls KDS_TriggerQueue; end() deletes what was handled, like END CONVERSATION."""
+
+    POLL_SECONDS = 0.02
+
+    def __init__(self, source):
+        self.conn = source._connect()
+        self._last_id = 0         # messages are handed out once, like RECEIVE
+
+    def receive(self, timeout_ms):
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            rows = self.conn.execute(
+                "SELECT id, message_type_name, message_body FROM KDS_TriggerQueue "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (self._last_id, int(config.TRIGGER_BATCH_SIZE))).fetchall()
+            if rows:
+                self._last_id = rows[-1][0]
+                return [tuple(row) for row in rows]
+            if time.monotonic() >= deadline:
+                return []
+            time.sleep(min(self.POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+
+    def end(self, batch):
+        with self.conn as conn:
+            conn.executemany("DELETE FROM KDS_TriggerQueue WHERE id = ?", [(row[0],) for row in batch])
+
+    def close(self):
+        self.conn.close()
+
+
+# ------------------- Factory -------------------
+def make_data_source():
+    """Data source selected by config.DATA_SOURCE ("sqlserver" or "sqlite")."""
+    if config.DATA_SOURCE == "sqlite":
+        path = config.SQLITE_PATH
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        return SqliteSource(path)
+    return SqlServerSource(config.DB_CONN_STR)
@@ -0,0 +1,174 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
+
+import pyodbc
+
+
+class PooledConnection:
+    """One ODBC connection plus the cursor that is reused for every borrow."""
+
+    __slots__ = ("conn", "cursor", "created", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def close(self):
+        try:
+            self.cursor.close()
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Bounded pool of pyodbc connections.
+
+    - at most ``max_size`` connections exist at once; borrowers wait for a free one
+    - connections idle longer than ``max_idle`` seconds are closed instead of reused
+    - connections idle longer than ``health_check_after`` seconds are pinged first
+    - each connection keeps a single cursor that is handed out on every borrow
+    """
+
+    def __init__(self, conn_str, max_size=8, max_idle=300, health_check_after=30,
+                 acquire_timeout=10, query_timeout=0):
+        self.conn_str = conn_str
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.query_timeout = query_timeout
+        self._idle = deque()          # most recently used on the right
+        self._size = 0                # idle + borrowed connections
+        self._cond = Condition()
+
+    @property
+    def size(self):
+        """Open connections, idle or borrowed."""
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    # ------------------- Borrow / Return -------------------
+    @contextmanager
+    def connection(self):
+        """Borrow ``(conn, cursor)``; returned to the pool when the block exits."""
+        pc = self._acquire()
+        try:
+            yield pc.conn, pc.cursor
+        except Exception:
+            self._release(pc, reusable=self._rollback(pc))
+            raise
+        else:
+            self._release(pc, reusable=self._drain(pc))
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No DB connection free after {self.acquire_timeout}s")
+                    self._cond.wait(remaining)
+                if not self._idle:
+                    self._size += 1
+                    break
+                pc = self._idle.pop()
+
+            # The candidate still counts towards _size, so it can be pinged or
+            # closed outside the lock without a dead connection stalling others
+            if self._usable(pc):
+                return pc
+            pc.close()
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+
+        # Connect outside the lock so other borrowers are not held up by the login
+        try:
+            conn = pyodbc.connect(self.conn_str)
+            if self.query_timeout:
+                conn.timeout = self.query_timeout
+            return PooledConnection(conn)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, pc, reusable=True):
+        now = time.monotonic()
+        with self._cond:
+            if reusable:
+                pc.last_used = now
+                self._idle.append(pc)
+            else:
+                self._size -= 1
+            stale = self._evict_idle(now)
+            self._cond.notify()
+        # Closing can block on the network, so it happens outside the lock
+        if not reusable:
+            pc.close()
+        for old in stale:
+            old.close()
+
+    # ------------------- Health -------------------
+    def _usable(self, pc):
+        idle_for = time.monotonic() - pc.last_used
+        if idle_for > self.max_idle:
+            return False
+        if idle_for > self.health_check_after:
+            try:
+                pc.cursor.execute("SELECT 1")
+                pc.cursor.fetchall()
+            except Exception:
+                return False
+        return True
+
+    def _evict_idle(self, now):
+        """Take connections idle past max_idle out of the pool (caller holds the lock and closes them)."""
+        stale = []
+        # Oldest idle connections sit on the left
+        while self._idle and now - self._idle[0].last_used > self.max_idle:
+            self._size -= 1
+            stale.append(self._idle.popleft())
+        return stale
+
+    @staticmethod
+    def _drain(pc):
+        """Discard unread result sets so the cursor is clean for the next borrower."""
+        try:
+            while pc.cursor.nextset():
+                pass
+            return True
+        except pyodbc.ProgrammingError:
+            # Raised when there was no result set at all
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _rollback(pc):
+        try:
+            pc.conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for pc in idle:
+            pc.close()
@@ -0,0 +1,184 @@
+"""Queue-based logging for the KDS server and the print servers.
+
+Callers only put a record on a bounded in-memory queue; a background thread
+writes the log file and hands each line to a second thread for the console.
+A Windows console that is blocked (e.g. text selected in the window) or a slow
+disk therefore never stalls the asyncio loop, the SQL listener or a print
+request: when a queue is full, records are dropped and counted instead.
+
+Repeated warnings/errors with the same message template ("DB Error: %s" in a
+retry loop) are rate limited; the next one let through says how many were
+suppressed.
+
+    kds_log.setup("server")                  # once, at startup
+    log = logging.getLogger("server")        # in any module
+    log.error("❌ DB Error: %s", e)
+    log.info("KOT change", extra={"fields": {"kot_no": 12, "station": "GRILL"}})
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+TEXT_FORMAT = "%(asctime)s.%(msecs)03d %(levelname)-7s %(name)s: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listeners = []
+
+
+class DropQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record and counts it."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most `burst` records per `window` seconds for each repeated warning/error."""
+
+    def __init__(self, burst=5, window=10.0, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._seen = {}           # (logger, level, template) -> [window start, count]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                suppressed = entry[1] - self.burst if entry and entry[1] > self.burst else 0
+                self._seen[key] = [now, 1]
+                if len(self._seen) > 1000:
+                    self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+            else:
+                entry[1] += 1
+                if entry[1] > self.burst:
+                    return False
+                suppressed = 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, DATE_FORMAT)
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (suppressed {suppressed} similar)"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, thread, msg, any extra `fields`."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SafeStreamHandler(logging.StreamHandler):
+    """Console handler that survives consoles that cannot encode emoji (cp1252 on Windows)."""
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            try:
+                self.stream.write(msg + self.terminator)
+            except UnicodeEncodeError:
+                encoding = getattr(self.stream, "encoding", None) or "ascii"
+                self.stream.write(msg.encode(encoding, "replace").decode(encoding) + self.terminator)
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+def setup(name, log_dir="logs", level="INFO", file_format="text", max_bytes=10 * 1024 * 1024,
+          backups=5, queue_size=10000, console=True, burst=5, window=10.0):
+    """Route the root logger through the queue; files go to <log_dir>/<name>.log (rotated).
+
+    Safe to call more than once; later calls are ignored.
+    """
+    root = logging.getLogger()
+    if any(isinstance(h, DropQueueHandler) for h in root.handlers):
+        return root
+    root.setLevel(level)
+
+    file_handlers = []
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, f"{name}.log"), maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter() if file_format == "json" else TextFormatter())
+        file_handlers.append(file_handler)
+
+    if console:
+        # The console gets its own queue and thread, so a frozen console only
+        # drops console lines and the file keeps being written
+        console_queue = queue.Queue(queue_size)
+        console_handler = SafeStreamHandler(sys.stdout)
+        console_handler.setFormatter(TextFormatter())
+        _listeners.append(logging.handlers.QueueListener(console_queue, console_handler))
+        file_handlers.append(DropQueueHandler(console_queue))
+
+    records = queue.Queue(queue_size)
+    _listeners.append(logging.handlers.QueueListener(records, *file_handlers))
+    for listener in _listeners:
+        listener.start()
+
+    handler = DropQueueHandler(records)
+    handler.addFilter(RateLimitFilter(burst=burst, window=window))
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    return root
+
+
+def dropped():
+    """Records dropped because a queue was full (logging fell behind)."""
+    handlers = [h for h in logging.getLogger().handlers if isinstance(h, DropQueueHandler)]
+    for listener in _listeners:
+        handlers += [h for h in listener.handlers if isinstance(h, DropQueueHandler)]
+    return sum(h.dropped for h in handlers)
+
+
+def shutdown():
+    """Flush what is queued (e.g. before exit)."""
+    while _listeners:
+        _listeners.pop().stop()
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_app_code(code):
+    return code.co_filename != __file__ and os.path.dirname(os.path.abspath(code.co_filename)) == APP_DIR
+
+
+def _name_frames(frames):
+    """(handler, action) from this app's frames, outermost first."""
+    if not frames:
+        return None
+    handler = frames[0].f_code.co_name
+    try:
+        action = frames[0].f_locals.get("action")
+    except Exception:
+        action = None
+    return handler, action if isinstance(action, str) else ""
+
+
+_HANDLE_RUN = asyncio.events.Handle._run.__code__
+
+
+def describe_stack(frame):
+    """(handler, action, "function:line") for a live stack (what the loop thread is stuck in).
+
+    Only the frames of the callback the loop is running count: the handler is
+    the outermost app function above Handle._run and action its `action` local;
+    the line is the innermost app function's current line.
+    """
+    frames = []
+    while frame is not None and frame.f_code is not _HANDLE_RUN:
+        if _is_app_code(frame.f_code):
+            frames.append(frame)
+        frame = frame.f_back
+    if not frames:
+        return None
+    handler, action = _name_frames(frames[::-1])
+    return handler, action, f"{frames[0].f_code.co_name}:{frames[0].f_lineno}"
+
+
+class LoopMonitor:
+    """Measures event-loop lag and names the handlers that stalled it.
+
+    - A probe callback is scheduled with loop.call_later every `interval` seconds
+      and records how late it ran (lag_seconds): what every timer, ping and send
+      is delayed by. Nothing in asyncio is patched; the loop runs as it would
+      without the monitor.
+    - A watchdog thread notices when the probe is `slow_after` seconds overdue
+      and reads the loop thread's stack while it is still blocked, so the stall
+      is reported with the handler and action it was in (slow_seconds labelled
+      handler/action, e.g. ws_kds_del_handler/toggle_ticket) and the line.
+    """
+
+    def __init__(self, interval=0.25, slow_after=0.1, lag_seconds=None, slow_seconds=None):
+        self.interval = interval
+        self.slow_after = slow_after
+        self.lag_seconds = lag_seconds       # histogram with observe(seconds)
+        self.slow_seconds = slow_seconds     # histogram with labels(handler, action)
+        self.max_lag = 0.0                   # worst sampled lag since start
+        self.max_callback = 0.0              # longest single stall since start
+        self._loop = None
+        self._thread_id = None
+        self._handle = None
+        self._due = None                     # perf_counter() the next probe should run at
+        self._seen = None                    # (due, (handler, action, where)) seen by the watchdog
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start monitoring; call from the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._schedule(time.perf_counter())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+        self._due = None
+
+    def _schedule(self, now):
+        self._due = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._probe)
+
+    def _probe(self):
+        now = time.perf_counter()
+        due = self._due
+        lag = max(now - due, 0.0)
+        seen = self._seen[1] if self._seen and self._seen[0] == due else None
+        self._schedule(now)
+        if self.lag_seconds is not None:
+            self.lag_seconds.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.slow_after:
+            self._report(lag, seen)
+
+    def _report(self, stall, seen):
+        handler, action, where = seen or ("event_loop", "", "")
+        self.max_callback = max(self.max_callback, stall)
+        if self.slow_seconds is not None:
+            self.slow_seconds.labels(handler, action).observe(stall)
+        label = f"{handler}/{action}" if action else handler
+        log.warning("🐢 Event loop blocked %.0f ms by %s%s", stall * 1000, label, f" at {where}" if where else "")
+
+    def _watchdog(self):
+        # Poll at a fraction of the threshold so a stall is caught while the loop is still stuck
+        tick = self.slow_after / 4
+        while not self._stopped.wait(tick):
+            due = self._due
+            if due is None or time.perf_counter() - due < self.slow_after:
+                continue
+            if self._seen is not None and self._seen[0] == due:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None and self._due == due:
+                self._seen = (due, describe_stack(frame))
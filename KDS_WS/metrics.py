@@ -0,0 +1,149 @@
+"""Minimal Prometheus text-format metrics, cheap enough for the hot paths.
+
+Label children are created once and cached, so recording a value is an integer
+add (Counter) or a bisect plus two adds (Histogram): no string formatting and no
+locks. Updates from different DB worker threads can, rarely, lose an increment;
+for monitoring that is an acceptable trade. All formatting happens in render(),
+when /metrics is scraped.
+"""
+from bisect import bisect_left
+
+# Seconds; covers a 1 ms cache hit up to a 10 s DB timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_label_text(self.label_names, values)} {child.value}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, seconds):
+        self.labels().observe(seconds)
+
+    def render(self):
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), list(child.counts)):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _label_text(self.label_names + ("le",), values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """Gauge read at scrape time: `fn()` returns a number, or {label values tuple: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labels=()):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def render(self):
+        lines = self._header()
+        try:
+            value = self.fn()
+        except Exception as e:
+            return lines + [f"# {self.name} unavailable: {e}"]
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        for values, v in list(samples):
+            lines.append(f"{self.name}{_label_text(self.label_names, values)} {v}")
+        return lines
+
+
+class CounterFunc(GaugeFunc):
+    """Counter kept elsewhere (e.g. an attribute), read at scrape time."""
+
+    kind = "counter"
+
+
+def render():
+    """All registered metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,135 @@
+import itertools
+import logging
+import queue
+from threading import Lock, Thread
+
+log = logging.getLogger(__name__)
+
+
+# ------------------- Transitions -------------------
+# A transition shows what the stored procedure will do to a cached ticket, so the
+# refetch that reconciles it finds the same thing (see the life cycle in
+# data_source.py). It returns a copy, or None when the ticket leaves the list;
+# the cached ticket is never modified in place, since VersionedCache diffs each
+# new value against the previous one.
+def accept_items(i_codes):
+    """USP_Accept_kds on a main KDS ticket: it toggles ack_status of each item in `i_codes`."""
+    codes = {str(code) for code in i_codes}
+
+    def apply(ticket):
+        items = [{**item, "ack_status": 0 if int(item.get("ack_status") or 0) == 1 else 1}
+                 if str(item.get("i_code", "")) in codes else item
+                 for item in ticket.get("items", [])]
+        return {**ticket, "items": items}
+    return apply
+
+
+def deliver_items(i_codes):
+    """USP_UPDATE_KDS_DEL on a KDS_DEL ticket: the ready items in `i_codes` are delivered.
+
+    Delivered items (order_status 2) are no longer returned by USP_GET_KDS_DEL_Data,
+    so they leave the ticket, and the ticket leaves the list once it is empty.
+    """
+    codes = {str(code) for code in i_codes}
+
+    def apply(ticket):
+        items = [item for item in ticket.get("items", [])
+                 if not (str(item.get("i_code", "")) in codes and int(item.get("ready_status") or 0) == 1)]
+        if not items:
+            return None
+        ready = sum(1 for item in items if int(item.get("ready_status") or 0) == 1)
+        status = 2 if ready == len(items) else 1 if ready else 0
+        return {**ticket, "items": items, "ticketstatus": status}
+    return apply
+
+
+class PendingTransitions:
+    """Ticket transitions shown ahead of their DB write, keyed by KOT.
+
+    Every value stored in a cache is passed through apply(), so a refresh that
+    read the DB before the write landed still shows the transition. A
+    transition is discarded once its write succeeds (the DB now agrees) or
+    fails (the next value shown is the DB's, which rolls it back).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}        # id -> (kot_no, transition), in tap order
+
+    def add(self, kot_no, transition):
+        with self._lock:
+            transition_id = next(self._ids)
+            self._pending[transition_id] = (str(kot_no), transition)
+            return transition_id
+
+    def discard(self, transition_id):
+        with self._lock:
+            self._pending.pop(transition_id, None)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def apply(self, tickets):
+        """`tickets` with pending transitions applied; the same list if none apply."""
+        with self._lock:
+            pending = list(self._pending.values())
+        if not pending:
+            return tickets
+        by_kot = {}
+        for kot_no, transition in pending:
+            by_kot.setdefault(kot_no, []).append(transition)
+        if not any(str(t.get("kot_no")) in by_kot for t in tickets):
+            return tickets
+        result = []
+        for ticket in tickets:
+            for transition in by_kot.get(str(ticket.get("kot_no")), ()):
+                ticket = transition(ticket)
+                if ticket is None:
+                    break
+            else:
+                result.append(ticket)
+        return result
+
+
+# ------------------- Write-Behind -------------------
+class WriteBehindQueue:
+    """Runs DB writes in tap order on one background thread.
+
+    submit() returns immediately. `func` reports failure by raising or by
+    returning False; `done(ok)` is then called on the worker thread.
+    """
+
+    def __init__(self, name="kds-write-behind"):
+        self._queue = queue.Queue()
+        self._thread = Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+        # Counters for monitoring
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, func, *args, done=None):
+        self._queue.put((func, args, done))
+
+    def _worker(self):
+        while True:
+            func, args, done = self._queue.get()
+            try:
+                ok = func(*args) is not False
+            except Exception as e:
+                log.error("❌ Write-behind %s failed: %s", getattr(func, "__name__", func), e)
+                ok = False
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            if done is not None:
+                try:
+                    done(ok)
+                except Exception as e:
+                    log.error("❌ Write-behind callback error: %s", e)
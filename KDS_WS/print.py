@@ -1,163 +1,171 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import json
-import win32print
-import win32ui
+import logging
 from datetime import datetime
 from threading import Thread
+import kds_log
+from print_http import PooledHTTPServer, PrintRequestHandler
+from print_queue import PrintQueue, PrintWorker
+from printer_context import PrinterCache, PrinterContext
+from ticket_layout import EscPosTarget, Layout
 
 PORT = 1000  # local print server port
-
-# ------------------- Print Function -------------------
-def print_ticket(ticket):
-    try:
-        printer_name = win32print.GetDefaultPrinter()
-        if not printer_name:
-            print("⚠️ No default printer found")
-            return
-
-        # --- Printer DC ---
-        pdc = win32ui.CreateDC()
-        pdc.CreatePrinterDC(printer_name)
-        pdc.StartDoc("KOT Ticket")
-        pdc.StartPage()
-
-        # --- Margins ---
-        y_start = 0
-        x_start = 20
-        right_padding = 10
-
-        # --- Fonts ---
-        header_font = win32ui.CreateFont({"name": "Consolas", "height": 40, "weight": 700})
-        subheader_font = win32ui.CreateFont({"name": "Consolas", "height": 30, "weight": 700})
-        item_font = win32ui.CreateFont({"name": "Consolas", "height": 28, "weight": 700})
-        footer_font = win32ui.CreateFont({"name": "Consolas", "height": 28, "weight": 400})
-
-        line_height_header = 55
-        line_height_subheader = 40
-        line_height_item = 30
-
-        printable_width = pdc.GetDeviceCaps(8)  # HORZRES
-
-        # --- Header ---
-        bill_type = ticket.get("bill_type", "N/A")
-        bill_type = "Table" if bill_type == "Table billing" else bill_type
-        table_no = ticket.get("table_no", "")
-        kot_no = ticket.get("kot_no", "")
-        bill_no = ticket.get("bill_no", "")
-
-        header_text = f"{bill_type} : {table_no}" if bill_type == "Table" else bill_type
-        pdc.SelectObject(header_font)
-        width = pdc.GetTextExtent(header_text)[0]
-        center_x = (printable_width - width) // 2
-        pdc.TextOut(center_x, y_start, header_text)
-        y_start += line_height_header
-
-        pdc.SelectObject(subheader_font)
-        subheader_text = f"Bill:{bill_no} | KOT:{kot_no}"
-        pdc.TextOut(x_start, y_start, subheader_text)
-        y_start += line_height_subheader
-
-        # --- Date/Time ---
-        now = datetime.now()
-        date_str = now.strftime("%Y-%m-%d")
-        time_str = now.strftime("%H:%M:%S")
-        pdc.TextOut(x_start, y_start, f"Date: {date_str}    Time: {time_str}")
-        y_start += line_height_subheader
-
-        # --- Items Header ---
-        pdc.TextOut(x_start, y_start, "ITEM")
-        qty_width = pdc.GetTextExtent("QTY")[0]
-        qty_x = printable_width - qty_width - right_padding
-        pdc.TextOut(qty_x, y_start, "QTY")
+QUEUE_PATH = "print_jobs.db"   # durable job queue; unprinted jobs survive a restart
+MAX_ATTEMPTS = 3               # a job is retried this many times before it is marked failed
+HTTP_WORKERS = 8               # threads serving (keep-alive) connections
+PRINT_BACKEND = "gdi"          # "gdi" (printer driver) or "escpos" (raw bytes, thermal printers)
+
+log = logging.getLogger("print")
+
+# Fonts are created once per printer and reused for every ticket; the ESC/POS
+# and PNG targets scale their own fonts from the same specs
+FONTS = {
+    "header": {"name": "Consolas", "height": 40, "weight": 700},
+    "subheader": {"name": "Consolas", "height": 30, "weight": 700},
+    "item": {"name": "Consolas", "height": 28, "weight": 700},
+    "footer": {"name": "Consolas", "height": 28, "weight": 400},
+}
+printers = PrinterCache(FONTS, factory=EscPosTarget if PRINT_BACKEND == "escpos" else PrinterContext)
+
+# ------------------- Ticket Layout -------------------
+def layout_ticket(ticket, target):
+    """Lay out a KOT for `target` (GDI printer, ESC/POS or PNG; see ticket_layout)."""
+    # --- Margins ---
+    y_start = 0
+    x_start = 20
+    right_padding = 10
+
+    line_height_header = 55
+    line_height_subheader = 40
+    line_height_item = 30
+
+    printable_width = target.printable_width
+    layout = Layout(printable_width)
+
+    # --- Header ---
+    bill_type = ticket.get("bill_type", "N/A")
+    bill_type = "Table" if bill_type == "Table billing" else bill_type
+    table_no = ticket.get("table_no", "")
+    kot_no = ticket.get("kot_no", "")
+    bill_no = ticket.get("bill_no", "")
+
+    header_text = f"{bill_type} : {table_no}" if bill_type == "Table" else bill_type
+    width = target.measure(header_text, "header")
+    center_x = (printable_width - width) // 2
+    layout.text(center_x, y_start, header_text, "header")
+    y_start += line_height_header
+
+    subheader_text = f"Bill:{bill_no} | KOT:{kot_no}"
+    layout.text(x_start, y_start, subheader_text, "subheader")
+    y_start += line_height_subheader
+
+    # --- Date/Time ---
+    now = datetime.now()
+    date_str = now.strftime("%Y-%m-%d")
+    time_str = now.strftime("%H:%M:%S")
+    layout.text(x_start, y_start, f"Date: {date_str}    Time: {time_str}", "subheader")
+    y_start += line_height_subheader
+
+    # --- Items Header ---
+    layout.text(x_start, y_start, "ITEM", "subheader")
+    qty_width = target.measure("QTY", "subheader")
+    qty_x = printable_width - qty_width - right_padding
+    layout.text(qty_x, y_start, "QTY", "subheader")
+    y_start += line_height_item
+
+    # --- Items ---
+    items = ticket.get("items", [])
+    for item in items:
+        name = str(item.get("name", ""))
+        qty = str(item.get("qty", ""))
+        # Wrap long names (layouts are cached per name and width)
+        max_width = qty_x - x_start - 5
+        *head, name = target.wrap(name, max_width, font="item")
+        for line in head:
+            layout.text(x_start, y_start, line, "item")
+            y_start += line_height_item
+        layout.text(x_start, y_start, name, "item")
+        layout.text(qty_x, y_start, qty, "item")
         y_start += line_height_item
 
-        # --- Items ---
-        pdc.SelectObject(item_font)
-        items = ticket.get("items", [])
-        for item in items:
-            name = str(item.get("name", ""))
-            qty = str(item.get("qty", ""))
-            # Wrap long names
-            max_width = qty_x - x_start - 5
-            while pdc.GetTextExtent(name)[0] > max_width:
-                # Find break point
-                for i in range(len(name)-1, 0, -1):
-                    if pdc.GetTextExtent(name[:i])[0] <= max_width:
-                        pdc.TextOut(x_start, y_start, name[:i])
-                        name = name[i:].lstrip()
-                        y_start += line_height_item
-                        break
-            pdc.TextOut(x_start, y_start, name)
-            pdc.TextOut(qty_x, y_start, qty)
-            y_start += line_height_item
+    # --- Footer ---
+    layout.text(x_start, y_start, "-" * 50, "item")
+    y_start += line_height_item
 
-        # --- Footer ---
-        pdc.TextOut(x_start, y_start, "-" * 50)
+    stwd = ticket.get("stwd", "")
+    if stwd:
+        layout.text(x_start, y_start, f"Steward: {stwd}  Items: {len(items)}", "item")
         y_start += line_height_item
 
-        stwd = ticket.get("stwd", "")
-        if stwd:
-            pdc.TextOut(x_start, y_start, f"Steward: {stwd}  Items: {len(items)}")
-            y_start += line_height_item
+    footer_text = "KDS PRINT"
+    width = target.measure(footer_text, "footer")
+    center_x = (printable_width - width) // 2
+    layout.text(center_x, y_start, footer_text, "footer")
+    layout.end(y_start + line_height_item)
+    return layout
 
-        pdc.SelectObject(footer_font)
-        footer_text = "KDS PRINT"
-        width = pdc.GetTextExtent(footer_text)[0]
-        center_x = (printable_width - width) // 2
-        pdc.TextOut(center_x, y_start, footer_text)
+# ------------------- Print Function -------------------
+def print_ticket(ticket):
+    try:
+        printer = printers.get()
+        if printer is None:
+            log.warning("⚠️ No default printer found")
+            return False
 
-        # --- End Print ---
-        pdc.EndPage()
-        pdc.EndDoc()
-        pdc.DeleteDC()
-        print(f"✅ Printed ticket #{kot_no}")
+        # Laid out once, then drawn through GDI or streamed as ESC/POS (PRINT_BACKEND)
+        printer.render(layout_ticket(ticket, printer), "KOT Ticket")
+        log.info("✅ Printed ticket #%s", ticket.get("kot_no", ""))
+        return True
 
     except Exception as e:
-        print("❌ Print error:", e)
+        log.error("❌ Print error: %s", e)
+        printers.invalidate()   # rebuild the printer target for the next ticket
+        return False
 
 # ------------------- HTTP Handler -------------------
-class Handler(BaseHTTPRequestHandler):
-    def _set_headers(self):
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self._set_headers()
-        self.end_headers()
-
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        body = self.rfile.read(content_length)
-        try:
-            data = json.loads(body)
-            ticket = data.get("ticket")
-            if ticket:
-                print_ticket(ticket)
-            self.send_response(200)
-            self._set_headers()
-            self.end_headers()
-            self.wfile.write(b"Printed")
-        except Exception as e:
-            self.send_response(500)
-            self._set_headers()
-            self.end_headers()
-            self.wfile.write(f"Error: {e}".encode())
+def make_handler(print_jobs):
+    """Request handler class that queues posted tickets on `print_jobs` (a PrintQueue)."""
+
+    class Handler(PrintRequestHandler):
+        def handle_tickets(self, tickets):
+            # Queued on disk and printed by the worker; the request does not wait for the printer
+            job_ids = print_jobs.submit_many(tickets)
+            payload = {"job_ids": job_ids, "status": "queued"}
+            if len(job_ids) == 1:
+                payload["job_id"] = job_ids[0]
+            return 200, payload
+
+        def do_GET(self):
+            # /jobs -> counts per status, /jobs/<id> -> one job's status
+            parts = self.path.split("?", 1)[0].strip("/").split("/")
+            if parts == ["jobs"]:
+                return self.reply(200, print_jobs.counts())
+            if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+                job = print_jobs.status(int(parts[1]))
+                return self.reply(200, job) if job else self.reply(404, {"error": "unknown job"})
+            self.reply(404, {"error": "not found"})
+
+    return Handler
+
+def make_server(print_jobs, host="0.0.0.0", port=PORT):
+    """HTTP print server queueing on `print_jobs`; call serve_forever() to run it."""
+    return PooledHTTPServer((host, port), make_handler(print_jobs), workers=HTTP_WORKERS)
 
 # ------------------- Run Server -------------------
 if __name__ == "__main__":
+    kds_log.setup("print")
+    print_jobs = PrintQueue(QUEUE_PATH)
+    PrintWorker(print_jobs, print_ticket, max_attempts=MAX_ATTEMPTS).start()
+
     def run_print_server():
-        server = HTTPServer(("0.0.0.0", PORT), Handler)
-        print(f"✅ Local print server running at http://0.0.0.0:{PORT}")
+        server = make_server(print_jobs)
+        log.info("✅ Local print server running at http://0.0.0.0:%d", PORT)
         server.serve_forever()
 
     Thread(target=run_print_server, daemon=True).start()
-    print("Press Ctrl+C to stop the server")
+    log.info("Press Ctrl+C to stop the server")
     try:
         import time
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("\n❌ Server stopped manually")
+        log.info("❌ Server stopped manually")
+        kds_log.shutdown()
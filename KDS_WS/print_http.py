@@ -0,0 +1,91 @@
+import abc
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+log = logging.getLogger(__name__)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles each connection on a fixed pool of threads.
+
+    With HTTP/1.1 keep-alive a connection holds its thread while it is open, so
+    the handler's `timeout` closes idle connections and gives the thread back.
+    The threads are daemons: an idle keep-alive connection never delays exit.
+    """
+
+    def __init__(self, address, handler, workers=8):
+        super().__init__(address, handler)
+        self._connections = queue.Queue()
+        for n in range(workers):
+            threading.Thread(target=self._work, name=f"print-http-{n}", daemon=True).start()
+
+    def process_request(self, request, client_address):
+        self._connections.put((request, client_address))
+
+    def _work(self):
+        while True:
+            request, client_address = self._connections.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class PrintRequestHandler(BaseHTTPRequestHandler, metaclass=abc.ABCMeta):
+    """Keep-alive JSON handler for the print servers.
+
+    POST accepts {"ticket": {...}}, {"tickets": [...]} or a bare list, so a
+    "bump all ready" on the expo screen is one request; subclasses implement
+    handle_tickets(tickets) -> (status code, payload). The CORS preflight is
+    cacheable, so a browser sends it once rather than before every POST.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = 30                  # seconds an idle keep-alive connection is kept
+
+    def log_message(self, format, *args):
+        log.debug("HTTP %s " + format, self.address_string(), *args)
+
+    def _set_headers(self):
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Max-Age", "86400")
+
+    def reply(self, code, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(code)
+        self._set_headers()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        self.reply(200)
+
+    def do_POST(self):
+        content_length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(content_length)
+        try:
+            data = json.loads(body)
+            if isinstance(data, list):
+                tickets = data
+            elif data.get("tickets") is not None:
+                tickets = list(data["tickets"])
+            else:
+                tickets = [data["ticket"]] if data.get("ticket") else []
+            if not tickets:
+                return self.reply(400, {"error": "no ticket"})
+            self.reply(*self.handle_tickets(tickets))
+        except Exception as e:
+            self.reply(500, {"error": str(e)})
+
+    @abc.abstractmethod
+    def handle_tickets(self, tickets):
+        """Handle the posted tickets; returns (status code, JSON payload)."""
@@ -0,0 +1,165 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS print_jobs (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket   TEXT NOT NULL,
+    status   TEXT NOT NULL DEFAULT 'queued',   -- queued, printing, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error    TEXT,
+    created  REAL NOT NULL,
+    updated  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS print_jobs_status ON print_jobs (status, id);
+"""
+
+
+class PrintQueue:
+    """Durable print job queue in a SQLite file.
+
+    A job is committed to disk before submit() returns its ID, and stays until
+    it has printed; jobs that were printing when the process stopped are queued
+    again on start, so a restart reprints rather than loses a ticket.
+    """
+
+    def __init__(self, path="print_jobs.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        requeued = self._execute("UPDATE print_jobs SET status = 'queued', updated = ? WHERE status = 'printing'",
+                                 (time.time(),)).rowcount
+        if requeued:
+            log.warning("↩️ Requeued %d print jobs interrupted by a restart", requeued)
+        self._ready.set()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def submit(self, ticket):
+        """Store a ticket for printing; returns the job ID."""
+        now = time.time()
+        job_id = self._execute("INSERT INTO print_jobs (ticket, created, updated) VALUES (?, ?, ?)",
+                               (json.dumps(ticket), now, now)).lastrowid
+        self._ready.set()
+        return job_id
+
+    def submit_many(self, tickets):
+        """Store several tickets in one transaction (one disk sync); returns their job IDs in order."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                job_ids = [self._conn.execute("INSERT INTO print_jobs (ticket, created, updated) VALUES (?, ?, ?)",
+                                              (json.dumps(ticket), now, now)).lastrowid for ticket in tickets]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._ready.set()
+        return job_ids
+
+    def claim(self, timeout=1.0):
+        """Oldest queued job as (id, ticket, attempts), marked printing; None if none arrives in `timeout`."""
+        while True:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT id, ticket, attempts FROM print_jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE print_jobs SET status = 'printing', attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (time.time(), row["id"]))
+                    return row["id"], json.loads(row["ticket"]), row["attempts"] + 1
+                self._ready.clear()
+            if not self._ready.wait(timeout):
+                return None
+
+    def finish(self, job_id, ok, error=None):
+        self._execute("UPDATE print_jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                      ("done" if ok else "failed", error, time.time(), job_id))
+
+    def retry(self, job_id, error):
+        """Put a job back in the queue after a failed attempt."""
+        self._execute("UPDATE print_jobs SET status = 'queued', error = ?, updated = ? WHERE id = ?",
+                      (error, time.time(), job_id))
+        self._ready.set()
+
+    def status(self, job_id):
+        row = self._execute("SELECT id, status, attempts, error, created, updated FROM print_jobs WHERE id = ?",
+                            (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def counts(self):
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM print_jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def purge(self, older_than):
+        """Delete finished jobs last updated more than `older_than` seconds ago."""
+        return self._execute("DELETE FROM print_jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                             (time.time() - older_than,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PrintWorker:
+    """Dedicated thread that prints queued jobs one after another.
+
+    `print_func(ticket)` returns True when printed; False or an exception is a
+    failed attempt, retried after `retry_delay` seconds up to `max_attempts`.
+    """
+
+    def __init__(self, queue, print_func, max_attempts=3, retry_delay=2.0, keep_finished=7 * 24 * 3600):
+        self.queue = queue
+        self.print_func = print_func
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.keep_finished = keep_finished
+        self._thread = threading.Thread(target=self._run, name="print-worker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        last_purge = 0.0
+        while True:
+            if time.monotonic() - last_purge > 3600:
+                last_purge = time.monotonic()
+                try:
+                    self.queue.purge(self.keep_finished)
+                except Exception as e:
+                    log.error("❌ Print queue purge failed: %s", e)
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                log.error("❌ Print queue error: %s", e)
+                time.sleep(self.retry_delay)
+                continue
+            if job is None:
+                continue
+            job_id, ticket, attempt = job
+            try:
+                ok, error = bool(self.print_func(ticket)), None
+            except Exception as e:
+                ok, error = False, str(e)
+            if ok:
+                self.queue.finish(job_id, True)
+            elif attempt < self.max_attempts:
+                log.warning("⚠️ Print job %s failed (attempt %d/%d), retrying", job_id, attempt, self.max_attempts)
+                time.sleep(self.retry_delay)
+                self.queue.retry(job_id, error or "print failed")
+            else:
+                log.error("❌ Print job %s failed after %d attempts: %s", job_id, attempt, error or "print failed")
+                self.queue.finish(job_id, False, error or "print failed")
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+
+from text_wrap import TextWrapper
+
+log = logging.getLogger(__name__)
+
+HORZRES = 8                       # GetDeviceCaps index: printable width in pixels
+
+
+class PrinterContext:
+    """Long-lived GDI resources for one printer: its DC, fonts, width and character widths.
+
+    A printer DC can run any number of StartDoc/EndDoc jobs, and fonts are
+    independent of the DC, so all of it is created once and reused per ticket.
+    Text is measured and wrapped by a TextWrapper per font (one GetTextExtent
+    per distinct character, wrapped item names memoized).
+    """
+
+    def __init__(self, printer_name, font_specs):
+        import win32ui
+
+        self.printer_name = printer_name
+        self.dc = win32ui.CreateDC()
+        self.dc.CreatePrinterDC(printer_name)
+        self.printable_width = self.dc.GetDeviceCaps(HORZRES)
+        self.fonts = {name: win32ui.CreateFont(spec) for name, spec in font_specs.items()}
+        self.wrappers = {name: TextWrapper(lambda ch, font=name: self._measure_char(font, ch))
+                         for name in font_specs}
+        self._current = None
+
+    def select(self, font):
+        """Make `font` (a key of font_specs) the DC's current font."""
+        if font != self._current:
+            self.dc.SelectObject(self.fonts[font])
+            self._current = font
+
+    def measure(self, text, font=None):
+        """Width of `text` in the current font (or `font`), from cached character widths."""
+        return self.wrappers[font or self._current].width(text)
+
+    def wrap(self, text, max_width, mode="chars", font=None):
+        """Lines of `text` that fit `max_width` in the current font (or `font`); see TextWrapper.wrap."""
+        return self.wrappers[font or self._current].wrap(text, max_width, mode)
+
+    def _measure_char(self, font, ch):
+        current = self._current
+        self.select(font)
+        width = self.dc.GetTextExtent(ch)[0]
+        if current is not None:
+            self.select(current)
+        return width
+
+    def start_job(self, title="KOT Ticket"):
+        self.dc.StartDoc(title)
+        self.dc.StartPage()
+
+    def end_job(self):
+        self.dc.EndPage()
+        self.dc.EndDoc()
+
+    def render(self, layout, title="KOT Ticket"):
+        """Print a ticket_layout.Layout as one GDI job."""
+        self.start_job(title)
+        for run in layout.runs:
+            self.select(run.font)
+            self.dc.TextOut(run.x, run.y, run.text)
+        self.end_job()
+
+    def close(self):
+        try:
+            self.dc.DeleteDC()
+        except Exception:
+            pass
+
+
+class PrinterCache:
+    """Hands out the print target for the default printer, building it on first use.
+
+    `factory(printer_name, font_specs)` builds the target: PrinterContext (GDI)
+    or ticket_layout.EscPosTarget (raw ESC/POS). The default printer is looked
+    up at most every `check_every` seconds; when it changed, or a job reported an
+    error (invalidate()), the target is rebuilt.
+    """
+
+    def __init__(self, font_specs, check_every=30.0, factory=PrinterContext):
+        self.font_specs = font_specs
+        self.check_every = check_every
+        self.factory = factory
+        self._context = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Current context, or None when there is no default printer."""
+        import win32print
+
+        with self._lock:
+            now = time.monotonic()
+            if self._context is None or now - self._checked >= self.check_every:
+                printer_name = win32print.GetDefaultPrinter()
+                self._checked = now
+                if self._context is not None and self._context.printer_name != printer_name:
+                    log.info("🖨️ Default printer changed to %s", printer_name)
+                    self._drop()
+                if self._context is None and printer_name:
+                    self._context = self.factory(printer_name, self.font_specs)
+            return self._context
+
+    def invalidate(self):
+        """Drop the context after an error; the next get() builds a fresh one."""
+        with self._lock:
+            self._drop()
+
+    def _drop(self):
+        if self._context is not None:
+            self._context.close()
+            self._context = None
@@ -0,0 +1,101 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+
+class RefreshScheduler:
+    """Bounded worker pool that runs at most one refresh per key at a time.
+
+    request() returns a concurrent.futures.Future for the refresh that will
+    cover the caller:
+
+    - nothing running for the key: a refresh starts now
+    - a refresh is running: the caller joins a single trailing refresh that
+      starts when the running one finishes, so a write made before the request
+      is always seen; any number of requests made meanwhile share that one run
+    - ``join_running=True``: the caller is happy with the refresh already in
+      flight (e.g. it only needs the cache to be filled at all)
+
+    request_many() runs one refresh for several keys (a bulk load) under the
+    same rule, so no two fetches for a key ever overlap and an older result
+    can never overwrite a newer one.
+    """
+
+    def __init__(self, max_workers=4, thread_name_prefix="kds-refresh"):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = Lock()
+        self._running = {}        # key -> Future of the refresh in flight
+        self._trailing = {}       # key -> (Future, func, args) to run once it finishes
+
+        # Counters for monitoring
+        self.started = 0
+        self.joined = 0
+
+    def request(self, key, func, *args, join_running=False):
+        with self._lock:
+            running = self._running.get(key)
+            if running is None:
+                future = Future()
+                self._running[key] = future
+                self._start([key], future, func, args)
+                return future
+            self.joined += 1
+            if join_running:
+                return running
+            trailing = self._trailing.get(key)
+            if trailing is None:
+                trailing = self._trailing[key] = (Future(), func, args)
+            return trailing[0]
+
+    def request_many(self, keys, func, single):
+        """Futures covering every key in `keys` ({key: arg}).
+
+        The keys with nothing running are refreshed together by one
+        ``func([arg, ...])``, which holds all of them until it finishes; keys
+        already in flight get a trailing ``single(arg)`` through request().
+        """
+        with self._lock:
+            idle = {key: arg for key, arg in keys.items() if key not in self._running}
+            futures = []
+            if idle:
+                future = Future()
+                for key in idle:
+                    self._running[key] = future
+                self._start(list(idle), future, func, (list(idle.values()),))
+                futures.append(future)
+        for key, arg in keys.items():
+            if key not in idle:
+                futures.append(self.request(key, single, arg))
+        return futures
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._running
+
+    def _start(self, keys, future, func, args):
+        # Called with the lock held
+        self.started += 1
+        self._executor.submit(self._run, keys, future, func, args)
+
+    def _run(self, keys, future, func, args):
+        # A waiter giving up cancels the shared future; the refresh still runs for the others
+        notify = future.set_running_or_notify_cancel()
+        try:
+            result = func(*args)
+        except BaseException as e:
+            if notify:
+                future.set_exception(e)
+        else:
+            if notify:
+                future.set_result(result)
+        finally:
+            with self._lock:
+                for key in keys:
+                    trailing = self._trailing.pop(key, None)
+                    if trailing is None:
+                        del self._running[key]
+                    else:
+                        self._running[key] = trailing[0]
+                        self._start([key], *trailing)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,26 +1,92 @@
 import asyncio
+import functools
 import json
 import logging
+import math
 import websockets
-import pyodbc
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from http.server import SimpleHTTPRequestHandler, HTTPServer
 from threading import Thread
+from urllib.parse import parse_qs
 import time
-import win32print
-import win32ui
 import config
+import kds_log
+import metrics
+from client_outbox import ClientOutbox
+from data_source import PROCEDURES, TRIGGER_MESSAGE, make_data_source
+from loop_monitor import LoopMonitor
+from optimistic import PendingTransitions, WriteBehindQueue, accept_items, deliver_items
+from refresh_scheduler import RefreshScheduler
+from snapshot_cache import StationSummary, VersionedCache
+from tracing import TraceBuffer
+from trigger_routing import StationIndex, TriggerChange, parse_trigger_message
+
+log = logging.getLogger("server")
+
+# ------------------- Metrics -------------------
+# Served at http://<host>:9090/metrics; gauges are read at scrape time
+db_call_seconds = metrics.Histogram("kds_db_call_seconds", "Stored procedure call duration", ["procedure"])
+db_call_errors = metrics.Counter("kds_db_call_errors_total", "Stored procedure calls that raised", ["procedure"])
+cache_refreshes = metrics.Counter("kds_cache_refresh_total", "Station cache refreshes from the DB", ["screen", "station"])
+trigger_messages = metrics.Counter("kds_trigger_messages_total", "Service Broker KDS_TriggerMessage messages received")
+trigger_rounds = metrics.Counter("kds_trigger_refresh_rounds_total", "Refresh rounds after coalescing trigger messages", ["scope"])
+broadcast_seconds = metrics.Histogram("kds_broadcast_seconds", "Broadcast fan-out duration (queueing to every client)", ["screen"])
+ws_send_seconds = metrics.Histogram("kds_ws_send_seconds", "Duration of one WebSocket send", ["port"])
+loop_lag_seconds = metrics.Histogram("kds_loop_lag_seconds", "How late the event loop woke up for a timer",
+                                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+loop_slow_seconds = metrics.Histogram("kds_loop_slow_callback_seconds", "Event loop stalls by the handler and action running",
+                                      ["handler", "action"])
+
+class TimedSource:
+    """Data source wrapper that records duration and errors of every contract call."""
+
+    def __init__(self, source):
+        self.source = source
+        for name, procedure in PROCEDURES.items():
+            setattr(self, name, self._timed(getattr(source, name), procedure))
+
+    @staticmethod
+    def _timed(func, procedure):
+        seconds = db_call_seconds.labels(procedure)
+        errors = db_call_errors.labels(procedure)
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - started)
+        return call
 
+    def __getattr__(self, name):
+        return getattr(self.source, name)
 
 # ------------------- DB Connection -------------------
-def get_db_connection():
-    try:
-        return pyodbc.connect(config.DB_CONN_STR)
-    except Exception as e:
-        logging.error(f"DB connection failed: {e}")
-        return None
+# SQL Server (pooled pyodbc) in production, SQLite for running off-site; see data_source.py
+data_source = TimedSource(make_data_source())
+
+# ------------------- Async DB Layer -------------------
+db_executor = ThreadPoolExecutor(max_workers=config.DB_WORKERS, thread_name_prefix="kds-db")
 
-CONN_STR = config.DB_CONN_STR
+async def run_db(func, *args, timeout=config.DB_READ_TIMEOUT, **kwargs):
+    """Run a blocking DB helper on the DB worker pool and await its result.
 
+    Raises asyncio.TimeoutError if the call takes longer than `timeout`; the worker
+    itself is released by the ODBC statement timeout (DB_QUERY_TIMEOUT).
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    return await asyncio.wait_for(loop.run_in_executor(db_executor, call), timeout)
+
+async def run_db_write(func, *args, **kwargs):
+    return await run_db(func, *args, timeout=config.DB_WRITE_TIMEOUT, **kwargs)
+
+# Station refreshes: bounded pool, one fetch per station in flight, bursts collapse
+# into a single trailing fetch
+refresh_scheduler = RefreshScheduler(max_workers=config.REFRESH_WORKERS)
 
 
 # ------------------- Globals -------------------
@@ -33,29 +99,81 @@ clients = set()
 clients_kds_del = set()
 
 # ------------------- Per-KDS Cache -------------------
-cached_kds_main = {}          # kds_name -> {"tickets": [...], "summary": [...]}
+EMPTY_MAIN = {"tickets": [], "summary": []}
+
+# Taps shown before their DB write has landed (see Optimistic Writes)
+pending_main = PendingTransitions()
+pending_kds_del = PendingTransitions()
+
+def overlay_main(value):
+    tickets = pending_main.apply(value.get("tickets", []))
+    return value if tickets is value.get("tickets") else {**value, "tickets": tickets}
+
+cached_kds_main = VersionedCache(overlay=overlay_main)   # kds_name -> {"tickets": [...], "summary": [...]}
 
 # Track KDS name for each connected client
 client_kds_map = {}
 
+# Outbound queue + writer task for each connected client (both ports)
+client_outboxes = {}
+
+# Clients speaking the delta protocol -> station version they last received (None = needs snapshot)
+delta_clients = {}
+
 # ------------------- NEW: In-Memory Cache -------------------
 cached_tickets = []
 cached_summary = []
-cached_kds_tickets = {}
+cached_kds_tickets = VersionedCache(wrap=lambda tickets: {"tickets": tickets},
+                                    overlay=pending_kds_del.apply)                 # kds_name -> [...]
+
+# ------------------- Metrics: Gauges -------------------
+broadcast_main_seconds = broadcast_seconds.labels("main")
+broadcast_kds_del_seconds = broadcast_seconds.labels("kds_del")
+
+def port_of(websocket):
+    return str(config.WS_PORT_KDS) if websocket in clients else str(config.WS_PORT_KDS_DEL)
+
+def connected_by_station():
+    counts = {}
+    for port, group in ((str(config.WS_PORT_KDS), clients), (str(config.WS_PORT_KDS_DEL), clients_kds_del)):
+        for client in list(group):
+            key = (port, client_kds_map.get(client, "NONE"))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def outbox_stat(attr):
+    def read():
+        return {(port_of(ws), client_kds_map.get(ws, "NONE"), "%s:%s" % (ws.remote_address or ("?", "?"))[:2]):
+                getattr(outbox, attr) for ws, outbox in list(client_outboxes.items())}
+    return read
+
+def pool_connections():
+    pool = getattr(data_source, "pool", None)
+    return {} if pool is None else {("open",): pool.size, ("idle",): pool.idle}
+
+CLIENT_LABELS = ["port", "station", "client"]
+metrics.GaugeFunc("kds_connected_clients", "Connected screens per port and station", connected_by_station,
+                  ["port", "station"])
+metrics.GaugeFunc("kds_client_outbox_depth", "Messages waiting in a client's send queue",
+                  outbox_stat("depth"), CLIENT_LABELS)
+metrics.GaugeFunc("kds_client_max_send_seconds", "Slowest single send to a client",
+                  outbox_stat("max_send_seconds"), CLIENT_LABELS)
+metrics.CounterFunc("kds_client_messages_sent_total", "Messages sent to a client", outbox_stat("sent"), CLIENT_LABELS)
+metrics.CounterFunc("kds_client_messages_superseded_total", "Queued snapshots replaced by a newer one before sending",
+                    outbox_stat("superseded"), CLIENT_LABELS)
+metrics.GaugeFunc("kds_db_pool_connections", "DB pool connections", pool_connections, ["state"])
+metrics.CounterFunc("kds_log_dropped_total", "Log records dropped because the log writer fell behind", kds_log.dropped)
 
 # ------------------- Prints ---------------------
 import asyncio
 
-async def send_print(client, ticket):
-    """Send a direct print command to the client."""
-    try:
-        await client.send(json.dumps({
-            "action": "print_ticket",
-            "ticket": ticket
-        }))
-        print(f"➡️ Print command sent for KOT {ticket.get('kot_no')}")
-    except Exception as e:
-        print("❌ Failed to send print command:", e)
+def send_print(client, ticket):
+    """Queue a direct print command for the client (never dropped by newer snapshots)."""
+    outbox = client_outboxes.get(client)
+    if outbox and outbox.offer(json.dumps({"action": "print_ticket", "ticket": ticket})):
+        log.info("➡️ Print command sent for KOT %s", ticket.get('kot_no'))
+    else:
+        log.warning("❌ Failed to send print command: client disconnected")
 
 
 # def print_ticket(ticket):
@@ -182,427 +300,685 @@ async def send_print(client, ticket):
 
 # ------------------- ORIGINAL FETCH TICKETS -------------------
 def fetch_tickets(kds_name="NONE"):
+    cache_refreshes.labels("main", kds_name).inc()
     try:
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
-        cursor.execute("EXEC dbo.USP_Get_KDS_Data @KDS =?", kds_name)
-        rows = cursor.fetchall()
-        tickets = {}
-        for row in rows:
-            kot_no = row.KOT_NO
-            bill_no = getattr(row, "BillNO", None)
-            table_name = getattr(row, "TableName", None)
-            created_on = getattr(row, "CreatedOn", None)
-            comments = getattr(row, "comments", "") or ""
-            cancel_type = getattr(row, "Cancel_Type", 0)
-            order_type = getattr(row, "bill_type", "")
-            i_code = getattr(row, "I_Code", None)
-            i_name = getattr(row, "I_Name", "")
-            qty = getattr(row, "Qty", 0)
-            item_status_idx = int(getattr(row, "order_status", 0))
-            item_status = STATUS_MAP[item_status_idx]
-            ack_status = getattr(row, "ack_status", 0)
-
-            if kot_no not in tickets:
-                tickets[kot_no] = {
-                    "kot_no": kot_no,
-                    "bill_no": bill_no,
-                    "table_no": table_name,
-                    "order_type": order_type,
-                    "created_on": str(created_on) if created_on else "",
-                    "order_status": item_status,
-                    "Comments": comments,
-                    "Cancelled": str(cancel_type) == "1",
-                    "items": []
-                }
-
-            tickets[kot_no]["items"].append({
-                "i_code": str(i_code) if i_code else "",
-                "name": i_name,
-                "qty": qty,
-                "status": item_status,
-                "ack_status": ack_status
-            })
-        conn.close()
-        return list(tickets.values())
+        return build_tickets(data_source.kds_rows(kds_name))
     except Exception as e:
-        print("❌ DB Error:", e)
+        log.error("❌ DB Error: %s", e)
         return []
 
+def build_tickets(rows):
+    """Group USP_Get_KDS_Data rows into KOT tickets."""
+    tickets = {}
+    for row in rows:
+        kot_no = row.KOT_NO
+        bill_no = getattr(row, "BillNO", None)
+        table_name = getattr(row, "TableName", None)
+        created_on = getattr(row, "CreatedOn", None)
+        comments = getattr(row, "comments", "") or ""
+        cancel_type = getattr(row, "Cancel_Type", 0)
+        order_type = getattr(row, "bill_type", "")
+        i_code = getattr(row, "I_Code", None)
+        i_name = getattr(row, "I_Name", "")
+        qty = getattr(row, "Qty", 0)
+        item_status_idx = int(getattr(row, "order_status", 0))
+        item_status = STATUS_MAP[item_status_idx]
+        ack_status = getattr(row, "ack_status", 0)
+
+        if kot_no not in tickets:
+            tickets[kot_no] = {
+                "kot_no": kot_no,
+                "bill_no": bill_no,
+                "table_no": table_name,
+                "order_type": order_type,
+                "created_on": str(created_on) if created_on else "",
+                "order_status": item_status,
+                "Comments": comments,
+                "Cancelled": str(cancel_type) == "1",
+                "items": []
+            }
+
+        tickets[kot_no]["items"].append({
+            "i_code": str(i_code) if i_code else "",
+            "name": i_name,
+            "qty": qty,
+            "status": item_status,
+            "ack_status": ack_status
+        })
+    return list(tickets.values())
+
 # ------------------- ORIGINAL FOOD SUMMARY -------------------
 def fetch_food_summary(kds_name="NONE"):
     try:
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
-        cursor.execute("EXEC dbo.USP_Get_KDS_Summary @KDS = ?", kds_name)
-        rows = cursor.fetchall()
+        rows = data_source.summary_rows(kds_name)
         summary = [{"name": getattr(row, "I_Name", ""), "qty": getattr(row, "Qty", 0)} for row in rows]
-        conn.close()
         return summary
     except Exception as e:
-        print("❌ Food Summary DB Error:", e)
+        log.error("❌ Food Summary DB Error: %s", e)
         return []
 
+# ------------------- IN-PROCESS FOOD SUMMARY -------------------
+station_summaries = {}        # kds_name -> StationSummary
+
+def station_summary(kds_name, tickets):
+    """Summary for a station's tickets; derived from the tickets unless SUMMARY_SOURCE = "procedure"."""
+    if config.SUMMARY_SOURCE == "procedure":
+        return fetch_food_summary(kds_name)
+    aggregate = station_summaries.get(kds_name)
+    if aggregate is None:
+        aggregate = station_summaries.setdefault(kds_name, StationSummary())
+    return aggregate.update(tickets)
+
 # ------------------- CACHE REFRESH FUNCTIONS -------------------
 def refresh_main_kds_cache(kds_name="NONE"):
-    """Fetch tickets and summary for a specific KDS and store in cache."""
+    """Fetch tickets for a specific KDS, derive its summary and store both in cache."""
     try:
-        tickets = fetch_tickets(kds_name)      # your existing function
-        summary = fetch_food_summary(kds_name) # your existing function
-        cached_kds_main[kds_name] = {"tickets": tickets, "summary": summary}
+        tickets = fetch_tickets(kds_name)
+        cached_kds_main[kds_name] = {"tickets": tickets, "summary": station_summary(kds_name, tickets)}
     except Exception as e:
-        print(f"❌ Failed to refresh main KDS cache for {kds_name}: {e}")
+        log.error("❌ Failed to refresh main KDS cache for %s: %s", kds_name, e)
 
-def async_refresh_main_kds(kds_name="NONE"):
-    Thread(target=refresh_main_kds_cache, args=(kds_name,), daemon=True).start()
+def async_refresh_main_kds(kds_name="NONE", join_running=False):
+    """Schedule a main KDS refresh for a station; returns its concurrent Future."""
+    return refresh_scheduler.request(("main", kds_name), refresh_main_kds_cache, kds_name,
+                                     join_running=join_running)
 
 
 def safe_refresh_cache(kds_name="NONE"):
     try:
         refresh_cache(kds_name)
     except Exception as e:
-        print("❌ Cache refresh failed:", e)
+        log.error("❌ Cache refresh failed: %s", e)
+
+def async_refresh_cache(kds_name="NONE"):
+    """Schedule a refresh of cached_tickets / cached_summary; returns its concurrent Future."""
+    return refresh_scheduler.request(("legacy", kds_name), safe_refresh_cache, kds_name)
 
 def refresh_cache(kds_name="NONE"):
     global cached_tickets, cached_summary
     cached_tickets = fetch_tickets(kds_name)
-    cached_summary = fetch_food_summary(kds_name)
+    cached_summary = station_summary(kds_name, cached_tickets)
 
 def refresh_kds_cache(kds_name="NONE"):
-    global cached_kds_tickets
-    cached_kds_tickets[kds_name] = fetch_kds_del_tickets(kds_name)
+    """Refresh a KDS_DEL station through the refresh scheduler and wait for it."""
+    async_refresh_kds(kds_name).result(timeout=config.DB_READ_TIMEOUT)
 
 # ------------------- Async Background Refresh -------------------
-def async_refresh_kds(kds_name):
-    """Refresh KDS_DEL tickets in a background thread."""
-    def worker():
-        try:
-            cached_kds_tickets[kds_name] = fetch_kds_del_tickets(kds_name)
-        except Exception as e:
-            print(f"❌ Async refresh error for {kds_name}:", e)
-    Thread(target=worker, daemon=True).start()
+def refresh_kds_del_cache(kds_name):
+    try:
+        cached_kds_tickets[kds_name] = fetch_kds_del_tickets(kds_name)
+    except Exception as e:
+        log.error("❌ Async refresh error for %s: %s", kds_name, e)
+
+def async_refresh_kds(kds_name, join_running=False):
+    """Schedule a KDS_DEL refresh for a station; returns its concurrent Future."""
+    return refresh_scheduler.request(("del", kds_name), refresh_kds_del_cache, kds_name,
+                                     join_running=join_running)
 
 # ------------------- ORIGINAL UPDATE ITEM STATUS -------------------
 def update_item_status(kot_no, bill_no=None, i_code=None, cancel=False):
     try:
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
+        if not cancel and (kot_no is None or bill_no is None or i_code is None):
+            return
         if cancel:
-            cursor.execute("UPDATE tbl_TempKot SET Cancel_Type = 1 WHERE KOT_NO = ?", kot_no)
+            data_source.cancel_ticket(kot_no)
         else:
-            if kot_no is None or bill_no is None or i_code is None:
-                conn.close()
-                return
-            cursor.execute("EXEC dbo.USP_Accept_kds ?, ?, ?", kot_no, str(i_code), bill_no)
-        conn.commit()
-        conn.close()
+            data_source.accept_items([(kot_no, str(i_code), bill_no)])
+        return True
     except Exception as e:
-        print("❌ Update Error:", e)
+        log.error("❌ Update Error: %s", e)
+        return False
 
 # ------------------- ORIGINAL ACK TICKET -------------------
 def ack_ticket(kot_no, bill_no=None, items=None):
     try:
         if not items:
-            print("❌ ACK Error: No items provided for ticket", kot_no)
+            log.error("❌ ACK Error: No items provided for ticket %s", kot_no)
             return
 
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
-
-        for item in items:
-            i_code = item.get("i_code")
-            if not i_code:
-                continue
-            cursor.execute("EXEC dbo.USP_Accept_kds ?, ?, ?", kot_no, str(i_code), bill_no)
-
-        conn.commit()
-        conn.close()
-        print(f"✅ ACK completed for ticket {kot_no} with {len(items)} items")
+        rows = [(kot_no, str(item["i_code"]), bill_no) for item in items if item.get("i_code")]
+        data_source.accept_items(rows)
+        log.info("✅ ACK completed for ticket %s with %d items", kot_no, len(items))
+        return True
 
     except Exception as e:
-        print("❌ ACK Error:", e)
-
-
+        log.error("❌ ACK Error: %s", e)
+        return False
+
+
+
+# ------------------- Outbound Queues -------------------
+def open_outbox(websocket):
+    port = websocket.local_address[1] if websocket.local_address else ""
+    outbox = ClientOutbox(websocket, max_queued=config.WS_OUTBOX_MAX, send_timeout=config.WS_SEND_TIMEOUT,
+                          send_seconds=ws_send_seconds.labels(port), on_sent=trace_sent)
+    client_outboxes[websocket] = outbox
+    return outbox
+
+def close_outbox(websocket):
+    traced_sends.pop(websocket, None)
+    outbox = client_outboxes.pop(websocket, None)
+    if outbox:
+        outbox.close()
+
+def enqueue(client, message, key=None):
+    """Hand a message to the client's writer task without waiting for the send."""
+    outbox = client_outboxes.get(client)
+    return outbox.offer(message, key) if outbox else False
+
+# ------------------- Delta Protocol -------------------
+def station_update(cache, websocket, kds_name, default):
+    """Message that brings a delta client up to date with `cache[kds_name]`.
+
+    Resolved by the client's writer right before sending, so a client that fell
+    behind (superseded or dropped messages) gets a full snapshot instead of a delta
+    it cannot apply. Returns None if the client already has the latest version.
+    Clients without the delta protocol always get the latest full snapshot.
+    """
+    if websocket not in delta_clients:
+        version, text = cache.snapshot(kds_name, default)
+        trace_encoded(cache, websocket, kds_name, version - 1, version)
+        return text
+    have = delta_clients.get(websocket)
+    current = cache.version(kds_name)
+    if have is not None and have == current:
+        return None
+    hit = cache.delta_since(kds_name, have) if have is not None else None
+    version, text = hit or cache.snapshot(kds_name, default)
+    delta_clients[websocket] = version
+    trace_encoded(cache, websocket, kds_name, have if have is not None else version - 1, version)
+    return text
+
+def queue_station_update(cache, client, kds_name, default):
+    enqueue(client, functools.partial(station_update, cache, client, kds_name, default), key="snapshot")
+
+def queue_resync(cache, websocket, kds_name, default):
+    """Full snapshot on request, e.g. after the client detected a version gap."""
+    if websocket in delta_clients:
+        delta_clients[websocket] = None
+    queue_station_update(cache, websocket, kds_name, default)
+
+# ------------------- Tracing -------------------
+# A trace follows one trigger batch or tap: received -> refresh -> cached version
+# -> encoded -> sent to each client -> (optionally) rendered, acked by KDS.js ?trace
+tracer = TraceBuffer(max_traces=config.TRACE_BUFFER_SIZE, max_age=config.TRACE_MAX_AGE)
+
+traced_sends = {}             # websocket -> (traces, detail) for the message being sent
+
+def screen_of(cache):
+    return "main" if cache is cached_kds_main else "kds_del"
+
+def cache_versions():
+    versions = {("main", k): cached_kds_main.version(k) for k in list(cached_kds_main.keys())}
+    versions.update({("kds_del", k): cached_kds_tickets.version(k) for k in list(cached_kds_tickets.keys())})
+    return versions
+
+def attach_changed(trace, before):
+    """Attach `trace` to every station version that changed since `before` (cache_versions())."""
+    for (screen, kds_name), version in cache_versions().items():
+        if version != before.get((screen, kds_name)):
+            tracer.attach(screen, kds_name, version, trace)
+
+def client_label(websocket):
+    address = websocket.remote_address or ("?", "?")
+    return f"{address[0]}:{address[1]}"
+
+def trace_encoded(cache, websocket, kds_name, after, upto):
+    if not config.TRACING:
+        return
+    traces = tracer.traces_between(screen_of(cache), kds_name, after, upto)
+    if not traces:
+        return
+    station = f"{screen_of(cache)} {kds_name} v{upto}"
+    for trace in traces:
+        if not any(stage == "encode" and detail == station for stage, _, detail in trace.stages):
+            trace.mark("encode", station)
+    traced_sends[websocket] = (traces, f"{client_label(websocket)} {station}")
+
+def trace_sent(websocket):
+    entry = traced_sends.pop(websocket, None)
+    if entry:
+        traces, detail = entry
+        for trace in traces:
+            trace.mark("send", detail)
+
+def trace_rendered(cache, websocket, kds_name, version):
+    """Client acknowledgement: `version` of the station is on the client's screen."""
+    if not config.TRACING or version is None:
+        return
+    for trace in tracer.traces_between(screen_of(cache), kds_name, version - 1, version):
+        trace.mark("client_ack", f"{client_label(websocket)} {screen_of(cache)} {kds_name} v{version}")
 
 # ------------------- ORIGINAL BROADCAST -------------------
 async def broadcast_main_kds(kds_name=None):
-    """Send tickets+summary only to clients of the given KDS (or all if kds_name=None)."""
+    """Queue tickets+summary only for clients of the given KDS (or all if kds_name=None)."""
+    started = time.perf_counter()
     for client in clients.copy():
-        try:
-            client_kds = client_kds_map.get(client, "NONE")
-            if kds_name and client_kds != kds_name:
-                continue
-            data = cached_kds_main.get(client_kds, {"tickets": [], "summary": []})
-            await client.send(json.dumps(data))
-        except:
-            clients.discard(client)
+        client_kds = client_kds_map.get(client, "NONE")
+        if kds_name and client_kds != kds_name:
+            continue
+        queue_station_update(cached_kds_main, client, client_kds, EMPTY_MAIN)
+    broadcast_main_seconds.observe(time.perf_counter() - started)
+
+# ------------------- Refresh -> Broadcast Pipeline -------------------
+def main_stations():
+    return {client_kds_map.get(client, "NONE") for client in clients}
+
+async def await_refresh(future, timeout=config.DB_READ_TIMEOUT):
+    """Await a RefreshScheduler future; giving up does not cancel it for other waiters."""
+    await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+
+async def refresh_and_broadcast_main(*kds_names):
+    """Refresh the given stations, then push the fresh cache to their screens."""
+    started = time.perf_counter()
+    await asyncio.gather(*(await_refresh(async_refresh_main_kds(k)) for k in kds_names))
+    refreshed = time.perf_counter()
+    for kds_name in kds_names:
+        await broadcast_main_kds(kds_name)
+    report_pipeline("main", kds_names, started, refreshed)
+
+async def refresh_and_broadcast_kds_del(*kds_names):
+    started = time.perf_counter()
+    await asyncio.gather(*(await_refresh(async_refresh_kds(k)) for k in kds_names))
+    refreshed = time.perf_counter()
+    for kds_name in kds_names:
+        await broadcast_kds_del_tickets(kds_name)
+    report_pipeline("kds_del", kds_names, started, refreshed)
+
+def report_pipeline(screen, kds_names, started, refreshed):
+    refresh_s = refreshed - started
+    broadcast_s = time.perf_counter() - refreshed
+    if refresh_s + broadcast_s >= config.SLOW_REFRESH_SECONDS:
+        log.warning("🐢 %s refresh %s: fetch %.0f ms, broadcast %.0f ms",
+                    screen, ",".join(kds_names), refresh_s * 1000, broadcast_s * 1000)
+
+# ------------------- Optimistic Writes -------------------
+# A tap is applied to the cached ticket and broadcast at once; the stored
+# procedure runs afterwards on the write-behind thread. When it finishes the
+# affected stations are re-fetched (reconcile); if it failed the transition is
+# dropped first, so the screens roll back without waiting for the DB.
+write_behind = WriteBehindQueue()
+
+metrics.GaugeFunc("kds_write_behind_depth", "DB writes waiting on the write-behind thread", lambda: write_behind.depth)
+metrics.CounterFunc("kds_write_behind_total", "Write-behind DB writes by result",
+                    lambda: {("ok",): write_behind.completed, ("failed",): write_behind.failed}, ["result"])
+metrics.CounterFunc("kds_refresh_requests_total", "Station refresh requests: started a fetch or joined one",
+                    lambda: {("started",): refresh_scheduler.started, ("joined",): refresh_scheduler.joined}, ["result"])
+
+def station_tickets(value):
+    return value.get("tickets", []) if isinstance(value, dict) else (value or [])
+
+def cached_ticket(cache, kds_name, kot_no):
+    kot_no = str(kot_no)
+    for ticket in station_tickets(cache.get(kds_name)):
+        if str(ticket.get("kot_no")) == kot_no:
+            return ticket
+    return None
+
+def stations_showing(cache, kot_no):
+    kot_no = str(kot_no)
+    return [kds_name for kds_name, value in list(cache.items())
+            if any(str(t.get("kot_no")) == kot_no for t in station_tickets(value))]
+
+async def reconcile_after_write(coro):
+    try:
+        await coro
+    except asyncio.TimeoutError:
+        log.warning("⏱️ Reconcile refresh timed out")
+    except Exception as e:
+        log.error("❌ Reconcile error: %s", e)
+
+def apply_optimistic(cache, pending, kot_no, transition, reconcile, write, *args):
+    """Show `transition` on every station holding the KOT and queue `write(*args)`.
+
+    Returns the stations whose cache changed; the caller broadcasts them.
+    `reconcile(*stations)` is scheduled on this loop once the write finishes.
+    """
+    trace = tracer.start("tap", [kot_no]) if config.TRACING else None
+    before = cache_versions() if trace else None
+    transition_id = pending.add(kot_no, transition)
+    stations = stations_showing(cache, kot_no)
+    for kds_name in stations:
+        cache.reapply(kds_name)
+    if trace:
+        attach_changed(trace, before)
+    loop = asyncio.get_running_loop()
+
+    async def finish(ok):
+        # On the loop, like every other reader and writer of the caches
+        if trace:
+            trace.mark("db_write", "ok" if ok else "failed")
+        pending.discard(transition_id)
+        if not ok:
+            log.warning("↩️ Rolling back KOT %s on %s", kot_no, ", ".join(stations))
+            for kds_name in stations:
+                cache.reapply(kds_name)
+        await reconcile_after_write(reconcile(*stations))
+
+    def done(ok):
+        # Called on the write-behind thread
+        asyncio.run_coroutine_threadsafe(finish(ok), loop)
+
+    write_behind.submit(write, *args, done=done)
+    return stations
+
+async def optimistic_main(kds_name, kot_no, transition, write, *args):
+    """Optimistic path for a main KDS tap; falls back to write -> refresh -> broadcast."""
+    if not config.OPTIMISTIC_WRITES or cached_ticket(cached_kds_main, kds_name, kot_no) is None:
+        await run_db_write(write, *args)
+        await refresh_and_broadcast_main(kds_name)
+        return
+    for station in apply_optimistic(cached_kds_main, pending_main, kot_no, transition,
+                                    refresh_and_broadcast_main, write, *args):
+        await broadcast_main_kds(station)
 
 
 
 async def ws_handler(websocket):
+    open_outbox(websocket)
     clients.add(websocket)
-    print("✅ KDS client connected")
+    log.info("✅ KDS client connected")
     try:
         kds_name = client_kds_map.get(websocket, "NONE")
 
         # Send cached data immediately (if exists), else empty
-        data = cached_kds_main.get(kds_name, {"tickets": [], "summary": []})
-        await websocket.send(json.dumps(data))
+        enqueue(websocket, cached_kds_main.encoded(kds_name, EMPTY_MAIN), key="snapshot")
 
-        while True:
+        # Event-driven: the coroutine sleeps until a frame arrives; keepalive pings
+        # are sent by the shared scheduler, not by this handler
+        async for message in websocket:
+            data = json.loads(message)
+            action = data.get("action")
             try:
-                message = await asyncio.wait_for(websocket.recv(), timeout=0.1)
-                data = json.loads(message)
-                action = data.get("action")
-
                 if action == "init_kds":
                     kds_name = data.get("kds_name", "NONE")
                     client_kds_map[websocket] = kds_name
-                    refresh_main_kds_cache(kds_name)
-                    await broadcast_main_kds(kds_name)
-                    print(f"Client initialized with KDS: {kds_name}")
+                    if data.get("protocol") == "delta":
+                        delta_clients[websocket] = None
+                    await refresh_and_broadcast_main(kds_name)
+                    log.info("Client initialized with KDS: %s", kds_name)
+
+                elif action == "resync":
+                    queue_resync(cached_kds_main, websocket, client_kds_map.get(websocket, "NONE"), EMPTY_MAIN)
+
+                elif action == "rendered":
+                    trace_rendered(cached_kds_main, websocket, client_kds_map.get(websocket, "NONE"), data.get("version"))
 
                 elif action == "toggle_item":
-                    update_item_status(data.get("kot_no"), data.get("bill_no"), data.get("i_code"))
-                    async_refresh_main_kds(client_kds_map.get(websocket, "NONE"))
-                    await broadcast_main_kds(client_kds_map.get(websocket, "NONE"))
+                    kds_name = client_kds_map.get(websocket, "NONE")
+                    kot_no, i_code = data.get("kot_no"), data.get("i_code")
+                    await optimistic_main(kds_name, kot_no, accept_items([i_code]),
+                                          update_item_status, kot_no, data.get("bill_no"), i_code)
 
                 elif action == "cancel_ticket":
-                    update_item_status(data.get("kot_no"), cancel=True)
-                    async_refresh_main_kds(client_kds_map.get(websocket, "NONE"))
-                    await broadcast_main_kds(client_kds_map.get(websocket, "NONE"))
+                    await run_db_write(update_item_status, data.get("kot_no"), cancel=True)
+                    await refresh_and_broadcast_main(client_kds_map.get(websocket, "NONE"))
 
                 elif action == "ack_ticket":
-                    ack_ticket(data.get("kot_no"), data.get("bill_no"), data.get("items"))
-                    async_refresh_main_kds(client_kds_map.get(websocket, "NONE"))
-                    await broadcast_main_kds(client_kds_map.get(websocket, "NONE"))
+                    items = data.get("items") or []
+                    await optimistic_main(client_kds_map.get(websocket, "NONE"), data.get("kot_no"),
+                                          accept_items([it.get("i_code") for it in items]),
+                                          ack_ticket, data.get("kot_no"), data.get("bill_no"), items)
 
             except asyncio.TimeoutError:
-                await asyncio.sleep(0.01)
+                log.warning("⏱️ DB call timed out for %s", action)
 
     except websockets.exceptions.ConnectionClosed:
-        print("❌ KDS client disconnected")
+        pass
     finally:
+        log.info("❌ KDS client disconnected")
         clients.discard(websocket)
         client_kds_map.pop(websocket, None)
+        delta_clients.pop(websocket, None)
+        close_outbox(websocket)
 
 # ------------------- KDS_DEL FETCH TICKETS -------------------
 def fetch_kds_del_tickets(kds_name="NONE"):
+    cache_refreshes.labels("kds_del", kds_name).inc()
     try:
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
-        cursor.execute("EXEC dbo.USP_GET_KDS_DEL_Data @KDS = ?", kds_name)
-        rows = cursor.fetchall()
-
-        tickets = {}
-        for row in rows:
-            kot_no = getattr(row, "KOT_NO", None)
-            bill_no = getattr(row, "BillNO", None)
-            table_name = getattr(row, "TableName", "")
-            i_code = getattr(row, "I_Code", "")
-            i_name = getattr(row, "I_Name", "")
-            qty = getattr(row, "Qty", 0)
-            steward = getattr(row, "stwd", "")
-            ready_date = getattr(row, "ready_date", "") 
-            bill_type = getattr(row, "bill_type", "")
-            cashier = getattr(row,"cashier", "")
-
-
-            ready_status = getattr(row, "ready_status")
-            if ready_status is None:
-                ready_status = 0
-            else:
-                ready_status = int(ready_status)
-
-            order_status_idx = getattr(row, "order_status", 0)
-            order_status_text = STATUS_MAP[order_status_idx]
-
-            if kot_no is None or bill_no is None:
-                print(f"Skipping row with missing KOT_NO or BillNO: {row}")
-                continue
-
-            if kot_no not in tickets:
-                tickets[kot_no] = {
-                    "kot_no": kot_no,
-                    "bill_no": bill_no,
-                    "table_no": table_name,
-                    "ready_date": str(ready_date) if ready_date else "",
-                    "stwd": steward,
-                    "items": [],
-                    "ticketstatus": 0,
-                    "order_type": "",
-                    "bill_type": bill_type,
-                    "cashier": cashier
-                }
-
-            tickets[kot_no]["items"].append({
-                "i_code": str(i_code),
-                "name": i_name,
-                "qty": qty,
-                "ready_status": ready_status,
-                "status": order_status_text
-            })
-
-            ready_items = sum(1 for it in tickets[kot_no]["items"] if it["ready_status"] == 1)
-            total_items = len(tickets[kot_no]["items"])
-
-            if ready_items == total_items and total_items > 0:
-                tickets[kot_no]["ticketstatus"] = 2
-            elif ready_items > 0:
-                tickets[kot_no]["ticketstatus"] = 1
-            else:
-                tickets[kot_no]["ticketstatus"] = 0
-
-        conn.close()
-        return list(tickets.values())
-
+        return build_kds_del_tickets(data_source.kds_del_rows(kds_name))
     except Exception as e:
-        print("❌ KDS_DEL DB Error:", e)
+        log.error("❌ KDS_DEL DB Error: %s", e)
         return []
 
+def build_kds_del_tickets(rows):
+    """Group USP_GET_KDS_DEL_Data rows into KDS_DEL tickets with their ticketstatus."""
+    tickets = {}
+    for row in rows:
+        kot_no = getattr(row, "KOT_NO", None)
+        bill_no = getattr(row, "BillNO", None)
+        table_name = getattr(row, "TableName", "")
+        i_code = getattr(row, "I_Code", "")
+        i_name = getattr(row, "I_Name", "")
+        qty = getattr(row, "Qty", 0)
+        steward = getattr(row, "stwd", "")
+        ready_date = getattr(row, "ready_date", "") 
+        bill_type = getattr(row, "bill_type", "")
+        cashier = getattr(row,"cashier", "")
+
+
+        ready_status = getattr(row, "ready_status")
+        if ready_status is None:
+            ready_status = 0
+        else:
+            ready_status = int(ready_status)
+
+        order_status_idx = getattr(row, "order_status", 0)
+        order_status_text = STATUS_MAP[order_status_idx]
+
+        if kot_no is None or bill_no is None:
+            log.warning("Skipping row with missing KOT_NO or BillNO: %s", row)
+            continue
+
+        if kot_no not in tickets:
+            tickets[kot_no] = {
+                "kot_no": kot_no,
+                "bill_no": bill_no,
+                "table_no": table_name,
+                "ready_date": str(ready_date) if ready_date else "",
+                "stwd": steward,
+                "items": [],
+                "ticketstatus": 0,
+                "order_type": "",
+                "bill_type": bill_type,
+                "cashier": cashier
+            }
+
+        tickets[kot_no]["items"].append({
+            "i_code": str(i_code),
+            "name": i_name,
+            "qty": qty,
+            "ready_status": ready_status,
+            "status": order_status_text
+        })
+
+        ready_items = sum(1 for it in tickets[kot_no]["items"] if it["ready_status"] == 1)
+        total_items = len(tickets[kot_no]["items"])
+
+        if ready_items == total_items and total_items > 0:
+            tickets[kot_no]["ticketstatus"] = 2
+        elif ready_items > 0:
+            tickets[kot_no]["ticketstatus"] = 1
+        else:
+            tickets[kot_no]["ticketstatus"] = 0
+
+    return list(tickets.values())
+
 # ------------------- KDS_DEL UPDATE -------------------
 def update_kds_del_ticket(kot_no, bill_no, items):
     try:
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
-        for item in items:
-            i_code = item["i_code"]
-            cursor.execute("EXEC dbo.USP_UPDATE_KDS_DEL ?, ?, ?", kot_no, i_code, bill_no)
-        conn.commit()
-        conn.close()
+        rows = [(kot_no, item["i_code"], bill_no) for item in items]
+        data_source.update_kds_del_items(rows)
+        return True
     except Exception as e:
-        print("❌ KDS_DEL Update Error:", e)
+        log.error("❌ KDS_DEL Update Error: %s", e)
+        return False
 
 # ------------------- KDS_DEL BROADCAST -------------------
-async def broadcast_kds_del_tickets():
+async def broadcast_kds_del_tickets(only_kds=None):
+    started = time.perf_counter()
     for client in clients_kds_del.copy():
-        try:
-            kds_name = client_kds_map.get(client, "NONE")
-            if kds_name not in cached_kds_tickets:
-                async_refresh_kds(kds_name)
-            await client.send(json.dumps({"tickets": cached_kds_tickets.get(kds_name, [])}))
-        except:
-            clients_kds_del.discard(client)
+        kds_name = client_kds_map.get(client, "NONE")
+        if only_kds and kds_name != only_kds:
+            continue
+        if kds_name not in cached_kds_tickets:
+            async_refresh_kds(kds_name, join_running=True)
+        queue_station_update(cached_kds_tickets, client, kds_name, [])
+    broadcast_kds_del_seconds.observe(time.perf_counter() - started)
 
 # ------------------- KDS_DEL WEBSOCKET -------------------
 async def ws_kds_del_handler(websocket):
+    open_outbox(websocket)
     clients_kds_del.add(websocket)
     client_kds_map[websocket] = "NONE"
-    print("✅ KDS_DEL client connected")
+    log.info("✅ KDS_DEL client connected")
 
     try:
         # Send empty tickets first
-        await websocket.send(json.dumps({"tickets": cached_kds_tickets.get("NONE", [])}))
+        enqueue(websocket, cached_kds_tickets.encoded("NONE", []), key="snapshot")
 
-        while True:
-            message = await websocket.recv()
+        async for message in websocket:
             data = json.loads(message)
             action = data.get("action")
-
-            # ---------- Initialize KDS ----------
-            if action == "init_kds":
-                kds_name = data.get("kds_name", "NONE")
-                client_kds_map[websocket] = kds_name
-                safe_refresh_cache(kds_name)
-                cached_kds_tickets[kds_name] = fetch_kds_del_tickets(kds_name)
-                print(f"Client initialized with KDS: {kds_name}")
-                # Send to this client immediately
-                await websocket.send(json.dumps({"tickets": cached_kds_tickets[kds_name]}))
-                continue
-
-            # ---------- Initialize Recall Screen ----------
-            elif action == "init_kds_recall":
-                kds_name = data.get("kds_name", "NONE")
-                client_kds_map[websocket] = kds_name
-                delivered = fetch_delivered_tickets(kds_name)
-                await websocket.send(json.dumps({"delivered_tickets": delivered}))
-                print(f"Recall tickets for {kds_name}: {len(delivered)}")
-                continue
-
-            # ---------- Recall Item ----------
-            elif action == "recall_item":
-                kot_no = data.get("kot_no")
-                i_code = data.get("i_code")
-                bill_no = data.get("bill_no")
-                recall_item(kot_no, i_code, bill_no)
-                # Refresh cache only once
-                safe_refresh_cache()
-                # Update main KDS clients
-                await broadcast_main_kds()
-
-                # Update this recall screen with fresh delivered tickets
-                kds_name = client_kds_map.get(websocket, "NONE")
-                delivered = fetch_delivered_tickets(kds_name)
-                await websocket.send(json.dumps({"delivered_tickets": delivered}))
-                continue
-
-            # ---------- Toggle Ticket ----------
-            elif action == "toggle_ticket":
-                kds_name = client_kds_map.get(websocket, "NONE")
-                update_kds_del_ticket(
-                    data.get("kot_no"),
-                    data.get("bill_no"),
-                    data.get("items")
-                )
-
-                # Refresh KDS cache only once after update
-                cached_kds_tickets[kds_name] = fetch_kds_del_tickets(kds_name)
-                delivered_tickets = fetch_delivered_tickets(kds_name)
-                safe_refresh_cache()
-
-                # Optional: Print when toggling ON
-                try:
-                    should_print = data.get("print", True)
-                    if should_print:
-                        kot_to_print = str(data.get("kot_no"))
-                        for t in cached_kds_tickets.get(kds_name, []):
-                            if str(t.get("kot_no")) == kot_to_print:
-                                ready_items = [item for item in t["items"] if int(item.get("ready_status", 0)) == 1]
-                                if ready_items:
-                                    t_copy = {**t, "items": ready_items}
-                                    asyncio.create_task(send_print(websocket, t_copy))
-                                    # print_ticket(t_copy)
-                                break
-                except Exception as e:
-                    print("❌ Print-on-toggle error:", e)
+            try:
+                # ---------- Initialize KDS ----------
+                if action == "init_kds":
+                    kds_name = data.get("kds_name", "NONE")
+                    client_kds_map[websocket] = kds_name
+                    if data.get("protocol") == "delta":
+                        delta_clients[websocket] = None
+                    await asyncio.gather(
+                        await_refresh(async_refresh_cache(kds_name)),
+                        await_refresh(async_refresh_kds(kds_name)),
+                    )
+                    log.info("Client initialized with KDS: %s", kds_name)
+                    # Send to this client immediately
+                    queue_station_update(cached_kds_tickets, websocket, kds_name, [])
+                    continue
+
+                elif action == "resync":
+                    queue_resync(cached_kds_tickets, websocket, client_kds_map.get(websocket, "NONE"), [])
+                    continue
+
+                # ---------- Initialize Recall Screen ----------
+                elif action == "init_kds_recall":
+                    kds_name = data.get("kds_name", "NONE")
+                    client_kds_map[websocket] = kds_name
+                    delivered = await run_db(fetch_delivered_tickets, kds_name)
+                    enqueue(websocket, json.dumps({"delivered_tickets": delivered}), key="delivered")
+                    log.info("Recall tickets for %s: %d", kds_name, len(delivered))
+                    continue
+
+                # ---------- Recall Item ----------
+                elif action == "recall_item":
+                    kot_no = data.get("kot_no")
+                    i_code = data.get("i_code")
+                    bill_no = data.get("bill_no")
+                    await run_db_write(recall_item, kot_no, i_code, bill_no)
+                    # Refresh main cache and this recall screen's list together
+                    kds_name = client_kds_map.get(websocket, "NONE")
+                    # and update main KDS clients once their stations have re-fetched
+                    _, delivered, _ = await asyncio.gather(
+                        await_refresh(async_refresh_cache()),
+                        run_db(fetch_delivered_tickets, kds_name),
+                        refresh_and_broadcast_main(*main_stations()),
+                    )
+
+                    # Update this recall screen with fresh delivered tickets
+                    enqueue(websocket, json.dumps({"delivered_tickets": delivered}), key="delivered")
+                    continue
+
+                # ---------- Toggle Ticket ----------
+                elif action == "toggle_ticket":
+                    kds_name = client_kds_map.get(websocket, "NONE")
+                    ticket = cached_ticket(cached_kds_tickets, kds_name, data.get("kot_no"))
+                    if config.OPTIMISTIC_WRITES and ticket is not None:
+                        # Take the ready items off the screen now; the recall list follows the write
+                        async def reconcile(*stations):
+                            _, delivered, _ = await asyncio.gather(
+                                refresh_and_broadcast_kds_del(*stations),
+                                run_db(fetch_delivered_tickets, kds_name),
+                                await_refresh(async_refresh_cache()),
+                            )
+                            enqueue(websocket, json.dumps({"delivered_tickets": delivered}), key="delivered")
+
+                        apply_optimistic(cached_kds_tickets, pending_kds_del, data.get("kot_no"),
+                                         deliver_items([it.get("i_code") for it in data.get("items") or []]), reconcile,
+                                         update_kds_del_ticket, data.get("kot_no"), data.get("bill_no"), data.get("items"))
+                        delivered_tickets = None
+                    else:
+                        await run_db_write(
+                            update_kds_del_ticket,
+                            data.get("kot_no"),
+                            data.get("bill_no"),
+                            data.get("items")
+                        )
+
+                        # Refresh KDS cache only once after update
+                        _, delivered_tickets, _ = await asyncio.gather(
+                            await_refresh(async_refresh_kds(kds_name)),
+                            run_db(fetch_delivered_tickets, kds_name),
+                            await_refresh(async_refresh_cache()),
+                        )
+
+                    # Optional: Print when toggling ON
+                    try:
+                        should_print = data.get("print", True)
+                        if should_print:
+                            kot_to_print = str(data.get("kot_no"))
+                            # The ticket as it was tapped: its ready items are the ones being delivered
+                            for t in [ticket] if ticket is not None else cached_kds_tickets.get(kds_name, []):
+                                if str(t.get("kot_no")) == kot_to_print:
+                                    ready_items = [item for item in t["items"] if int(item.get("ready_status", 0)) == 1]
+                                    if ready_items:
+                                        t_copy = {**t, "items": ready_items}
+                                        send_print(websocket, t_copy)
+                                        # print_ticket(t_copy)
+                                    break
+                    except Exception as e:
+                        log.error("❌ Print-on-toggle error: %s", e)
                     
-                                # Optional: Print when toggling ON
-                # try:
-                #     kot_to_print = str(data.get("kot_no"))
-                #     for t in cached_kds_tickets.get(kds_name, []):
-                #         if str(t.get("kot_no")) == kot_to_print:
-                #             # Only include items that are ready
-                #             ready_items = [item for item in t["items"] if int(item.get("ready_status", 0)) == 1]
-
-                #             # Set print flag for client
-                #             if ready_items and data.get("print", True):
-                #                 t["print"] = True
-                #                 t["items"] = ready_items  # only ready items sent for printing
-                #             else:
-                #                 t["print"] = False
-                #             break
-                # except Exception as e:
-                #     print("❌ Print-on-toggle error:", e)
-
-                # Broadcast to all KDS_DEL clients
-                await broadcast_kds_del_tickets()
-                await websocket.send(json.dumps({"delivered_tickets": delivered_tickets}))
+                                    # Optional: Print when toggling ON
+                    # try:
+                    #     kot_to_print = str(data.get("kot_no"))
+                    #     for t in cached_kds_tickets.get(kds_name, []):
+                    #         if str(t.get("kot_no")) == kot_to_print:
+                    #             # Only include items that are ready
+                    #             ready_items = [item for item in t["items"] if int(item.get("ready_status", 0)) == 1]
+
+                    #             # Set print flag for client
+                    #             if ready_items and data.get("print", True):
+                    #                 t["print"] = True
+                    #                 t["items"] = ready_items  # only ready items sent for printing
+                    #             else:
+                    #                 t["print"] = False
+                    #             break
+                    # except Exception as e:
+                    #     log.error("❌ Print-on-toggle error: %s", e)
+
+                    # Broadcast to all KDS_DEL clients
+                    await broadcast_kds_del_tickets()
+                    if delivered_tickets is not None:
+                        enqueue(websocket, json.dumps({"delivered_tickets": delivered_tickets}), key="delivered")
+
+                    continue
 
-                continue
+            except asyncio.TimeoutError:
+                log.warning("⏱️ DB call timed out for %s", action)
 
     except websockets.exceptions.ConnectionClosed:
-        print("❌ KDS_DEL client disconnected")
+        pass
     finally:
+        log.info("❌ KDS_DEL client disconnected")
         clients_kds_del.discard(websocket)
         client_kds_map.pop(websocket, None)
+        delta_clients.pop(websocket, None)
+        close_outbox(websocket)
 
 # ------------------- KDS_Delivered FETCH TICKETS -------------------
 def fetch_delivered_tickets(kds_name="NONE"):
     try:
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
-        cursor.execute("EXEC dbo.USP_Get_KDS_Delivered_Data @KDS = ?", kds_name)
-        rows = cursor.fetchall()
+        rows = data_source.delivered_rows(kds_name)
         tickets = {}
         for row in rows:
             kot_no = getattr(row, "KOT_NO", None)
@@ -625,7 +1001,7 @@ def fetch_delivered_tickets(kds_name="NONE"):
             order_status_text = STATUS_MAP[order_status_idx]
 
             if kot_no is None or bill_no is None:
-                print(f"Skipping row with missing KOT_NO or BillNO: {row}")
+                log.warning("Skipping row with missing KOT_NO or BillNO: %s", row)
                 continue
 
             if kot_no not in tickets:
@@ -648,83 +1024,315 @@ def fetch_delivered_tickets(kds_name="NONE"):
                 "ready_status": ready_status,
                 "status": order_status_text
             })
-        conn.close()
         return list(tickets.values())
     except Exception as e:
-        print("❌ Delivered Tickets Error:", e)
+        log.error("❌ Delivered Tickets Error: %s", e)
         return []
 
 def recall_item(kot_no, i_code, bill_no):
     try:
-        conn = pyodbc.connect(CONN_STR)
-        cursor = conn.cursor()
-        cursor.execute("EXEC dbo.USP_Recall_KDS_DEL_Data ?, ?, ?", kot_no, i_code, bill_no)
-        conn.commit()
-        conn.close()
-        print(f"✅ Recalled item {i_code} from KOT {kot_no}")
+        data_source.recall_item(kot_no, i_code, bill_no)
+        log.info("✅ Recalled item %s from KOT %s", i_code, kot_no)
+    except Exception as e:
+        log.error("❌ Recall Error: %s", e)
+
+
+# ------------------- ALL-STATION BULK LOAD -------------------
+def use_bulk_load(kds_names):
+    # One station is cheaper through its own procedure call than through a batch
+    return config.KDS_LOAD_MODE == "bulk" and len(kds_names) > 1
+
+def fetch_bulk(fetch, screen, kds_names):
+    """{kds_name: rows} from one bulk call, or None (logged) to fall back to per-station."""
+    if not use_bulk_load(kds_names):
+        return None
+    try:
+        return fetch(kds_names)
+    except Exception as e:
+        log.error("❌ Bulk %s load failed, falling back to per-station: %s", screen, e)
+        return None
+
+def request_main_stations(kds_names):
+    """Futures refreshing several main stations through the scheduler: one bulk load or one fetch each."""
+    kds_names = list(kds_names)
+    if not use_bulk_load(kds_names):
+        return [async_refresh_main_kds(k) for k in kds_names]
+    return refresh_scheduler.request_many({("main", k): k for k in kds_names},
+                                          refresh_main_stations, refresh_main_kds_cache)
+
+def request_kds_del_stations(kds_names):
+    kds_names = list(kds_names)
+    if not use_bulk_load(kds_names):
+        return [async_refresh_kds(k) for k in kds_names]
+    return refresh_scheduler.request_many({("del", k): k for k in kds_names},
+                                          refresh_kds_del_stations, refresh_kds_del_cache)
+
+def refresh_main_stations(kds_names):
+    """Refresh several main KDS stations; one round trip for all of them in bulk mode.
+
+    Runs on the refresh scheduler (request_main_stations), which holds every
+    station's key while it runs.
+    """
+    kds_names = list(kds_names)
+    rows = fetch_bulk(data_source.kds_rows_bulk, "KDS", kds_names)
+    if rows is None:
+        for kds_name in kds_names:
+            refresh_main_kds_cache(kds_name)
+        return
+    for kds_name in kds_names:
+        cache_refreshes.labels("main", kds_name).inc()
+        tickets = build_tickets(rows[kds_name])
+        cached_kds_main[kds_name] = {"tickets": tickets, "summary": station_summary(kds_name, tickets)}
+
+def refresh_kds_del_stations(kds_names):
+    """Refresh several KDS_DEL stations; one round trip for all of them in bulk mode."""
+    kds_names = list(kds_names)
+    rows = fetch_bulk(data_source.kds_del_rows_bulk, "KDS_DEL", kds_names)
+    if rows is None:
+        for kds_name in kds_names:
+            cached_kds_tickets[kds_name] = fetch_kds_del_tickets(kds_name)
+        return
+    for kds_name in kds_names:
+        cache_refreshes.labels("kds_del", kds_name).inc()
+        cached_kds_tickets[kds_name] = build_kds_del_tickets(rows[kds_name])
+
+# ------------------- Loop Monitor -------------------
+loop_monitor = LoopMonitor(interval=config.LOOP_LAG_INTERVAL, slow_after=config.LOOP_SLOW_CALLBACK,
+                           lag_seconds=loop_lag_seconds, slow_seconds=loop_slow_seconds)
+metrics.GaugeFunc("kds_loop_max_lag_seconds", "Worst event loop lag since start", lambda: loop_monitor.max_lag)
+metrics.GaugeFunc("kds_loop_max_callback_seconds", "Longest single event loop stall since start",
+                  lambda: loop_monitor.max_callback)
+
+# ------------------- Shared Scheduler -------------------
+periodic_jobs = []            # [interval_seconds, async job, next_run, task of the last run]
+
+def schedule_every(interval, job):
+    """Register an async `job` to run every `interval` seconds on the shared scheduler."""
+    periodic_jobs.append([interval, job, None, None])
+
+async def run_job(job):
+    try:
+        await job()
     except Exception as e:
-        print("❌ Recall Error:", e)
+        log.error("❌ Scheduled job %s failed: %s", job.__name__, e)
 
+async def run_scheduler():
+    """One task times all periodic work, so an idle socket owns no timers of its own.
+
+    Each due job runs as its own task: the full refresh waiting on the DB does
+    not hold up the keepalive round. A job still running when it is due again
+    skips that round rather than overlapping itself.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        now = loop.time()
+        for entry in periodic_jobs:
+            interval, job, next_run, task = entry
+            if next_run is None:
+                entry[2] = now + interval
+            elif now >= next_run:
+                entry[2] = now + interval
+                if task is not None and not task.done():
+                    log.warning("⏳ Scheduled job %s still running, skipping this round", job.__name__)
+                    continue
+                entry[3] = asyncio.create_task(run_job(job))
+        wake_at = min((entry[2] for entry in periodic_jobs), default=now + 1)
+        await asyncio.sleep(max(0, wake_at - loop.time()))
+
+# ------------------- Keepalive -------------------
+pending_pongs = {}            # websocket -> pong waiter from the previous round
+
+async def keepalive_clients():
+    """Ping every connected screen; drop the ones that never answered the last ping."""
+    for ws, waiter in list(pending_pongs.items()):
+        if not waiter.done():
+            log.warning("❌ Keepalive timeout, closing client")
+            asyncio.create_task(ws.close())
+    pending_pongs.clear()
+
+    sockets = [ws for ws in clients | clients_kds_del if ws.open]
+    waiters = await asyncio.gather(*(ws.ping() for ws in sockets), return_exceptions=True)
+    for ws, waiter in zip(sockets, waiters):
+        if isinstance(waiter, Exception):
+            continue
+        pending_pongs[ws] = waiter
 
 # ------------------- HTTP SERVER -------------------
+class KDSRequestHandler(SimpleHTTPRequestHandler):
+    """Static screens plus /metrics (Prometheus text format) and /traces (JSON)."""
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/metrics":
+            self._reply(metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/traces":
+            params = parse_qs(query)
+            try:
+                minutes = float(params.get("minutes", [config.TRACE_MAX_AGE / 60])[0])
+            except ValueError:
+                minutes = -1
+            if not math.isfinite(minutes) or minutes < 0:
+                return self._reply(json.dumps({"error": "minutes must be a number >= 0"}), "application/json", 400)
+            kot_no = params.get("kot", [None])[0]
+            self._reply(json.dumps(tracer.recent(minutes * 60, kot_no)), "application/json")
+        else:
+            super().do_GET()
+
+    def log_message(self, format, *args):
+        log.debug("HTTP %s " + format, self.address_string(), *args)
+
+    def _reply(self, text, content_type, status=200):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
 def run_http():
-    httpd = HTTPServer(("0.0.0.0", 9090), SimpleHTTPRequestHandler)
-    print("✅ HTTP server running at http://0.0.0.0:9090")
+    httpd = HTTPServer(("0.0.0.0", 9090), KDSRequestHandler)
+    log.info("✅ HTTP server running at http://0.0.0.0:9090")
     httpd.serve_forever()
 
 # ------------------- SQL LISTENER -------------------
+# Main and KDS_DEL stations show different items, so each screen learns its own map
+main_station_index = StationIndex()
+kds_del_station_index = StationIndex()
+
+def request_all_stations():
+    """Futures refreshing every cached station once, through the refresh scheduler."""
+    return (request_main_stations(list(cached_kds_main.keys())) + [async_refresh_cache()]
+            + request_kds_del_stations(list(cached_kds_tickets.keys())))
+
+def wait_refreshes(futures, timeout=config.DB_WRITE_TIMEOUT):
+    """Block the listener thread until the scheduled refreshes are done (or `timeout`)."""
+    _, not_done = wait_futures(futures, timeout)
+    if not_done:
+        log.warning("⏱️ %d station refreshes still running after %ss", len(not_done), timeout)
+
+def refresh_after_triggers():
+    """Refresh every cached station once, however many triggers were coalesced."""
+    wait_refreshes(request_all_stations())
+
+def refresh_for_changes(parsed_changes):
+    """Refetch only the stations the parsed trigger bodies touch.
+
+    Returns (main stations, KDS_DEL stations) that were refreshed; None for a side
+    means it could not be narrowed down and every station on it was refreshed.
+    """
+    change = TriggerChange()
+    for parsed in parsed_changes:
+        if parsed is None:
+            refresh_after_triggers()
+            return None, None
+        change.merge(parsed)
+
+    main_targets = main_station_index.stations_for(
+        change, {k: v.get("tickets", []) for k, v in list(cached_kds_main.items())})
+    del_targets = kds_del_station_index.stations_for(change, dict(cached_kds_tickets))
+
+    wait_refreshes(request_main_stations(main_targets if main_targets is not None else list(cached_kds_main.keys()))
+                   + request_kds_del_stations(del_targets if del_targets is not None else list(cached_kds_tickets.keys())))
+    return main_targets, del_targets
+
+async def reconcile_all_stations():
+    """Periodic full refresh; safety net for stations the learned item index does not know yet."""
+    await asyncio.gather(*(await_refresh(f, timeout=config.DB_WRITE_TIMEOUT) for f in request_all_stations()))
+    main_station_index.reset()
+    kds_del_station_index.reset()
+    await broadcast_main_kds()
+    await broadcast_kds_del_tickets()
+
 def sql_listener(loop):
+    window = config.TRIGGER_COALESCE_WINDOW_MS / 1000
     while True:
+        listener = None
         try:
-            conn = pyodbc.connect(CONN_STR, timeout=60)
-            cursor = conn.cursor()
-            print("🔔 SQL listener connected")
+            listener = data_source.open_listener()
+            log.info("🔔 SQL listener connected")
             while True:
-                cursor.execute("""
-                    WAITFOR (
-                        RECEIVE TOP(1)
-                            conversation_handle,
-                            message_type_name,
-                            CAST(message_body AS NVARCHAR(MAX))
-                        FROM KDS_TriggerQueue
-                    ), TIMEOUT 10000;
-                """)
-                row = cursor.fetchone()
-                if row:
-                    conversation_handle, message_type, message_body = row
-                    if message_type == "KDS_TriggerMessage":
-                        print(f"🔔 KOT Change: {message_body}")
-                        for kds_name in cached_kds_main.keys():
-                            cached_kds_main[kds_name] = {
-                            "tickets": fetch_tickets(kds_name),
-                            "summary": fetch_food_summary(kds_name)
-                        }
-                        safe_refresh_cache()
-                        for kds_name in list(cached_kds_tickets.keys()):
-                            cached_kds_tickets[kds_name] = fetch_kds_del_tickets(kds_name)
+                batch = listener.receive(config.TRIGGER_WAIT_MS)
+                if not batch:
+                    continue
+                received = time.perf_counter()
+
+                # Coalesce: keep draining until the queue stays quiet or the window closes,
+                # so a 12-item KOT insert becomes one refresh instead of twelve
+                deadline = time.monotonic() + window
+                while True:
+                    remaining_ms = (deadline - time.monotonic()) * 1000
+                    if remaining_ms < 1:
+                        break
+                    more = listener.receive(remaining_ms)
+                    if not more:
+                        break
+                    batch.extend(more)
+
+                listener.end(batch)
+
+                changes = [row[2] for row in batch if row[1] == TRIGGER_MESSAGE]
+                if changes:
+                    trigger_messages.inc(len(changes))
+                    log.info("🔔 KOT Change x%d (coalesced): %s", len(changes), changes[-1])
+                    parsed = [parse_trigger_message(body) for body in changes]
+                    trace = None
+                    if config.TRACING:
+                        trace = tracer.start("trigger", {k for p in parsed if p for k in p.kot_nos}, at=received)
+                        trace.mark("trigger_received", f"{len(changes)} messages", at=received)
+                        trace.mark("refresh_start")
+                        before = cache_versions()
+                    if config.TARGETED_REFRESH:
+                        main_targets, del_targets = refresh_for_changes(parsed)
+                    else:
+                        refresh_after_triggers()
+                        main_targets = del_targets = None
+                    if trace:
+                        trace.mark("refresh_end", "full" if main_targets is None or del_targets is None else "targeted")
+                        attach_changed(trace, before)
+                    scope = "full" if main_targets is None or del_targets is None else "targeted"
+                    trigger_rounds.labels(scope).inc()
+                    if main_targets is None:
                         loop.call_soon_threadsafe(asyncio.create_task, broadcast_main_kds())
+                    else:
+                        for kds_name in main_targets:
+                            loop.call_soon_threadsafe(asyncio.create_task, broadcast_main_kds(kds_name))
+                    if del_targets is None:
                         loop.call_soon_threadsafe(asyncio.create_task, broadcast_kds_del_tickets())
-                    cursor.execute("END CONVERSATION ?", conversation_handle)
-                    conn.commit()
+                    else:
+                        for kds_name in del_targets:
+                            loop.call_soon_threadsafe(asyncio.create_task, broadcast_kds_del_tickets(kds_name))
         except Exception as e:
-            print("❌ SQL Listener Error. Retrying in 5s:", e)
+            log.error("❌ SQL Listener Error. Retrying in 5s: %s", e)
+            if listener is not None:
+                listener.close()
             time.sleep(5)  # retry DB connection
 
 # ------------------- MAIN -------------------
 async def main():
+    kds_log.setup("server", log_dir=config.LOG_DIR, level=config.LOG_LEVEL, file_format=config.LOG_FILE_FORMAT,
+                  max_bytes=config.LOG_MAX_BYTES, backups=config.LOG_BACKUPS,
+                  burst=config.LOG_RATE_BURST, window=config.LOG_RATE_WINDOW)
+    logging.getLogger("websockets").setLevel(logging.WARNING)   # not one line per connection
     cached_tickets.clear()
     cached_summary.clear()
     cached_kds_tickets.clear()
     safe_refresh_cache() # preload tickets for first client
     Thread(target=run_http, daemon=True).start()
-    print("Testing DB connection...")
-    print(f"KDS tickets: {len(cached_tickets)}")
-    print(f"KDS_DEL tickets: {len(fetch_kds_del_tickets())}")
+    log.info("Testing DB connection...")
+    log.info("KDS tickets: %d", len(cached_tickets))
+    log.info("KDS_DEL tickets: %d", len(fetch_kds_del_tickets()))
     loop = asyncio.get_running_loop()
     Thread(target=sql_listener, args=(loop,), daemon=True).start()
-    async with websockets.serve(ws_handler, "0.0.0.0", 9999), \
-               websockets.serve(ws_kds_del_handler, "0.0.0.0", 9998):
-        print("✅ WebSocket servers running at ws://0.0.0.0:9999 and ws://0.0.0.0:9998")
+    schedule_every(config.WS_PING_INTERVAL, keepalive_clients)
+    if config.TARGETED_REFRESH and config.FULL_REFRESH_INTERVAL:
+        schedule_every(config.FULL_REFRESH_INTERVAL, reconcile_all_stations)
+    asyncio.create_task(run_scheduler())
+    if config.LOOP_MONITOR:
+        loop_monitor.start()
+    # ping_interval=None: keepalive runs once for all sockets in keepalive_clients()
+    async with websockets.serve(ws_handler, "0.0.0.0", 9999, ping_interval=None), \
+               websockets.serve(ws_kds_del_handler, "0.0.0.0", 9998, ping_interval=None):
+        log.info("✅ WebSocket servers running at ws://0.0.0.0:9999 and ws://0.0.0.0:9998")
         await asyncio.Future()  # run forever
 
 if __name__ == "__main__":
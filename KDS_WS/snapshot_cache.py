@@ -0,0 +1,247 @@
+import json
+from decimal import Decimal
+from threading import Lock
+
+
+# ------------------- Diffing -------------------
+def item_keys(items):
+    """Stable key per item: its i_code, suffixed with #n for repeats inside one KOT.
+
+    KDS.js / KDS_DEL.js compute the same keys when applying a delta.
+    """
+    seen = {}
+    keys = []
+    for item in items:
+        code = str(item.get("i_code", ""))
+        n = seen.get(code, 0) + 1
+        seen[code] = n
+        keys.append(code if n == 1 else f"{code}#{n}")
+    return keys
+
+
+def diff_ticket(old, new):
+    """Changes from one version of a ticket to the next, or None if it is unchanged."""
+    if old == new:
+        return None
+    change = {"kot_no": new["kot_no"]}
+
+    fields = {k: v for k, v in new.items() if k != "items" and old.get(k) != v}
+    if fields:
+        change["fields"] = fields
+
+    old_items = dict(zip(item_keys(old["items"]), old["items"]))
+    new_items = dict(zip(item_keys(new["items"]), new["items"]))
+    kept_old = [k for k in old_items if k in new_items]
+    kept_new = [k for k in new_items if k in old_items]
+    if kept_old != kept_new:
+        # Items were reordered; an item-level diff cannot express that
+        change["items"] = new["items"]
+        return change
+
+    # Added items carry their position so the client can insert them in order
+    added = [[k, it, i] for i, (k, it) in enumerate(new_items.items()) if k not in old_items]
+    removed = [k for k in old_items if k not in new_items]
+    changed = [[k, it] for k, it in new_items.items() if k in old_items and old_items[k] != it]
+    if added:
+        change["items_added"] = added
+    if removed:
+        change["items_removed"] = removed
+    if changed:
+        change["items_changed"] = changed
+    return change
+
+
+def diff_tickets(old, new):
+    """(added tickets, removed kot_nos, changed-ticket entries) between two ticket lists."""
+    old_by_kot = {t["kot_no"]: t for t in old}
+    new_by_kot = {t["kot_no"]: t for t in new}
+    added = [t for kot, t in new_by_kot.items() if kot not in old_by_kot]
+    removed = [kot for kot in old_by_kot if kot not in new_by_kot]
+    changed = []
+    for kot, ticket in new_by_kot.items():
+        if kot in old_by_kot:
+            change = diff_ticket(old_by_kot[kot], ticket)
+            if change:
+                changed.append(change)
+    return added, removed, changed
+
+
+def diff_snapshot(old, new):
+    """Delta between two cache values, or None if nothing changed.
+
+    Values are either {"tickets": [...], "summary": [...]} (main KDS) or a bare
+    ticket list (KDS_DEL).
+    """
+    if old == new:
+        return None
+    if isinstance(new, dict):
+        old_tickets, new_tickets = old.get("tickets", []), new.get("tickets", [])
+    else:
+        old_tickets, new_tickets = old, new
+
+    added, removed, changed = diff_tickets(old_tickets, new_tickets)
+    delta = {"added": added, "removed": removed, "changed": changed}
+    if isinstance(new, dict) and old.get("summary") != new.get("summary"):
+        delta["summary"] = new.get("summary", [])
+    return delta
+
+
+# ------------------- Versioned Cache -------------------
+class VersionedCache(dict):
+    """kds_name -> snapshot dict that versions every change and keeps its JSON text.
+
+    Assigning a value that differs from the current one bumps the station's
+    version and records the delta from the previous version; assigning an equal
+    value is a no-op. Snapshot and delta text are each serialized once per version
+    and the same string is handed to every subscriber.
+
+    An `overlay` (e.g. pending optimistic transitions) is applied to every value
+    stored; reapply() re-runs it over the last value assigned.
+    """
+
+    def __init__(self, wrap=None, overlay=None):
+        super().__init__()
+        self._wrap = wrap
+        self._overlay = overlay
+        self._base = {}           # kds_name -> value as assigned, before the overlay
+        self._state = {}          # kds_name -> (version, value, delta); replaced atomically
+        self._snapshot_text = {}  # kds_name -> (version, text)
+        self._delta_text = {}     # kds_name -> (version, text)
+        self._lock = Lock()
+
+    def __setitem__(self, kds_name, value):
+        with self._lock:
+            self._base[kds_name] = value
+            if self._overlay is not None:
+                value = self._overlay(value)
+            prev = self._state.get(kds_name)
+            if prev is None:
+                state = (1, value, None)
+            else:
+                delta = diff_snapshot(prev[1], value)
+                if delta is None:
+                    super().__setitem__(kds_name, value)
+                    return
+                state = (prev[0] + 1, value, delta)
+            super().__setitem__(kds_name, value)
+            self._state[kds_name] = state
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._base.clear()
+            self._state.clear()
+            self._snapshot_text.clear()
+            self._delta_text.clear()
+
+    def reapply(self, kds_name):
+        """Re-run the overlay for a station after it changed; True if the station is cached."""
+        base = self._base.get(kds_name)
+        if base is None:
+            return False
+        self[kds_name] = base
+        return True
+
+    def version(self, kds_name):
+        state = self._state.get(kds_name)
+        return state[0] if state else 0
+
+    def snapshot(self, kds_name, default):
+        """(version, JSON text) of the full snapshot for a station."""
+        version, value, _ = self._state.get(kds_name) or (0, default, None)
+        hit = self._snapshot_text.get(kds_name)
+        if hit is not None and hit[0] == version:
+            return hit
+        payload = self._wrap(value) if self._wrap else dict(value)
+        payload["type"] = "snapshot"
+        payload["version"] = version
+        hit = (version, json.dumps(payload))
+        self._snapshot_text[kds_name] = hit
+        return hit
+
+    def encoded(self, kds_name, default):
+        return self.snapshot(kds_name, default)[1]
+
+    def delta_since(self, kds_name, version):
+        """(version, JSON text) of the delta from `version` to the next one, if that is the latest."""
+        state = self._state.get(kds_name)
+        if state is None or state[2] is None or state[0] != version + 1:
+            return None
+        hit = self._delta_text.get(kds_name)
+        if hit is not None and hit[0] == state[0]:
+            return hit
+        payload = {"type": "delta", "from": version, "version": state[0], **state[2]}
+        hit = (state[0], json.dumps(payload))
+        self._delta_text[kds_name] = hit
+        return hit
+
+
+# ------------------- Food Summary -------------------
+def exact_qty(qty):
+    """Quantity as an exact Decimal, so adding and removing tickets never drifts."""
+    if not qty:
+        return Decimal(0)
+    return qty if isinstance(qty, Decimal) else Decimal(str(qty))
+
+
+def plain_qty(qty):
+    """Decimal total back to an int (or float) for JSON, like the procedure's Qty column."""
+    return int(qty) if qty == qty.to_integral_value() else float(qty)
+
+
+class StationSummary:
+    """Per-station item quantity totals keyed by i_code, maintained incrementally.
+
+    update() is fed each new ticket list for the station; only tickets that
+    appeared, changed or left since the previous list touch the totals, so the
+    summary always matches the tickets it is sent with. Like USP_Get_KDS_Summary
+    it counts items that are not cancelled and not yet delivered, so an item
+    changing status to Delivered leaves the totals.
+
+    Totals are exact (Decimal) and kept even when they reach zero or below, so
+    void/return lines with negative quantities give the same result in any
+    order; rows() leaves out the items whose total is not positive.
+    """
+
+    def __init__(self):
+        self._tickets = {}        # kot_no -> ticket last counted
+        self._totals = {}         # i_code -> [name, Decimal qty, counted lines]
+        self._lock = Lock()
+
+    @staticmethod
+    def counted(ticket):
+        """Items of `ticket` that belong in the summary."""
+        if ticket.get("Cancelled"):
+            return []
+        return [item for item in ticket.get("items", []) if item.get("status") != "Delivered"]
+
+    def _apply(self, ticket, sign):
+        for item in self.counted(ticket):
+            code = item.get("i_code", "")
+            entry = self._totals.get(code)
+            if entry is None:
+                entry = self._totals[code] = [item.get("name", ""), Decimal(0), 0]
+            entry[1] += sign * exact_qty(item.get("qty"))
+            entry[2] += sign
+            if entry[2] == 0:
+                # No ticket holds the item any more; its exact total is back to zero
+                del self._totals[code]
+
+    def update(self, tickets):
+        with self._lock:
+            new_by_kot = {t["kot_no"]: t for t in tickets}
+            for kot, old in self._tickets.items():
+                new = new_by_kot.get(kot)
+                if new is None or new != old:
+                    self._apply(old, -1)
+            for kot, new in new_by_kot.items():
+                old = self._tickets.get(kot)
+                if old is None or new != old:
+                    self._apply(new, +1)
+            self._tickets = new_by_kot
+            return self.rows()
+
+    def rows(self):
+        # I_Name can be NULL: sort it with the empty names rather than comparing None to str
+        totals = sorted(self._totals.values(), key=lambda entry: (entry[0] or "", entry[1]))
+        return [{"name": name, "qty": plain_qty(qty)} for name, qty, _ in totals if qty > 0]
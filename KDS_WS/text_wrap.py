@@ -0,0 +1,87 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+
+
+class TextWrapper:
+    """Measures and wraps text for one font from cached per-character widths.
+
+    `char_width(ch)` is the expensive measurement (a GDI call); it runs once per
+    distinct character. Wrapped layouts are memoized by (text, width, mode):
+    menus repeat the same item names all night, so most tickets lay out from
+    the cache without measuring anything.
+    """
+
+    def __init__(self, char_width, max_layouts=4096):
+        self._char_width = char_width
+        self._widths = {}                  # ch -> width
+        self._layouts = OrderedDict()      # (text, max_width, mode) -> tuple of lines
+        self._max_layouts = max_layouts
+        self.hits = 0
+        self.misses = 0
+
+    def _widths_of(self, text):
+        widths = self._widths
+        out = []
+        for ch in text:
+            w = widths.get(ch)
+            if w is None:
+                w = widths[ch] = self._char_width(ch)
+            out.append(w)
+        return out
+
+    def width(self, text):
+        return sum(self._widths_of(text))
+
+    def wrap(self, text, max_width, mode="chars"):
+        """Lines of `text` no wider than `max_width`.
+
+        mode "chars" breaks after the longest prefix that fits (leading spaces of
+        the next line dropped); "words" fills lines word by word, and a single
+        word wider than the line keeps a line of its own.
+        """
+        key = (text, max_width, mode)
+        lines = self._layouts.get(key)
+        if lines is not None:
+            self.hits += 1
+            self._layouts.move_to_end(key)
+            return lines
+        self.misses += 1
+        lines = tuple(self._wrap_words(text, max_width) if mode == "words" else self._wrap_chars(text, max_width))
+        self._layouts[key] = lines
+        if len(self._layouts) > self._max_layouts:
+            self._layouts.popitem(last=False)
+        return lines
+
+    def _wrap_chars(self, text, max_width):
+        lines = []
+        while True:
+            # Prefix widths are non-decreasing, so the break point is a binary search
+            prefix = list(accumulate(self._widths_of(text)))
+            if not prefix or prefix[-1] <= max_width:
+                lines.append(text)
+                return lines
+            fit = max(bisect_right(prefix, max_width), 1)
+            lines.append(text[:fit])
+            text = text[fit:].lstrip()
+            if not text:
+                return lines
+
+    def _wrap_words(self, text, max_width):
+        if self.width(text) <= max_width:
+            return [text]
+        space = self.width(" ")
+        lines = []
+        current, current_w = "", 0
+        for word in text.split():
+            word_w = self.width(word)
+            if not current:
+                current, current_w = word, word_w
+            elif current_w + space + word_w <= max_width:
+                current, current_w = f"{current} {word}", current_w + space + word_w
+            else:
+                lines.append(current)
+                current, current_w = word, word_w
+        if current:
+            lines.append(current)
+        return lines
@@ -0,0 +1,174 @@
+import io
+from collections import namedtuple
+
+from text_wrap import TextWrapper
+
+Run = namedtuple("Run", "x y text font")
+
+
+class Layout:
+    """Positioned text runs of one ticket, in device units (dots or pixels).
+
+    A ticket is laid out once against a target's metrics (printable_width,
+    measure, wrap) and then rendered by that target: PrinterContext (GDI),
+    EscPosTarget (raw ESC/POS) or PngTarget (an image, needs Pillow).
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.height = 0
+        self.runs = []
+
+    def text(self, x, y, text, font):
+        self.runs.append(Run(x, y, str(text), font))
+
+    def end(self, y):
+        """Mark the bottom of the ticket (the y after the last line)."""
+        self.height = max(self.height, y)
+
+    def rows(self):
+        """Runs grouped by y, top to bottom, each row left to right."""
+        by_y = {}
+        for run in self.runs:
+            by_y.setdefault(run.y, []).append(run)
+        return [(y, sorted(by_y[y], key=lambda r: r.x)) for y in sorted(by_y)]
+
+
+class _MeasuredTarget:
+    """Metrics from a TextWrapper per font; subclasses provide char_width(font, ch)."""
+
+    def __init__(self, font_specs, printable_width):
+        self.printable_width = printable_width
+        self.wrappers = {name: TextWrapper(lambda ch, font=name: self.char_width(font, ch))
+                         for name in font_specs}
+
+    def measure(self, text, font):
+        return self.wrappers[font].width(text)
+
+    def wrap(self, text, max_width, mode="chars", font=None):
+        return self.wrappers[font].wrap(text, max_width, mode)
+
+
+# ------------------- ESC/POS -------------------
+ESC_INIT = b"\x1b@"
+ESC_CUT = b"\x1dV\x42\x00"         # feed to the cutter and cut
+FONT_A_WIDTH = 12                  # dots per character of the printer's Font A (12x24)
+FONT_A_HEIGHT = 24
+
+
+class EscPosTarget(_MeasuredTarget):
+    """Raw ESC/POS for 80 mm thermal printers (576 dots wide at 203 dpi).
+
+    Each font spec maps to Font A scaled to the nearest whole multiple of its
+    height (1x-8x) and bold for weight >= 700. Runs are placed with absolute
+    horizontal positions (ESC $) and rows are fed by exact dot counts (ESC J),
+    so the layout matches the GDI one without the driver rasterizing a page.
+    """
+
+    def __init__(self, printer_name=None, font_specs=None, printable_width=576, encoding="cp437"):
+        self.printer_name = printer_name
+        self.encoding = encoding
+        self.fonts = {}
+        for name, spec in (font_specs or {}).items():
+            scale = max(1, min(8, round(spec.get("height", FONT_A_HEIGHT) / FONT_A_HEIGHT)))
+            self.fonts[name] = (scale, spec.get("weight", 400) >= 700)
+        super().__init__(self.fonts, printable_width)
+
+    def char_width(self, font, ch):
+        return FONT_A_WIDTH * self.fonts[font][0]
+
+    def encode(self, layout, cut=True):
+        out = bytearray(ESC_INIT)
+        style = None
+        rows = layout.rows()
+        for i, (y, runs) in enumerate(rows):
+            for run in runs:
+                scale, bold = self.fonts[run.font]
+                x = max(0, int(run.x))
+                # Clip to the print head like GDI does; the printer would wrap the rest onto a new line
+                text = run.text[:max(0, (self.printable_width - x) // (FONT_A_WIDTH * scale))]
+                if not text:
+                    continue
+                if run.font != style:
+                    out += b"\x1d!" + bytes([(scale - 1) << 4 | (scale - 1)])   # GS ! size
+                    out += b"\x1bE" + (b"\x01" if bold else b"\x00")          # ESC E bold
+                    style = run.font
+                out += b"\x1b$" + bytes([x & 0xFF, x >> 8 & 0xFF])            # ESC $ position
+                out += text.encode(self.encoding, "replace")
+            next_y = rows[i + 1][0] if i + 1 < len(rows) else max(layout.height, y + FONT_A_HEIGHT)
+            feed = max(int(next_y - y), 0)
+            out += b"\x1bJ" + bytes([min(feed, 255)])                         # ESC J print and feed
+            feed -= 255
+            while feed > 0:
+                out += b"\x1bJ" + bytes([min(feed, 255)])
+                feed -= 255
+        if cut:
+            out += b"\n\n\n" + ESC_CUT
+        return bytes(out)
+
+    def render(self, layout, title="KOT Ticket"):
+        """Send the ticket to the printer as one RAW job."""
+        import win32print
+
+        data = self.encode(layout)
+        handle = win32print.OpenPrinter(self.printer_name)
+        try:
+            win32print.StartDocPrinter(handle, 1, (title, None, "RAW"))
+            try:
+                win32print.StartPagePrinter(handle)
+                win32print.WritePrinter(handle, data)
+                win32print.EndPagePrinter(handle)
+            finally:
+                win32print.EndDocPrinter(handle)
+        finally:
+            win32print.ClosePrinter(handle)
+
+    def close(self):
+        pass
+
+
+# ------------------- PNG -------------------
+PNG_FONT_FILES = {
+    False: ["consola.ttf", "DejaVuSansMono.ttf", "LiberationMono-Regular.ttf"],
+    True: ["consolab.ttf", "DejaVuSansMono-Bold.ttf", "LiberationMono-Bold.ttf"],
+}
+
+
+class PngTarget(_MeasuredTarget):
+    """Renders a Layout to a grayscale PNG (Pillow is only needed for this target)."""
+
+    def __init__(self, font_specs, printable_width=576):
+        from PIL import ImageFont
+
+        self.fonts = {}
+        for name, spec in font_specs.items():
+            size = spec.get("height", FONT_A_HEIGHT)
+            self.fonts[name] = self._load_font(ImageFont, size, spec.get("weight", 400) >= 700)
+        super().__init__(self.fonts, printable_width)
+
+    @staticmethod
+    def _load_font(ImageFont, size, bold):
+        for path in PNG_FONT_FILES[bold]:
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+        return ImageFont.load_default(size)
+
+    def char_width(self, font, ch):
+        return round(self.fonts[font].getlength(ch))
+
+    def render(self, layout, title=None):
+        """PNG bytes of the ticket."""
+        from PIL import Image, ImageDraw
+
+        image = Image.new("L", (layout.width, max(int(layout.height), 1)), 255)
+        draw = ImageDraw.Draw(image)
+        for run in layout.runs:
+            draw.text((run.x, run.y), run.text, fill=0, font=self.fonts[run.font])
+        out = io.BytesIO()
+        image.save(out, format="PNG")
+        return out.getvalue()
+
+    def close(self):
+        pass
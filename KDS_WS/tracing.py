@@ -0,0 +1,90 @@
+import itertools
+import time
+from collections import deque
+from threading import Lock
+
+
+class Trace:
+    """Timestamps of one change (a trigger batch or a tap) on its way to the screens.
+
+    mark() only appends to a list, so it is safe from any thread without a lock.
+    """
+
+    __slots__ = ("id", "source", "kot_nos", "started", "_t0", "stages")
+
+    MAX_STAGES = 500              # per-client sends on a busy trace stop here
+
+    def __init__(self, trace_id, source, kot_nos, at=None):
+        self.id = trace_id
+        self.source = source
+        self.kot_nos = sorted({str(k) for k in kot_nos})
+        now = time.perf_counter()
+        self._t0 = now if at is None else at      # perf_counter() the change was first seen
+        self.started = time.time() - (now - self._t0)
+        self.stages = []
+
+    def mark(self, stage, detail="", at=None):
+        if len(self.stages) < self.MAX_STAGES:
+            at = time.perf_counter() if at is None else at
+            self.stages.append((stage, at - self._t0, detail))
+
+    def has(self, stage):
+        return any(s[0] == stage for s in self.stages)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "source": self.source,
+            "kot_nos": self.kot_nos,
+            "started": self.started,
+            "stages": [{"stage": s, "ms": round(t * 1000, 3), "detail": d} for s, t, d in list(self.stages)],
+        }
+
+
+class TraceBuffer:
+    """Ring buffer of recent traces, plus which cache version each trace produced.
+
+    A screen is told about a change through station versions (snapshot/delta), so
+    traces are attached to (screen, station, version); encode, send and client
+    acknowledgements are then marked on every trace behind the version sent.
+    """
+
+    def __init__(self, max_traces=2000, max_age=900, versions_per_station=64):
+        self.max_age = max_age
+        self._traces = deque(maxlen=max_traces)
+        self._versions = {}       # (screen, station) -> deque of (version, trace)
+        self._versions_per_station = versions_per_station
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+
+    def start(self, source, kot_nos=(), at=None):
+        trace = Trace(f"{int(time.time())}-{next(self._ids)}", source, kot_nos, at)
+        with self._lock:
+            self._traces.append(trace)
+        return trace
+
+    def attach(self, screen, station, version, trace):
+        """Record that `trace`'s change is in `station`'s cache as of `version`."""
+        trace.mark("cached", f"{screen} {station} v{version}")
+        key = (screen, station)
+        with self._lock:
+            versions = self._versions.get(key)
+            if versions is None:
+                versions = self._versions[key] = deque(maxlen=self._versions_per_station)
+            versions.append((version, trace))
+
+    def traces_between(self, screen, station, after, upto):
+        """Traces attached to versions in (after, upto]; `after` None means any up to `upto`."""
+        versions = self._versions.get((screen, station))
+        if not versions:
+            return []
+        return [trace for version, trace in list(versions)
+                if version <= upto and (after is None or version > after)]
+
+    def recent(self, seconds=None, kot_no=None):
+        cutoff = time.time() - (self.max_age if seconds is None else seconds)
+        with self._lock:
+            traces = list(self._traces)
+        kot_no = None if kot_no is None else str(kot_no)
+        return [t.to_dict() for t in traces
+                if t.started >= cutoff and (kot_no is None or kot_no in t.kot_nos)]
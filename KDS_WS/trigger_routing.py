@@ -0,0 +1,138 @@
+import json
+import re
+import xml.etree.ElementTree as ET
+
+# Column names the KDS trigger may use, compared case-insensitively
+KOT_FIELDS = {"kot_no", "kotno", "kot"}
+BILL_FIELDS = {"billno", "bill_no", "bill"}
+ITEM_FIELDS = {"i_code", "icode", "item_code"}
+
+
+class TriggerChange:
+    """KOT numbers, bill numbers and item codes touched by one or more trigger messages."""
+
+    __slots__ = ("kot_nos", "bill_nos", "i_codes")
+
+    def __init__(self):
+        self.kot_nos = set()
+        self.bill_nos = set()
+        self.i_codes = set()
+
+    def add(self, field, value):
+        if value is None or value == "":
+            return
+        name = field.lower()
+        if name in KOT_FIELDS:
+            self.kot_nos.add(str(value))
+        elif name in BILL_FIELDS:
+            self.bill_nos.add(str(value))
+        elif name in ITEM_FIELDS:
+            self.i_codes.add(str(value))
+
+    def merge(self, other):
+        self.kot_nos |= other.kot_nos
+        self.bill_nos |= other.bill_nos
+        self.i_codes |= other.i_codes
+
+    def __bool__(self):
+        return bool(self.kot_nos or self.i_codes)
+
+    def __repr__(self):
+        return f"TriggerChange(kot={sorted(self.kot_nos)}, bill={sorted(self.bill_nos)}, items={sorted(self.i_codes)})"
+
+
+# ------------------- Parsing -------------------
+def _from_json(body):
+    data = json.loads(body)
+    rows = data if isinstance(data, list) else [data]
+    change = TriggerChange()
+    for row in rows:
+        if isinstance(row, dict):
+            for field, value in row.items():
+                change.add(field, value)
+    return change
+
+
+def _from_xml(body):
+    # FOR XML output may be a bare fragment of <row .../> elements
+    root = ET.fromstring(f"<msg>{body}</msg>")
+    change = TriggerChange()
+    for el in root.iter():
+        for field, value in el.attrib.items():
+            change.add(field, value)
+        if len(el) == 0 and el.text:
+            change.add(el.tag, el.text.strip())
+    return change
+
+
+_PAIR = re.compile(r"(\w+)\s*[=:]\s*([^;,&\s]+)")
+
+
+def _from_pairs(body):
+    change = TriggerChange()
+    for field, value in _PAIR.findall(body):
+        change.add(field, value)
+    return change
+
+
+def parse_trigger_message(body):
+    """Parse a KDS_TriggerMessage body (JSON, FOR XML, or KEY=value pairs).
+
+    Returns None when the body says nothing usable; the caller then refreshes everything.
+    """
+    if not body:
+        return None
+    body = body.strip()
+    try:
+        if body[0] in "[{":
+            change = _from_json(body)
+        elif body[0] == "<":
+            change = _from_xml(body)
+        else:
+            change = _from_pairs(body)
+    except (ValueError, ET.ParseError):
+        return None
+    return change or None
+
+
+# ------------------- Station Routing -------------------
+class StationIndex:
+    """Learned i_code -> stations map, built from what each station has displayed.
+
+    Used to route a trigger to the stations that show its items. Keep one index
+    per screen type: main and KDS_DEL stations show different items. A trigger
+    is unknown (None, refresh everything) when it names an item code no station
+    has shown yet, or a KOT no station holds yet (a new order could go anywhere).
+    """
+
+    def __init__(self):
+        self.item_stations = {}
+
+    def reset(self):
+        self.item_stations = {}
+
+    def learn(self, station_tickets):
+        for kds_name, tickets in station_tickets.items():
+            for ticket in tickets:
+                for item in ticket.get("items", []):
+                    self.item_stations.setdefault(str(item.get("i_code", "")), set()).add(kds_name)
+
+    def stations_for(self, change, station_tickets):
+        """Stations in `station_tickets` affected by `change`, or None if that cannot be told."""
+        self.learn(station_tickets)
+        affected = set()
+        held = set()
+        for kds_name, tickets in station_tickets.items():
+            for ticket in tickets:
+                kot_no = str(ticket.get("kot_no"))
+                if kot_no in change.kot_nos:
+                    affected.add(kds_name)
+                    held.add(kot_no)
+        if change.kot_nos - held:
+            return None
+        for code in change.i_codes:
+            stations = self.item_stations.get(code)
+            if stations is None:
+                return None
+            affected |= stations & station_tickets.keys()
+        return affected